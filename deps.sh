@@ -1,6 +1,6 @@
 #! /bin/bash
 
-conda install -c conda-forge biopandas rdkit
+conda install -c conda-forge biopandas rdkit scipy
 
 conda install black isort flake8
 
@@ -0,0 +1,300 @@
+use std::{
+    collections::HashMap,
+    f64::consts::PI,
+    sync::{Arc, RwLock},
+};
+
+use ndarray::{Array, ArrayBase, ArrayView2, Dim, OwnedRepr};
+use once_cell::sync::OnceCell;
+use rayon::prelude::*;
+
+use crate::{config::get_vdw_vec, neighbor::CellList, surface::dotsphere};
+
+/// 立方体贴图每个面上每个方向的格子数
+const GRID: usize = 24;
+
+/// cos 阈值在[-1, 1]内的等分数
+const LEVELS: usize = 64;
+
+/// 缓存不同均分点数对应的遮挡表
+static TABLES: OnceCell<RwLock<HashMap<usize, Arc<OcclusionTable>>>> = OnceCell::new();
+
+///
+/// 单位球均分点的遮挡表
+///
+/// 原子`i`(半径`ri`)上的点`s`被距离为`d`, 方向为`u`的原子`j`(半径`rj`)遮挡, 当且仅当
+/// `s·u > (ri² + d² - rj²) / (2 * ri * d)`, 即被遮挡的点是以`u`为中心的一个球冠.
+/// 把方向`u`用立方体贴图量化, 阈值等分量化, 预先算出每个(方向, 阈值)下被遮挡点的bitmask,
+/// 计算时只需查表并按位或
+///
+pub struct OcclusionTable {
+    pub n: usize,
+    pub words: usize,
+    masks: Vec<u64>,
+}
+
+impl OcclusionTable {
+    pub fn new(n: usize) -> Self {
+        let ball = dotsphere(n);
+        let words = (n + 63) / 64;
+
+        let masks = (0..6 * GRID * GRID)
+            .into_par_iter()
+            .map(|k| {
+                let u = Self::direction(k);
+                let cos = (0..n)
+                    .map(|j| ball[[j, 0]] * u[0] + ball[[j, 1]] * u[1] + ball[[j, 2]] * u[2])
+                    .collect::<Vec<f64>>();
+
+                let mut v = vec![0u64; LEVELS * words];
+                for l in 0..LEVELS {
+                    let t = Self::threshold(l);
+                    for (j, c) in cos.iter().enumerate() {
+                        if *c > t {
+                            v[l * words + j / 64] |= 1u64 << (j % 64);
+                        }
+                    }
+                }
+                v
+            })
+            .collect::<Vec<Vec<u64>>>()
+            .concat();
+
+        Self { n, words, masks }
+    }
+
+    /// 第`l`个等分对应的cos阈值
+    #[inline]
+    fn threshold(l: usize) -> f64 {
+        -1. + 2. * l as f64 / (LEVELS - 1) as f64
+    }
+
+    /// 立方体贴图第`k`个格子中心对应的单位方向
+    fn direction(k: usize) -> [f64; 3] {
+        let face = k / (GRID * GRID);
+        let a = ((k / GRID) % GRID) as f64 + 0.5;
+        let b = (k % GRID) as f64 + 0.5;
+        let a = 2. * a / GRID as f64 - 1.;
+        let b = 2. * b / GRID as f64 - 1.;
+
+        let axis = face / 2;
+        let sign = if face % 2 == 0 { 1. } else { -1. };
+
+        let mut u = [0.; 3];
+        u[axis] = sign;
+        u[(axis + 1) % 3] = a;
+        u[(axis + 2) % 3] = b;
+
+        let norm = (u[0].powi(2) + u[1].powi(2) + u[2].powi(2)).sqrt();
+        [u[0] / norm, u[1] / norm, u[2] / norm]
+    }
+
+    /// 方向`u`(不需要归一化)所在立方体贴图格子的序号
+    #[inline]
+    fn direction_index(u: &[f64; 3]) -> usize {
+        let mut axis = 0;
+        for k in 1..3 {
+            if u[k].abs() > u[axis].abs() {
+                axis = k;
+            }
+        }
+        let face = 2 * axis + if u[axis] >= 0. { 0 } else { 1 };
+        let m = u[axis].abs();
+
+        let cell = |x: f64| (((x / m + 1.) / 2. * GRID as f64) as usize).min(GRID - 1);
+        let a = cell(u[(axis + 1) % 3]);
+        let b = cell(u[(axis + 2) % 3]);
+        (face * GRID + a) * GRID + b
+    }
+
+    ///
+    /// 方向为`u`, 阈值为`t`的球冠中被遮挡点的bitmask
+    ///
+    #[inline]
+    pub fn mask(&self, u: &[f64; 3], t: f64) -> &[u64] {
+        let l = ((t + 1.) / 2. * (LEVELS - 1) as f64).round().max(0.) as usize;
+        let start = (Self::direction_index(u) * LEVELS + l.min(LEVELS - 1)) * self.words;
+        &self.masks[start..start + self.words]
+    }
+}
+
+///
+/// 获取`n`个均分点对应的遮挡表, 第一次使用时生成并缓存
+///
+pub fn occlusion_table(n: usize) -> Arc<OcclusionTable> {
+    let tables = TABLES.get_or_init(|| RwLock::new(HashMap::new()));
+
+    if let Some(t) = tables.read().unwrap().get(&n) {
+        return t.clone();
+    }
+
+    let t = Arc::new(OcclusionTable::new(n));
+    tables.write().unwrap().insert(n, t.clone());
+    t
+}
+
+///
+/// 用查表的方式计算每个原子被遮挡点的bitmask
+/// * `coors` : 原子坐标集合
+/// * `radis_v` : 原子半径集合
+/// * `n` : 球均分点数
+/// * `pr` : 补充半径
+///
+fn occlusion_core(
+    coors: &ArrayView2<'_, f64>,
+    radis_v: &Vec<f64>,
+    n: usize,
+    pr: f64,
+) -> (Arc<OcclusionTable>, Vec<Vec<u64>>) {
+    let table = occlusion_table(n);
+
+    let max_r = radis_v.iter().cloned().fold(0f64, f64::max) + pr;
+    let cells = CellList::new(coors, 2. * max_r);
+
+    let masks = (0..coors.nrows())
+        .into_par_iter()
+        .map(|i| {
+            let c = [coors[[i, 0]], coors[[i, 1]], coors[[i, 2]]];
+            let ri = radis_v[i] + pr;
+            let mut occ = vec![0u64; table.words];
+
+            for (j, d2) in cells.within(coors, &c, (ri + max_r).powi(2)) {
+                let rj = radis_v[j] + pr;
+                if j == i || d2 >= (ri + rj).powi(2) {
+                    continue;
+                }
+
+                let d = d2.sqrt();
+                let u = [coors[[j, 0]] - c[0], coors[[j, 1]] - c[1], coors[[j, 2]] - c[2]];
+
+                // 原子i完全在原子j内部
+                if d + ri <= rj {
+                    occ.iter_mut().for_each(|f| *f = u64::MAX);
+                    break;
+                }
+                // 原子j完全在原子i内部, 或者两原子重合
+                if d + rj <= ri || d < 1e-9 {
+                    continue;
+                }
+
+                let t = (ri * ri + d2 - rj * rj) / (2. * ri * d);
+                for (o, m) in occ.iter_mut().zip(table.mask(&u, t)) {
+                    *o |= *m;
+                }
+            }
+
+            // 去掉最后一个word中多余的位
+            if n % 64 != 0 {
+                let last = occ.len() - 1;
+                occ[last] &= (1u64 << (n % 64)) - 1;
+            }
+            occ
+        })
+        .collect::<Vec<_>>();
+
+    (table, masks)
+}
+
+///
+/// 用bitmask查表的方式计算每个原子的sasa, 结果为近似值
+/// * `coors` : 原子坐标集合
+/// * `elements` : 原子名称列表
+/// * `n` : 球均分点数
+/// * `pr` : 补充半径
+///
+/// 返回`(m, 2)`矩阵, 第一列为原子球上留存点的百分比, 第二列为面积(Å²), 与`per_atom_sasa`相同
+///
+pub fn per_atom_sasa_bitmask(
+    coors: &ArrayView2<'_, f64>,
+    elements: Option<&Vec<&str>>,
+    n: usize,
+    pr: f64,
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    let mut radis_v = vec![0.; coors.nrows()];
+    get_vdw_vec(elements, &mut radis_v);
+
+    let (_, masks) = occlusion_core(coors, &radis_v, n, pr);
+
+    Array::from_shape_fn((radis_v.len(), 2), |(i, j)| {
+        let hidden = masks[i].iter().map(|f| f.count_ones()).sum::<u32>();
+        let percent = (n - hidden as usize) as f64 / n as f64;
+        if j == 0 {
+            percent
+        } else {
+            4. * PI * (radis_v[i] + pr).powi(2) * percent
+        }
+    })
+}
+
+///
+/// 用bitmask查表的方式求sa平面点集合, 结果为近似值
+/// * `coors` : 原子坐标集合
+/// * `elements` : 原子名称列表
+/// * `n` : 球均分点数
+/// * `pr` : 补充半径
+/// * `index`: 返回矩阵是否包含index
+///
+pub fn sa_surface_bitmask(
+    coors: &ArrayView2<'_, f64>,
+    elements: Option<&Vec<&str>>,
+    n: usize,
+    pr: f64,
+    index: bool,
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    let mut radis_v = vec![0.; coors.nrows()];
+    get_vdw_vec(elements, &mut radis_v);
+
+    let (_, masks) = occlusion_core(coors, &radis_v, n, pr);
+    let ball = dotsphere(n);
+    let col = if index { 4 } else { 3 };
+
+    let mut v = Vec::<f64>::new();
+    for (i, occ) in masks.iter().enumerate() {
+        let r = radis_v[i] + pr;
+        for j in (0..n).filter(|j| (occ[j / 64] & (1u64 << (j % 64))) == 0) {
+            for k in 0..3 {
+                v.push(ball[[j, k]] * r + coors[[i, k]]);
+            }
+            if index {
+                v.push(i as f64);
+            }
+        }
+    }
+
+    Array::from_shape_vec((v.len() / col, col), v).unwrap()
+}
+
+#[cfg(test)]
+mod tests {
+    use ndarray::array;
+
+    use super::*;
+    use crate::surface::per_atom_sasa;
+
+    #[test]
+    fn test_direction_index() {
+        for k in [0, 17, GRID * GRID + 3, 6 * GRID * GRID - 1].iter() {
+            let u = OcclusionTable::direction(*k);
+            assert_eq!(OcclusionTable::direction_index(&u), *k);
+        }
+    }
+
+    #[test]
+    fn test_per_atom_sasa_bitmask() {
+        let a = array![[0., 0., 0.], [0., 0., 1.7], [0., 0., 10.7], [3., 2., 4.]];
+        let b = vec!["C", "O", "CD1", "N"];
+        let n = 200;
+
+        let exact = per_atom_sasa(&a.view(), Some(&b), n, 1.4);
+        let s = per_atom_sasa_bitmask(&a.view(), Some(&b), n, 1.4);
+
+        for i in 0..a.nrows() {
+            // 量化误差只影响球冠边缘的少量点
+            assert!((exact[[i, 0]] - s[[i, 0]]).abs() < 0.05);
+        }
+
+        let d = sa_surface_bitmask(&a.view(), Some(&b), n, 1.4, true);
+        let total = s.column(0).sum() * n as f64;
+        assert_eq!(total.round() as usize, d.nrows());
+    }
+}
@@ -0,0 +1,157 @@
+use ndarray::{Array1, ArrayView2};
+use rayon::prelude::*;
+
+use crate::{config::get_vdw_vec, surface::dotsphere};
+
+///
+/// 原子vdw球占据的格点
+///
+/// 格点范围与python版`gen_grid`相同, 再每个方向向外扩展`max(vdw) / spacing + 1`个格点
+///
+struct Occupancy {
+    origin: [f64; 3],
+    spacing: f64,
+    shape: [usize; 3],
+    occupied: Vec<bool>,
+}
+
+impl Occupancy {
+    fn new(coors: &ArrayView2<'_, f64>, radis_v: &[f64], spacing: f64) -> Self {
+        let max_r = radis_v.iter().cloned().fold(0f64, f64::max);
+        let k = (max_r / spacing).ceil() + 1.;
+
+        let mut origin = [0.; 3];
+        let mut shape = [0usize; 3];
+        for i in 0..3 {
+            let lo = coors.column(i).fold(f64::MAX, |a, b| a.min(*b)).trunc();
+            let hi = coors.column(i).fold(f64::MIN, |a, b| a.max(*b)).trunc();
+            origin[i] = lo - k * spacing;
+            shape[i] = ((hi + 1. - lo) / spacing).ceil() as usize + 2 * k as usize;
+        }
+
+        let mut occupied = vec![false; shape[0] * shape[1] * shape[2]];
+        for (a, r) in radis_v.iter().enumerate() {
+            let c = [coors[[a, 0]], coors[[a, 1]], coors[[a, 2]]];
+            let mut lo = [0usize; 3];
+            let mut hi = [0usize; 3];
+            for i in 0..3 {
+                let base = ((c[i] - origin[i]) / spacing).floor();
+                lo[i] = (base - k).max(0.) as usize;
+                hi[i] = ((base + k) as usize).min(shape[i] - 1);
+            }
+
+            for x in lo[0]..=hi[0] {
+                for y in lo[1]..=hi[1] {
+                    for z in lo[2]..=hi[2] {
+                        let d = (origin[0] + x as f64 * spacing - c[0]).powi(2)
+                            + (origin[1] + y as f64 * spacing - c[1]).powi(2)
+                            + (origin[2] + z as f64 * spacing - c[2]).powi(2);
+                        if d < r * r {
+                            occupied[(x * shape[1] + y) * shape[2] + z] = true;
+                        }
+                    }
+                }
+            }
+        }
+
+        Self {
+            origin,
+            spacing,
+            shape,
+            occupied,
+        }
+    }
+
+    /// 点`p`所在(最近)的格点是否被占据, 超出范围时为false
+    #[inline]
+    fn is_occupied(&self, p: &[f64; 3]) -> bool {
+        let mut idx = [0usize; 3];
+        for i in 0..3 {
+            let v = ((p[i] - self.origin[i]) / self.spacing + 0.5).floor();
+            if v < 0. || v >= self.shape[i] as f64 {
+                return false;
+            }
+            idx[i] = v as usize;
+        }
+        self.occupied[(idx[0] * self.shape[1] + idx[1]) * self.shape[2] + idx[2]]
+    }
+}
+
+///
+/// 计算格点的埋藏度: 从每个格点沿`dotsphere(n)`的方向发射射线,
+/// 以`spacing / 2`为步长前进`max_d`, 经过原子占据的格点即为被遮挡, 返回被遮挡射线的比例
+///
+/// * `coors` : 原子坐标集合
+/// * `elements` : 原子名称列表
+/// * `grid` : 格点集合, 只使用前三列
+/// * `n` : 射线数
+/// * `max_d` : 射线长度
+/// * `spacing` : 原子占据格点的间距
+///
+pub fn buriedness(
+    coors: &ArrayView2<'_, f64>,
+    elements: Option<&Vec<&str>>,
+    grid: &ArrayView2<'_, f64>,
+    n: usize,
+    max_d: f64,
+    spacing: f64,
+) -> Array1<f64> {
+    let mut radis_v = vec![0.; coors.nrows()];
+    get_vdw_vec(elements, &mut radis_v);
+
+    let occupancy = Occupancy::new(coors, &radis_v, spacing);
+    let rays = dotsphere(n);
+    let step = spacing / 2.;
+    let steps = (max_d / step).floor() as usize;
+
+    let v = (0..grid.nrows())
+        .into_par_iter()
+        .map(|i| {
+            let p = [grid[[i, 0]], grid[[i, 1]], grid[[i, 2]]];
+            let blocked = (0..n)
+                .filter(|j| {
+                    (1..=steps).any(|s| {
+                        let t = step * s as f64;
+                        occupancy.is_occupied(&[
+                            p[0] + t * rays[[*j, 0]],
+                            p[1] + t * rays[[*j, 1]],
+                            p[2] + t * rays[[*j, 2]],
+                        ])
+                    })
+                })
+                .count();
+            blocked as f64 / n as f64
+        })
+        .collect::<Vec<f64>>();
+
+    Array1::from(v)
+}
+
+#[cfg(test)]
+mod tests {
+    use ndarray::array;
+
+    use super::*;
+
+    #[test]
+    fn test_buriedness() {
+        crate::config::init_config();
+
+        // 一圈原子围住中心点, 只有z方向开口
+        let mut v = vec![];
+        for i in 0..24 {
+            let a = i as f64 * std::f64::consts::PI / 12.;
+            for z in [-3., 0., 3.].iter() {
+                v.extend_from_slice(&[6. * a.cos(), 6. * a.sin(), *z]);
+            }
+        }
+        let coors = ndarray::Array::from_shape_vec((v.len() / 3, 3), v).unwrap();
+        let elements = vec!["C"; coors.nrows()];
+
+        let grid = array![[0., 0., 0.], [30., 30., 30.]];
+        let b = buriedness(&coors.view(), Some(&elements), &grid.view(), 60, 20., 1.);
+
+        assert!(b[0] > 0.3 && b[0] < 1.);
+        assert_eq!(b[1], 0.);
+    }
+}
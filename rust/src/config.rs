@@ -6,13 +6,16 @@
  * @Description: In User Settings Edit
  * @FilePath: /rust/src/config.rs
  */
-use std::{collections::HashMap, sync::Mutex};
+use std::{
+    collections::HashMap,
+    sync::{Mutex, Once},
+};
 
 use log::warn;
 use once_cell::sync::Lazy;
 use rayon::iter::{IndexedParallelIterator, IntoParallelRefMutIterator, ParallelIterator};
 
-const VDW_RADII: Lazy<Mutex<HashMap<&str, f64>>> = Lazy::new(|| {
+static VDW_RADII: Lazy<Mutex<HashMap<&str, f64>>> = Lazy::new(|| {
     let m = [
         ("C", 1.7),
         ("CA", 1.7),
@@ -70,7 +73,7 @@ const VDW_RADII: Lazy<Mutex<HashMap<&str, f64>>> = Lazy::new(|| {
 });
 
 /// 残基_原子 ==> 疏水性
-const ATOMS_HYDROPHOBICITY: Lazy<Mutex<HashMap<&str, i32>>> = Lazy::new(|| {
+static ATOMS_HYDROPHOBICITY: Lazy<Mutex<HashMap<&str, i32>>> = Lazy::new(|| {
     let m = [
         ("ALA_C", 12),
         ("ALA_CA", 12),
@@ -364,12 +367,17 @@ pub fn get_hdp_vec(elements: Option<&Vec<&str>>, resns: &Vec<&str>, hdp_v: &mut
     });
 }
 
+static LOG_INIT: Once = Once::new();
+
+/// 初始化日志, 每个进程只执行一次
 pub fn init_config() {
-    let r = log4rs::init_file("config/log4rs.yaml", Default::default());
+    LOG_INIT.call_once(|| {
+        let r = log4rs::init_file("config/log4rs.yaml", Default::default());
 
-    if r.is_err() {
-        let _ = log4rs::init_file("rust/config/log4rs.yaml", Default::default());
-    }
+        if r.is_err() {
+            let _ = log4rs::init_file("rust/config/log4rs.yaml", Default::default());
+        }
+    });
 }
 
 mod tests {
@@ -1,6 +1,7 @@
 use std::f64::consts::PI;
 
-use ndarray::{ArrayView1, ArrayView2, Axis};
+use ndarray::{Array1, ArrayView1, ArrayView2, Axis};
+use rayon::iter::{IntoParallelIterator, ParallelIterator};
 
 pub fn cal_electro(grid: ArrayView1<'_, f64>, atoms: ArrayView2<'_, f64>, n: usize) -> f64 {
     let (s1, s2) = atoms.view().split_at(Axis(1), 3);
@@ -10,6 +11,38 @@ pub fn cal_electro(grid: ArrayView1<'_, f64>, atoms: ArrayView2<'_, f64>, n: usi
     (1. / (4. * PI * (n as f64))) * a
 }
 
+///
+/// 所有格点的静电势, 每个格点与`cal_electro`相同, 并行计算
+/// * `grids`: 格点集合, 只使用前三列
+/// * `atoms`: 带电原子, 前三列为坐标, 第四列为电荷
+/// * `n`: 介质的介电常数
+///
+pub fn cal_electro_grid(
+    grids: ArrayView2<'_, f64>,
+    atoms: ArrayView2<'_, f64>,
+    n: usize,
+) -> Array1<f64> {
+    let k = 1. / (4. * PI * (n as f64));
+    let v = (0..grids.nrows())
+        .into_par_iter()
+        .map(|i| {
+            let a = atoms
+                .outer_iter()
+                .map(|atom| {
+                    let d = ((atom[0] - grids[[i, 0]]).powi(2)
+                        + (atom[1] - grids[[i, 1]]).powi(2)
+                        + (atom[2] - grids[[i, 2]]).powi(2))
+                    .sqrt();
+                    d * atom[3]
+                })
+                .sum::<f64>();
+            k * a
+        })
+        .collect::<Vec<f64>>();
+
+    Array1::from(v)
+}
+
 #[cfg(test)]
 mod tests {
     #[test]
@@ -20,4 +53,19 @@ mod tests {
         super::cal_electro(grid.view(), a.view(), 4);
         assert_eq!(2 + 2, 4);
     }
+
+    #[test]
+    fn test_cal_electro_grid() {
+        let grids = ndarray::array![[9., 68., 44.], [1., 2., 3.], [-4., 20., 7.5]];
+        let a = ndarray::array![
+            [5.8, 7.7, 3.75, -0.5],
+            [11.5, 86.9, 31.9, -0.5],
+            [0., 1., 2., 1.]
+        ];
+
+        let v = super::cal_electro_grid(grids.view(), a.view(), 4);
+        for (i, grid) in grids.outer_iter().enumerate() {
+            assert!((v[i] - super::cal_electro(grid, a.view(), 4)).abs() < 1e-9);
+        }
+    }
 }
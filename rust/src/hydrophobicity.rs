@@ -1,14 +1,12 @@
-use std::{collections::HashMap, f64::consts::PI, sync::Mutex};
-
 use log::info;
-use ndarray::{concatenate, Array, ArrayView1, ArrayView2, Axis};
-use rayon::iter::{IntoParallelIterator, ParallelIterator};
+use ndarray::{concatenate, Array, ArrayView2, Axis};
+use rayon::iter::{IntoParallelIterator, IntoParallelRefIterator, ParallelIterator};
 
 use crate::{
     config::get_hdp_vec,
+    neighbor::CellList,
     pocket::find_layer_core,
     surface::{Protein, DEFAULT_PTR},
-    utils::distance,
 };
 
 ///
@@ -18,6 +16,10 @@ use crate::{
 /// * `resns`: 原子对应的残基列表
 /// * `n`: 均等分点数
 /// * `pr` : 辅助半径
+/// * `density`: 点密度(每Å²的点数), 设置后代替`n`, 见`Protein::with_density`
+/// * `tol`: 设置时为近似模式, 允许的疏水性绝对误差, 见`select_kernel`
+///
+/// 返回格点及疏水性, 以及近似模式下的`(截断距离, 抽样估计的最大误差)`
 ///
 pub fn run_hydrophobicity(
     coors: &ArrayView2<'_, f64>,
@@ -25,121 +27,285 @@ pub fn run_hydrophobicity(
     resns: &Vec<&str>,
     n: usize,
     pr: f64,
-) -> ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>> {
-    let mut protein = Protein::new(coors.clone(), elements, n);
+    density: Option<f64>,
+    tol: Option<f64>,
+) -> (
+    ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>>,
+    Option<(f64, f64)>,
+) {
+    let mut protein = Protein::with_density(coors.clone(), elements, n, density);
 
     // atom_resn ==> hdp
     let mut hdp_v = vec![0.; coors.len()];
     get_hdp_vec(elements, resns, &mut hdp_v);
 
-    let layer_grid = find_layer_core(&mut protein, pr);
+    hydrophobicity_core(&mut protein, &hdp_v, pr, tol)
+}
+
+///
+/// 计算蛋白质疏水性, `protein`中已缓存的sa平面直接使用
+/// * `protein`: 蛋白质对象
+/// * `hdp_v`: 原子+残基对疏水性的影响值, 见`get_hdp_vec`
+/// * `pr` : 辅助半径
+/// * `tol`: 设置时为近似模式, 允许的疏水性绝对误差, 见`select_kernel`
+///
+/// 返回值同`run_hydrophobicity`
+///
+pub fn hydrophobicity_core(
+    protein: &mut Protein,
+    hdp_v: &Vec<f64>,
+    pr: f64,
+    tol: Option<f64>,
+) -> (
+    ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>>,
+    Option<(f64, f64)>,
+) {
+    let layer_grid = find_layer_core(protein, pr);
 
-    let sa = protein.get_index_map_by_ptr(DEFAULT_PTR);
+    // 每个原子的sasa, 第二列为面积
+    let sa = protein.per_atom_sasa(DEFAULT_PTR);
 
     let (pocket, layer) = layer_grid.view().split_at(Axis(1), 3);
 
     let layer_len = layer_grid.nrows();
 
-    let atom_hdp_v = Mutex::new(vec![0.; layer_len]);
-
-    info!("sa = {:?}, layer_len = {}", sa.len(), layer_len);
+    info!("sa = {:?}, layer_len = {}", sa.nrows(), layer_len);
     let label = layer.column(0).to_vec();
 
+    let coors = &protein.coors.view();
+
+    // exp(-0.7 * (d - r - 1.4)) = exp(0.7 * (r + 1.4)) * exp(-0.7 * d)
+    let weights = (0..coors.nrows())
+        .map(|i| hdp_v[i] * sa[[i, 1]] * (0.7 * (protein.radis_v[i] + DEFAULT_PTR)).exp())
+        .collect::<Vec<f64>>();
+
+    let (kernel, approx) = match tol {
+        Some(tol) => {
+            let (kernel, error) = select_kernel(coors, &pocket, &weights, &label, tol);
+            let cutoff = kernel.r2.sqrt();
+            (kernel, Some((cutoff, error)))
+        }
+        None => (Kernel::exact(), None),
+    };
+
+    // 原子和格点都只需要查找截断距离以内的
+    let atom_cells = CellList::new(coors, kernel.r2.sqrt());
+    let grid_cells = CellList::new(&pocket, kernel.r2.sqrt());
+
     // 计算每一个pocket点的疏水性
-    (0..layer_len).into_par_iter().for_each(|i| {
-        let grid = pocket.row(i);
-        let atom_h = cal_atom_hydro(&grid, coors, &protein.radis_v, &hdp_v, &sa);
-        let water_h = cal_water_hydro(&grid, &pocket.view(), &label);
-        let all = (atom_h + water_h) / 10.;
-        let n = &mut atom_hdp_v.lock().unwrap();
-        n[i] = all;
-    });
+    let v = (0..layer_len)
+        .into_par_iter()
+        .map(|i| {
+            let grid = [pocket[[i, 0]], pocket[[i, 1]], pocket[[i, 2]]];
+            let atom_h = cal_atom_hydro(&grid, coors, &atom_cells, &weights, &kernel);
+            let water_h = cal_water_hydro(&grid, &pocket, &grid_cells, &label, &kernel);
+            (atom_h + water_h) / 10.
+        })
+        .collect::<Vec<f64>>();
 
     info!("done cal hydrophobicity ...");
 
-    let v = atom_hdp_v.lock().unwrap().to_owned();
     let hdp_n = Array::from_shape_vec((layer_len, 1), v).unwrap();
 
-    concatenate![Axis(1), pocket, hdp_n]
+    (concatenate![Axis(1), pocket, hdp_n], approx)
 }
 
 const HPD_I: f64 = 81.01;
 
+/// 近似模式可选的截断距离, 从小到大, 之后为精确的`9i`
+const CUTOFFS: [f64; 9] = [4.5, 5., 5.5, 6., 6.5, 7., 7.5, 8., 8.5];
+
+/// 近似模式可选的查表步长, 从大到小
+const TABLE_STEPS: [f64; 7] = [0.1, 0.05, 0.02, 0.01, 0.005, 0.002, 0.001];
+
+/// 近似模式抽样比较的格点数, 与python版`hydro_cutoff`相同
+const SAMPLES: usize = 1024;
+
+///
+/// `exp(-0.7 d)`的查表近似, 在`[0, 9i]`上等距取点, 线性插值
+/// 相对误差不超过`0.49 * step^2 / 8`
 ///
-/// 根据距离进行`filer`
+struct ExpTable {
+    step: f64,
+    values: Vec<f64>,
+}
+
+impl ExpTable {
+    fn new(step: f64) -> Self {
+        let len = (HPD_I.sqrt() / step).ceil() as usize + 2;
+        let values = (0..len).map(|i| (-0.7 * i as f64 * step).exp()).collect();
+        Self { step, values }
+    }
+
+    #[inline]
+    fn eval(&self, d: f64) -> f64 {
+        let u = d / self.step;
+        let i = u as usize;
+        let f = u - i as f64;
+        self.values[i] * (1. - f) + self.values[i + 1] * f
+    }
+}
+
 ///
-/// 返回(index, dis)
+/// 疏水性使用的`exp(-0.7 d)`核
+/// * `r2`: 截断距离的平方
+/// * `table`: 设置时查表计算, 否则直接计算
 ///
-fn filer_point(a: &ArrayView1<'_, f64>, b: &ArrayView1<'_, f64>, i: usize) -> Option<(usize, f64)> {
-    let sum = distance(a, b);
-    if sum < HPD_I {
-        Some((i, sum.sqrt()))
-    } else {
-        None
+struct Kernel {
+    r2: f64,
+    table: Option<ExpTable>,
+}
+
+impl Kernel {
+    fn exact() -> Self {
+        Self {
+            r2: HPD_I,
+            table: None,
+        }
+    }
+
+    #[inline]
+    fn eval(&self, d: f64) -> f64 {
+        match &self.table {
+            Some(t) => t.eval(d),
+            None => (-0.7 * d).exp(),
+        }
     }
 }
 
 ///
-/// 计算原子对于疏水性的影响
+/// 近似模式: 抽取不超过`SAMPLES`个格点与精确结果比较,
+/// 先选择误差不超过`tol / 2`的最大查表步长, 再将截断距离从大到小逐个比较, 第一次超过`tol`时停止,
+/// 与python版`hydro_cutoff`相同; 查表步长都不满足时使用精确计算.
+/// 返回`(核, 抽样格点上的最大误差)`, 误差只是抽样估计, 未抽到的格点的误差可能更大
+/// * `coors`: 原子集合
+/// * `pocket`: 格点集合
+/// * `weights`: 原子的权重, 见`cal_atom_hydro`
+/// * `label` : 格点对应的`layer`值
+/// * `tol`: 允许的疏水性绝对误差
+///
+fn select_kernel(
+    coors: &ArrayView2<'_, f64>,
+    pocket: &ArrayView2<'_, f64>,
+    weights: &Vec<f64>,
+    label: &Vec<f64>,
+    tol: f64,
+) -> (Kernel, f64) {
+    let atom_cells = CellList::new(coors, HPD_I.sqrt());
+    let grid_cells = CellList::new(pocket, HPD_I.sqrt());
+
+    let step = (pocket.nrows() / SAMPLES).max(1);
+    let samples = (0..pocket.nrows())
+        .step_by(step)
+        .map(|i| [pocket[[i, 0]], pocket[[i, 1]], pocket[[i, 2]]])
+        .collect::<Vec<[f64; 3]>>();
+
+    let scores = |kernel: &Kernel| {
+        samples
+            .par_iter()
+            .map(|p| {
+                (cal_atom_hydro(p, coors, &atom_cells, weights, kernel)
+                    + cal_water_hydro(p, pocket, &grid_cells, label, kernel))
+                    / 10.
+            })
+            .collect::<Vec<f64>>()
+    };
+    let expected = scores(&Kernel::exact());
+    let error = |kernel: &Kernel| {
+        scores(kernel)
+            .iter()
+            .zip(expected.iter())
+            .map(|(a, b)| (a - b).abs())
+            .fold(0f64, f64::max)
+    };
+
+    let mut kernel = Kernel::exact();
+    let mut max_error = 0.;
+    if let Some(s) = TABLE_STEPS.iter().find(|s| {
+        error(&Kernel {
+            r2: HPD_I,
+            table: Some(ExpTable::new(**s)),
+        }) <= tol / 2.
+    }) {
+        kernel.table = Some(ExpTable::new(*s));
+        max_error = error(&kernel);
+        for c in CUTOFFS.iter().rev() {
+            let k = Kernel {
+                r2: c * c,
+                table: Some(ExpTable::new(*s)),
+            };
+            let e = error(&k);
+            if e > tol {
+                break;
+            }
+            kernel = k;
+            max_error = e;
+        }
+    }
+
+    info!(
+        "tol = {}: cutoff = {:.1}, table step = {:?}, max error = {:e}",
+        tol,
+        kernel.r2.sqrt(),
+        kernel.table.as_ref().map(|t| t.step),
+        max_error
+    );
+
+    (kernel, max_error)
+}
+
+///
+/// 计算原子对于疏水性的影响, 为截断距离以内原子的`weights * exp(-0.7 d)`之和
 /// * `grid` : `pocket`格点
 /// * `coors` : 原子集合
-/// * `radis_v`: 原子半径集合
-/// * `hdp_v`: 原子+残基对疏水性的影响值
-/// * `sa_m`: 原子球体上留存的点的百分比字典
+/// * `cells` : 原子集合的`CellList`, 单元格边长不小于截断距离
+/// * `weights`: 原子的权重, 为`hdp * sasa * exp(0.7 * (r + 1.4))`
+/// * `kernel`: `exp(-0.7 d)`核以及截断距离
 ///
 fn cal_atom_hydro(
-    grid: &ArrayView1<'_, f64>,
+    grid: &[f64; 3],
     coors: &ArrayView2<'_, f64>,
-    radis_v: &Vec<f64>,
-    hdp_v: &Vec<f64>,
-    sa_m: &HashMap<usize, f64>,
+    cells: &CellList,
+    weights: &Vec<f64>,
+    kernel: &Kernel,
 ) -> f64 {
-    (0..coors.nrows())
+    cells
+        .within(coors, grid, kernel.r2)
         .into_iter()
-        .filter_map(|f| filer_point(grid, &coors.row(f), f))
-        .map(|v| {
-            let i = v.0;
-            let r = radis_v[i];
-            let hdp = hdp_v[i];
-            let a = 4. * PI * (r + DEFAULT_PTR).powi(2) * sa_m.get(&i).unwrap();
-            let dis = v.1 - r - DEFAULT_PTR;
-            let hydro_atom = hdp * a * (-0.7 * dis).exp();
-            hydro_atom
-        })
+        .map(|(i, d2)| weights[i] * kernel.eval(d2.sqrt()))
         .sum::<f64>()
 }
 
-///                                                                                                                                                                     
-/// 计算水对于个点疏水性的影响值, 方法是`9i`距离内其他点对于格点影响累计
+///
+/// 计算水对于个点疏水性的影响值, 方法是截断距离内其他点对于格点影响累计;
+/// 逐对计算, 没有python版`cal_waters_hydro`的FFT方法
 /// * `grid`: `pocket`格点
 /// * `pocket`: 格点集合
+/// * `cells` : 格点集合的`CellList`, 单元格边长不小于截断距离
 /// * `label` : 格点对应的`layer`值
+/// * `kernel`: `exp(-0.7 d)`核以及截断距离
 ///
 fn cal_water_hydro(
-    grid: &ArrayView1<'_, f64>,
+    grid: &[f64; 3],
     pocket: &ArrayView2<'_, f64>,
+    cells: &CellList,
     label: &Vec<f64>,
+    kernel: &Kernel,
 ) -> f64 {
     let mut f = 0.;
     let mut p = 0.;
 
-    (0..pocket.nrows())
+    cells
+        .within(pocket, grid, kernel.r2)
         .into_iter()
-        .filter_map(|f| filer_point(grid, &pocket.row(f), f))
-        .for_each(|v| {
-            let d = (-0.7 * v.1).exp();
-            let h = label[v.0];
+        .for_each(|(i, d2)| {
+            let d = kernel.eval(d2.sqrt());
+            let h = label[i];
             f += d * h;
             p += d;
         });
 
-    let r = f / p;
-
-    // info!(
-    //     "cal_water_hydro = {:?},     water_h = {}",
-    //     grid, r
-    // );
-    r
+    f / p
 }
 
 #[cfg(test)]
@@ -319,8 +485,34 @@ mod tests {
             (a.len(), b.len(), c.len())
         );
 
-        let grid = run_hydrophobicity(&a.view(), Some(&b), &c, n, 20.);
+        let (grid, exact) = run_hydrophobicity(&a.view(), Some(&b), &c, n, 20., None, None);
+        assert!(exact.is_none());
 
         info!("layer = {:?}", grid);
+
+        let (approx, report) =
+            run_hydrophobicity(&a.view(), Some(&b), &c, n, 20., None, Some(1e-3));
+        assert_eq!(approx.nrows(), grid.nrows());
+        let (cutoff, error) = report.unwrap();
+        assert!(cutoff <= HPD_I.sqrt() && error <= 1e-3);
+
+        // 同一个蛋白质对象, 换辅助半径后再算回来, 结果不变
+        let mut protein = Protein::new(a.view(), Some(&b), n);
+        let mut hdp_v = vec![0.; a.len()];
+        get_hdp_vec(Some(&b), &c, &mut hdp_v);
+        hydrophobicity_core(&mut protein, &hdp_v, 15., None);
+        assert_eq!(hydrophobicity_core(&mut protein, &hdp_v, 20., None).0, grid);
+    }
+
+    #[test]
+    fn test_exp_table() {
+        for step in TABLE_STEPS.iter() {
+            let table = ExpTable::new(*step);
+            for i in 0..900 {
+                let d = i as f64 * 0.01 + 0.003;
+                let e = (-0.7 * d).exp();
+                assert!((table.eval(d) - e).abs() <= 0.49 * step * step / 8. * e * 1.1);
+            }
+        }
     }
 }
@@ -1,21 +1,31 @@
 #![allow(dead_code)]
 
 use numpy::{
-    npyffi::NPY_ARRAY_WRITEABLE, IntoPyArray, PyArray2, PyReadonlyArray1, PyReadonlyArray2,
+    npyffi::NPY_ARRAY_WRITEABLE, IntoPyArray, PyArray1, PyArray2, PyReadonlyArray1,
+    PyReadonlyArray2,
 };
-use pyo3::prelude::{pymodule, PyModule, PyResult, Python};
+use pyo3::prelude::{pymodule, IntoPy, PyModule, PyObject, PyResult, Python};
 
 use crate::{
-    electrostatic::cal_electro,
+    bitmask::{per_atom_sasa_bitmask, sa_surface_bitmask},
+    buriedness::buriedness,
+    electrostatic::{cal_electro, cal_electro_grid},
     hydrophobicity::run_hydrophobicity,
-    pocket::{find_layer, find_pocket},
-    surface::sa_surface,
+    pocket::{find_layer, find_pocket, group_pockets},
+    structure::Structure,
+    surface::{
+        connolly_surface, per_atom_sasa, sa_surface, sa_surface_density, sa_surface_multi,
+    },
 };
 
+mod bitmask;
+mod buriedness;
 mod config;
 mod electrostatic;
 mod hydrophobicity;
+mod neighbor;
 mod pocket;
+mod structure;
 mod surface;
 mod utils;
 
@@ -42,6 +52,16 @@ pub fn sz_py_ext(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
         cal_electro(grid.as_array(), atoms.as_array(), n)
     }
 
+    #[pyfn(m, "cal_electro_grid")]
+    fn cal_electro_grid_py<'py>(
+        py: Python<'py>,
+        grids: PyReadonlyArray2<'_, f64>,
+        atoms: PyReadonlyArray2<'_, f64>,
+        n: usize,
+    ) -> &'py PyArray1<f64> {
+        nparray_return!(cal_electro_grid(grids.as_array(), atoms.as_array(), n).into_pyarray(py))
+    }
+
     #[pyfn(m, "sa_surface")]
     fn sa_surface_py<'py>(
         py: Python<'py>,
@@ -71,6 +91,87 @@ pub fn sz_py_ext(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
         )
     }
 
+    #[pyfn(m, "sa_surface_density")]
+    fn sa_surface_density_py<'py>(
+        py: Python<'py>,
+        coors: PyReadonlyArray2<'_, f64>,
+        elements: Vec<&str>,
+        density: f64,
+        pr: f64,
+        index: bool,
+    ) -> &'py PyArray2<f64> {
+        nparray_return!(
+            sa_surface_density(&coors.as_array(), Some(&elements), density, pr, index)
+                .into_pyarray(py)
+        )
+    }
+
+    #[pyfn(m, "per_atom_sasa")]
+    fn per_atom_sasa_py<'py>(
+        py: Python<'py>,
+        coors: PyReadonlyArray2<'_, f64>,
+        elements: Vec<&str>,
+        n: usize,
+        pr: f64,
+    ) -> &'py PyArray2<f64> {
+        nparray_return!(per_atom_sasa(&coors.as_array(), Some(&elements), n, pr).into_pyarray(py))
+    }
+
+    #[pyfn(m, "per_atom_sasa_bitmask")]
+    fn per_atom_sasa_bitmask_py<'py>(
+        py: Python<'py>,
+        coors: PyReadonlyArray2<'_, f64>,
+        elements: Vec<&str>,
+        n: usize,
+        pr: f64,
+    ) -> &'py PyArray2<f64> {
+        nparray_return!(
+            per_atom_sasa_bitmask(&coors.as_array(), Some(&elements), n, pr).into_pyarray(py)
+        )
+    }
+
+    #[pyfn(m, "sa_surface_bitmask")]
+    fn sa_surface_bitmask_py<'py>(
+        py: Python<'py>,
+        coors: PyReadonlyArray2<'_, f64>,
+        elements: Vec<&str>,
+        n: usize,
+        pr: f64,
+        index: bool,
+    ) -> &'py PyArray2<f64> {
+        nparray_return!(
+            sa_surface_bitmask(&coors.as_array(), Some(&elements), n, pr, index).into_pyarray(py)
+        )
+    }
+
+    #[pyfn(m, "sa_surface_multi")]
+    fn sa_surface_multi_py<'py>(
+        py: Python<'py>,
+        coors: PyReadonlyArray2<'_, f64>,
+        elements: Vec<&str>,
+        n: usize,
+        radii: Vec<f64>,
+    ) -> (&'py PyArray2<f64>, &'py PyArray1<i64>) {
+        let (dots, offsets) = sa_surface_multi(&coors.as_array(), Some(&elements), n, &radii);
+        (
+            nparray_return!(dots.into_pyarray(py)),
+            nparray_return!(offsets.into_pyarray(py)),
+        )
+    }
+
+    #[pyfn(m, "connolly_surface")]
+    fn connolly_surface_py<'py>(
+        py: Python<'py>,
+        coors: PyReadonlyArray2<'_, f64>,
+        elements: Vec<&str>,
+        n: usize,
+        pr: f64,
+    ) -> &'py PyArray2<f64> {
+        nparray_return!(
+            connolly_surface(&coors.as_array(), Some(&elements), n, pr).into_pyarray(py)
+        )
+    }
+
     #[pyfn(m, "find_pocket")]
     fn find_pocket_py<'py>(
         py: Python<'py>,
@@ -78,9 +179,12 @@ pub fn sz_py_ext(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
         elements: Vec<&str>,
         n: usize,
         pr: f64,
+        density: Option<f64>,
     ) -> &'py PyArray2<f64> {
         // crate::config::init_config();
-        nparray_return!(find_pocket(&coors.as_array(), Some(&elements), n, pr).into_pyarray(py))
+        nparray_return!(
+            find_pocket(&coors.as_array(), Some(&elements), n, pr, density).into_pyarray(py)
+        )
     }
 
     #[pyfn(m, "find_layer")]
@@ -90,9 +194,46 @@ pub fn sz_py_ext(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
         elements: Vec<&str>,
         n: usize,
         pr: f64,
+        density: Option<f64>,
     ) -> &'py PyArray2<f64> {
         // crate::config::init_config();
-        nparray_return!(find_layer(&coors.as_array(), Some(&elements), n, pr).into_pyarray(py))
+        nparray_return!(
+            find_layer(&coors.as_array(), Some(&elements), n, pr, density).into_pyarray(py)
+        )
+    }
+
+    #[pyfn(m, "group_pockets")]
+    fn group_pockets_py<'py>(
+        py: Python<'py>,
+        grid: PyReadonlyArray2<'_, f64>,
+        spacing: f64,
+    ) -> (&'py PyArray1<i64>, &'py PyArray1<i64>) {
+        let (ids, sizes) = group_pockets(&grid.as_array(), spacing);
+        (
+            nparray_return!(ids.into_pyarray(py)),
+            nparray_return!(sizes.into_pyarray(py)),
+        )
+    }
+
+    #[pyfn(m, "buriedness")]
+    fn buriedness_py<'py>(
+        py: Python<'py>,
+        coors: PyReadonlyArray2<'_, f64>,
+        elements: Vec<&str>,
+        grid: PyReadonlyArray2<'_, f64>,
+        n: usize,
+        max_d: f64,
+        spacing: f64,
+    ) -> &'py PyArray1<f64> {
+        nparray_return!(buriedness(
+            &coors.as_array(),
+            Some(&elements),
+            &grid.as_array(),
+            n,
+            max_d,
+            spacing
+        )
+        .into_pyarray(py))
     }
 
     #[pyfn(m, "run_hydrophobicity")]
@@ -103,12 +244,28 @@ pub fn sz_py_ext(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
         resns: Vec<&str>,
         n: usize,
         pr: f64,
-    ) -> &'py PyArray2<f64> {
+        density: Option<f64>,
+        tol: Option<f64>,
+    ) -> PyObject {
         crate::config::init_config();
-        nparray_return!(
-            run_hydrophobicity(&coors.as_array(), Some(&elements), &resns, n, pr).into_pyarray(py)
-        )
+        let (grid, approx) = run_hydrophobicity(
+            &coors.as_array(),
+            Some(&elements),
+            &resns,
+            n,
+            pr,
+            density,
+            tol,
+        );
+        let grid = nparray_return!(grid.into_pyarray(py));
+        // 近似模式同时返回截断距离和抽样估计的最大误差
+        match approx {
+            Some((cutoff, error)) => (grid, cutoff, error).into_py(py),
+            None => grid.into_py(py),
+        }
     }
 
+    m.add_class::<Structure>()?;
+
     Ok(())
 }
@@ -0,0 +1,205 @@
+use std::collections::HashMap;
+
+use ndarray::ArrayView2;
+
+///
+/// 空间哈希(cell list), 按`cutoff`划分立方体单元格
+/// 查询时只需遍历所在单元格及周围26个单元格中的点
+///
+pub struct CellList {
+    pub cutoff: f64,
+    origin: [f64; 3],
+    cells: HashMap<[i64; 3], Vec<usize>>,
+}
+
+impl CellList {
+    ///
+    /// * `coors`: 点集合, 只使用前三列
+    /// * `cutoff`: 单元格边长, 不能小于之后需要查询的最大距离
+    ///
+    pub fn new(coors: &ArrayView2<'_, f64>, cutoff: f64) -> Self {
+        let mut origin = [0.; 3];
+        for k in 0..3 {
+            origin[k] = coors.column(k).fold(f64::MAX, |a, b| a.min(*b));
+        }
+
+        let mut cell_list = Self {
+            cutoff,
+            origin,
+            cells: HashMap::new(),
+        };
+
+        for i in 0..coors.nrows() {
+            let key = cell_list.key(&[coors[[i, 0]], coors[[i, 1]], coors[[i, 2]]]);
+            cell_list.cells.entry(key).or_insert_with(Vec::new).push(i);
+        }
+        cell_list
+    }
+
+    ///
+    /// 点所在单元格的整数坐标
+    ///
+    #[inline]
+    pub fn key(&self, p: &[f64; 3]) -> [i64; 3] {
+        [
+            ((p[0] - self.origin[0]) / self.cutoff).floor() as i64,
+            ((p[1] - self.origin[1]) / self.cutoff).floor() as i64,
+            ((p[2] - self.origin[2]) / self.cutoff).floor() as i64,
+        ]
+    }
+
+    ///
+    /// 遍历`p`所在单元格及周围26个单元格中的点序号
+    ///
+    pub fn for_each<F: FnMut(usize)>(&self, p: &[f64; 3], mut f: F) {
+        let k = self.key(p);
+        for x in -1..=1 {
+            for y in -1..=1 {
+                for z in -1..=1 {
+                    if let Some(v) = self.cells.get(&[k[0] + x, k[1] + y, k[2] + z]) {
+                        v.iter().for_each(|i| f(*i));
+                    }
+                }
+            }
+        }
+    }
+
+    ///
+    /// `coors`中是否存在与`p`距离平方小于`r2`的点
+    /// `coors`必须是构建时使用的点集合
+    ///
+    pub fn any_within(&self, coors: &ArrayView2<'_, f64>, p: &[f64; 3], r2: f64) -> bool {
+        let k = self.key(p);
+        for x in -1..=1 {
+            for y in -1..=1 {
+                for z in -1..=1 {
+                    if let Some(v) = self.cells.get(&[k[0] + x, k[1] + y, k[2] + z]) {
+                        let found = v.iter().any(|i| {
+                            let d = (coors[[*i, 0]] - p[0]).powi(2)
+                                + (coors[[*i, 1]] - p[1]).powi(2)
+                                + (coors[[*i, 2]] - p[2]).powi(2);
+                            d < r2
+                        });
+                        if found {
+                            return true;
+                        }
+                    }
+                }
+            }
+        }
+        false
+    }
+
+    ///
+    /// `coors`中与`p`距离平方小于`r2`的点, 返回(序号, 距离平方)
+    /// `coors`必须是构建时使用的点集合
+    ///
+    pub fn within(&self, coors: &ArrayView2<'_, f64>, p: &[f64; 3], r2: f64) -> Vec<(usize, f64)> {
+        let mut v = vec![];
+        self.for_each(p, |i| {
+            let d = (coors[[i, 0]] - p[0]).powi(2)
+                + (coors[[i, 1]] - p[1]).powi(2)
+                + (coors[[i, 2]] - p[2]).powi(2);
+            if d < r2 {
+                v.push((i, d));
+            }
+        });
+        v
+    }
+
+    ///
+    /// 与`within`相同, 但`r2`可以大于单元格边长的平方, 按需要遍历更多层单元格
+    ///
+    pub fn within_reach(
+        &self,
+        coors: &ArrayView2<'_, f64>,
+        p: &[f64; 3],
+        r2: f64,
+    ) -> Vec<(usize, f64)> {
+        let k = self.key(p);
+        let l = (r2.sqrt() / self.cutoff).ceil().max(1.) as i64;
+        let mut v = vec![];
+        for x in -l..=l {
+            for y in -l..=l {
+                for z in -l..=l {
+                    if let Some(cell) = self.cells.get(&[k[0] + x, k[1] + y, k[2] + z]) {
+                        for i in cell {
+                            let d = (coors[[*i, 0]] - p[0]).powi(2)
+                                + (coors[[*i, 1]] - p[1]).powi(2)
+                                + (coors[[*i, 2]] - p[2]).powi(2);
+                            if d < r2 {
+                                v.push((*i, d));
+                            }
+                        }
+                    }
+                }
+            }
+        }
+        v
+    }
+
+    ///
+    /// 第`i`个点从`old`移动到`new`后, 更新其所在的单元格
+    ///
+    pub fn move_point(&mut self, i: usize, old: &[f64; 3], new: &[f64; 3]) {
+        let (from, to) = (self.key(old), self.key(new));
+        if from == to {
+            return;
+        }
+
+        let empty = match self.cells.get_mut(&from) {
+            Some(v) => {
+                v.retain(|f| *f != i);
+                v.is_empty()
+            }
+            None => false,
+        };
+        if empty {
+            self.cells.remove(&from);
+        }
+        self.cells.entry(to).or_insert_with(Vec::new).push(i);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use ndarray::array;
+
+    use super::*;
+
+    #[test]
+    fn test_cell_list() {
+        let a = array![[0., 0., 0.], [0., 0., 1.7], [0., 0., 10.7], [3., 3., 3.]];
+        let c = CellList::new(&a.view(), 3.2);
+
+        let mut v = c.within(&a.view(), &[0., 0., 0.], 3.2f64.powi(2));
+        v.sort_by(|a, b| a.0.cmp(&b.0));
+        assert_eq!(v.iter().map(|f| f.0).collect::<Vec<_>>(), vec![0, 1]);
+
+        let v = c.within(&a.view(), &[0., 0., 9.], 3.2f64.powi(2));
+        assert_eq!(v.len(), 1);
+        assert_eq!(v[0].0, 2);
+
+        assert!(c.any_within(&a.view(), &[0., 0., 9.], 3.2f64.powi(2)));
+        assert!(!c.any_within(&a.view(), &[0., 0., 6.], 3.2f64.powi(2)));
+    }
+
+    #[test]
+    fn test_within_reach() {
+        let mut a = array![[0., 0., 0.], [0., 0., 1.7], [0., 0., 10.7], [3., 3., 3.]];
+        let mut c = CellList::new(&a.view(), 3.2);
+
+        // 查询距离大于单元格边长
+        let mut v = c.within_reach(&a.view(), &[0., 0., 0.], 11f64.powi(2));
+        v.sort_by(|a, b| a.0.cmp(&b.0));
+        assert_eq!(v.iter().map(|f| f.0).collect::<Vec<_>>(), vec![0, 1, 2, 3]);
+
+        // 移动到其他单元格后, 只能在新位置附近找到
+        a.row_mut(2).assign(&array![20., 0., 0.]);
+        c.move_point(2, &[0., 0., 10.7], &[20., 0., 0.]);
+        assert!(c.within(&a.view(), &[0., 0., 9.], 3.2f64.powi(2)).is_empty());
+        let v = c.within(&a.view(), &[19., 0., 0.], 3.2f64.powi(2));
+        assert_eq!(v.len(), 1);
+        assert_eq!(v[0].0, 2);
+    }
+}
@@ -1,18 +1,18 @@
 use std::{
-    cmp::{max, min},
-    collections::HashSet,
-    sync::Mutex,
+    collections::HashMap,
+    sync::atomic::{AtomicBool, Ordering},
 };
 
 use log::info;
-use ndarray::{concatenate, s, Array, ArrayView2, Axis};
+use ndarray::{concatenate, Array, Array1, ArrayView2, Axis};
 use rayon::iter::{
-    IndexedParallelIterator, IntoParallelIterator, IntoParallelRefMutIterator, ParallelIterator,
+    IndexedParallelIterator, IntoParallelIterator, IntoParallelRefIterator,
+    IntoParallelRefMutIterator, ParallelIterator,
 };
 
 use crate::{
+    neighbor::CellList,
     surface::{Protein, DEFAULT_PTR},
-    utils::distance,
 };
 
 ///
@@ -71,146 +71,147 @@ fn gen_grid(
 }
 
 ///
-/// 画园法,截取网格点
-/// * `coors`: 原子集合
-/// * `elements`: 原子半径集合
-/// * `grid`: 网格点集合
-/// * `pr`: 辅助圆半径
-///  
-/// 返回过滤后的`grid`
+/// 以整数偏移表示的球(格点间距为1)
 ///
-fn select_point(
-    coors: &ArrayView2<'_, f64>,
-    grid: &ArrayView2<'_, f64>,
-    y_ptr: f64,
-) -> ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>> {
-    let filer = Mutex::new(Vec::<usize>::with_capacity(grid.nrows() / 4));
+/// 球心在所在单元格`[0, 1)³`内任意移动时:
+/// 返回的第一组偏移点一定在半径`r`内, 直接标记;
+/// 第二组偏移点可能在半径`r`内, 需要精确计算距离
+///
+fn sphere_offsets(r: f64) -> (Vec<[i64; 3]>, Vec<[i64; 3]>) {
+    let k = r.ceil() as i64 + 1;
+    let r2 = r.powi(2);
+
+    let mut inner = vec![];
+    let mut shell = vec![];
+    for x in -k..=k {
+        for y in -k..=k {
+            for z in -k..=k {
+                let o = [x, y, z];
+                let far = o.iter().map(|v| (v * v).max((v - 1) * (v - 1))).sum::<i64>() as f64;
+                let near = o.iter().map(|v| (-v).max(v - 1).max(0).pow(2)).sum::<i64>() as f64;
+                if far < r2 - 1e-6 {
+                    inner.push(o);
+                } else if near <= r2 + 1e-6 {
+                    shell.push(o);
+                }
+            }
+        }
+    }
+    (inner, shell)
+}
 
-    let ptr_2 = y_ptr.powi(2);
+///
+/// 把球印到网格上, 与球心距离平方小于`r²`的格点标记为`true`
+/// * `centers`: 球心集合, 只使用前三列
+/// * `radii`: 每个球心对应的半径
+/// * `xyz`: `gen_grid`得到的网格信息, 格点间距为1
+/// * `mask`: 网格点标记, 与`gen_grid`的格点一一对应
+///
+/// 相同半径的球共用一组偏移, 计算量与球心数量成正比, 与网格点数无关
+///
+fn stamp_spheres(
+    centers: &ArrayView2<'_, f64>,
+    radii: &[f64],
+    xyz: &[f64],
+    mask: &[AtomicBool],
+) {
+    let origin = [xyz[0], xyz[3], xyz[6]];
+    let shape = [xyz[2] as i64, xyz[5] as i64, xyz[8] as i64];
 
-    (0..grid.nrows()).into_par_iter().for_each(|i| {
-        let mut flags = true;
-        let b = grid.row(i);
+    let mut groups = HashMap::<u64, Vec<usize>>::new();
+    for (i, r) in radii.iter().enumerate() {
+        groups.entry(r.to_bits()).or_insert_with(Vec::new).push(i);
+    }
 
-        for j in 0..coors.nrows() {
-            let a = coors.row(j);
-            let r1 = distance(&a, &b);
-            if r1 < ptr_2 {
-                flags = false;
-                break;
+    for (bits, ids) in groups {
+        let r = f64::from_bits(bits);
+        let r2 = r.powi(2);
+        let k = r.ceil() as i64 + 1;
+        let (inner, shell) = sphere_offsets(r);
+
+        ids.par_iter().for_each(|i| {
+            let c = [centers[[*i, 0]], centers[[*i, 1]], centers[[*i, 2]]];
+            let base = [
+                (c[0] - origin[0]).floor() as i64,
+                (c[1] - origin[1]).floor() as i64,
+                (c[2] - origin[2]).floor() as i64,
+            ];
+
+            // 离网格太远的球不会覆盖任何格点
+            if (0..3).any(|j| base[j] < -k || base[j] >= shape[j] + k) {
+                return;
             }
-        }
 
-        if flags {
-            &mut filer.lock().unwrap().push(i);
-        }
-    });
+            let index = |o: &[i64; 3]| {
+                let p = [base[0] + o[0], base[1] + o[1], base[2] + o[2]];
+                if (0..3).all(|j| p[j] >= 0 && p[j] < shape[j]) {
+                    Some((p, ((p[0] * shape[1] + p[1]) * shape[2] + p[2]) as usize))
+                } else {
+                    None
+                }
+            };
+
+            for o in &inner {
+                if let Some((_, j)) = index(o) {
+                    mask[j].store(true, Ordering::Relaxed);
+                }
+            }
 
-    let d = grid.select(Axis(0), &filer.lock().unwrap());
-    d
+            for o in &shell {
+                if let Some((p, j)) = index(o) {
+                    let d = (origin[0] + p[0] as f64 - c[0]).powi(2)
+                        + (origin[1] + p[1] as f64 - c[1]).powi(2)
+                        + (origin[2] + p[2] as f64 - c[2]).powi(2);
+                    if d < r2 {
+                        mask[j].store(true, Ordering::Relaxed);
+                    }
+                }
+            }
+        });
+    }
 }
 
 ///
-/// 从网格grid中去除原子集合内的点, 方式是先获取起始点, 减少判定次数
+/// 画园法,截取网格点
+/// * `coors`: 圆心集合
+/// * `y_ptr`: 辅助圆半径
+/// * `xyz`: `gen_grid`得到的网格信息
+/// * `mask`: 网格点标记, 圆内的格点标记为`true`
+///
+fn select_point(coors: &ArrayView2<'_, f64>, y_ptr: f64, xyz: &[f64], mask: &[AtomicBool]) {
+    stamp_spheres(coors, &vec![y_ptr; coors.nrows()], xyz, mask);
+}
+
+///
+/// 标记网格中原子集合内的点
 /// * `coors`: 原子集合
 /// * `elements`: 原子半径集合
-/// * `grid`: 网格, 包含所有原子集合的立方体网格
 /// * `pr`: 探测小球半径 一般1.4
-/// * `xyz`: `grid` 状态相关数据集合
-///  
-/// 返回过滤后的`grid`
+/// * `xyz`: `gen_grid`得到的网格信息
+/// * `mask`: 网格点标记, 原子`r + pr`内的格点标记为`true`
 ///
 fn select_point_by_atomic(
     coors: &ArrayView2<'_, f64>,
     elements: &Vec<f64>,
-    grid: &ArrayView2<'_, f64>,
     pr: f64,
     xyz: &[f64],
-) -> ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>> {
-    let tmp = grid;
-
-    let row = grid.nrows();
-
-    let filer = Mutex::new(HashSet::<usize>::with_capacity(row / 2));
-
-    (0..coors.nrows()).into_par_iter().for_each(|i| {
-        let b1 = coors.row(i);
-        let r = elements[i] + pr;
-
-        // 立方体左上角最小的点
-        let (x1, y1, z1) = (b1[0] - r - xyz[0], b1[1] - r - xyz[3], b1[2] - r - xyz[6]);
-        // 立方体右下角最大的点
-        let (x2, y2, z2) = (b1[0] + r - xyz[0], b1[1] + r - xyz[3], b1[2] + r - xyz[6]);
-
-        let (c1, c2) = (xyz[5] * xyz[8], xyz[8]);
-        let start = (x1 * c1 + y1 * c2 + z1) as usize;
-        let end = min(row, (x2 * c1 + y2 * c2 + z2) as usize);
-
-        let (xmin, ymin, zmin) = (x1.floor() as i32, y1.floor() as i32, z1.floor() as i32);
-        let (xmax, ymax, zmax) = (x2.ceil() as i32, y2.ceil() as i32, z2.ceil() as i32);
-
-        let p_len = (xmax - xmin) * (ymax - ymin) * (zmax - zmin);
-
-        // info!(
-        //     "center({:?}), r({:.3}), len({:?}), start({:?}), range({:?}, {:?}, {:?})",
-        //     (b1[0], b1[1], b1[2]),
-        //     r,
-        //     p_len,
-        //     (start, end, tmp.nrows()),
-        //     (xmin, xmax),
-        //     (ymin, ymax),
-        //     (zmin, zmax)
-        // );
-
-        // 精确计算球体中的点数
-        let cache = Mutex::new(Vec::<usize>::with_capacity(p_len as usize));
-
-        // 遍历原子所在的立方体区域
-        (xmin..xmax).into_par_iter().for_each(|x| {
-            for y in ymin..ymax {
-                let start = max(start, (x * (c1 as i32) + y * (c2 as i32) + zmin) as usize);
-                let end = min(end, (x * (c1 as i32) + y * (c2 as i32) + zmax) as usize);
-                if start > end - 1 {
-                    continue;
-                }
-                let tmp_s = tmp.slice(s![start..end, ..]);
-
-                let t = &tmp_s - &b1;
-
-                // 行为一个点, 先得出距离, 再进行判断, 筛选
-                t.mapv(|f| f * f)
-                    .sum_axis(Axis(1))
-                    .into_iter()
-                    .enumerate()
-                    .for_each(|(i, f)| {
-                        if f < r.powi(2) {
-                            let m = &mut cache.lock().unwrap();
-                            m.push(start + i);
-                        }
-                    });
-            }
-        });
-        let n = &mut filer.lock().unwrap();
-        n.extend(cache.lock().unwrap().to_owned());
-    });
-
-    let d = filer.lock().unwrap().to_owned();
-
-    let d = (0..row)
-        .into_par_iter()
-        .filter_map(|f| if d.contains(&f) { None } else { Some(f) })
-        .collect::<Vec<usize>>();
-
-    tmp.select(Axis(0), &d)
+    mask: &[AtomicBool],
+) {
+    let radii = elements.iter().map(|f| f + pr).collect::<Vec<f64>>();
+    stamp_spheres(coors, &radii, xyz, mask);
 }
 
+///
+/// * `density`: 点密度(每Å²的点数), 设置后代替`n`, 见`Protein::with_density`
+///
 pub fn find_pocket(
     coors: &ArrayView2<'_, f64>,
     elements: Option<&Vec<&str>>,
     n: usize,
     pr: f64,
+    density: Option<f64>,
 ) -> ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>> {
-    let mut protein = Protein::new(coors.clone(), elements, n);
+    let mut protein = Protein::with_density(coors.clone(), elements, n, density);
     find_pocket_core(&mut protein, pr)
 }
 
@@ -234,23 +235,31 @@ pub fn find_pocket_core(
     info!("shape: {:?}", dot.shape());
 
     // 生成网格
-    let grid = gen_grid(&protein.coors, 1, 0., &mut xyz);
+    let grid = gen_grid(&protein.coors.view(), 1, 0., &mut xyz);
 
     info!("shape: {:?} xyz = {:?}", grid.shape(), xyz);
 
+    let mask = (0..grid.nrows())
+        .map(|_| AtomicBool::new(false))
+        .collect::<Vec<_>>();
+
     //去除原子集合内的格点
-    let grid = select_point_by_atomic(
-        &protein.coors,
+    select_point_by_atomic(
+        &protein.coors.view(),
         &protein.radis_v,
-        &grid.view(),
         DEFAULT_PTR,
         &xyz,
+        &mask,
     );
-    info!("1111 shape: {:?}", grid.shape());
 
     // 外部画圆(pr 选择为 20)的方式截取的方式获得最后的pokcets
-    let grid = select_point(&dot.view(), &grid.view(), pr);
-    info!("2222 shape: {:?}", grid.shape());
+    select_point(&dot.view(), pr, &xyz, &mask);
+
+    let keep = (0..grid.nrows())
+        .filter(|i| !mask[*i].load(Ordering::Relaxed))
+        .collect::<Vec<usize>>();
+    let grid = grid.select(Axis(0), &keep);
+    info!("pocket shape: {:?}", grid.shape());
     grid
 }
 
@@ -270,32 +279,123 @@ pub fn label_from_grid(
     vec: &mut Vec<f64>,
     pr: f64,
 ) {
-    let tmp = vec.clone();
-
-    let filer = Mutex::new(vec);
+    let cells = CellList::new(coors, pr);
     let r = pr.powi(2);
 
+    vec.par_iter_mut()
+        .enumerate()
+        .filter(|(_, v)| **v == 0.)
+        .for_each(|(i, v)| {
+            let p = [grid[[i, 0]], grid[[i, 1]], grid[[i, 2]]];
+            if cells.any_within(coors, &p, r) {
+                *v = label;
+            }
+        });
+}
+
+///
+/// 一次完成所有层级的标记, 结果与依次调用`label_from_grid`相同
+///
+/// * `grid`: `pocket`格点集合
+/// * `shells`: 按标记顺序排列的(sa平面点集合, 辅助半径, 标记值)
+///
+/// 每个格点标记为第一个与之距离小于辅助半径的层级, 都不满足时为0.
+/// 每层的点用`CellList`索引, 每个格点只查询附近的单元格, 命中后不再查询后面的层级
+///
+pub fn label_layers(
+    grid: &ArrayView2<'_, f64>,
+    shells: &[(ArrayView2<'_, f64>, f64, f64)],
+) -> Vec<f64> {
+    let cells = shells
+        .iter()
+        .map(|(dots, pr, _)| CellList::new(dots, *pr))
+        .collect::<Vec<_>>();
+
     (0..grid.nrows())
         .into_par_iter()
-        .filter(|f| tmp[*f] == 0.)
-        .for_each(|i| {
-            let mut flags = false;
-            let g = grid.row(i);
-
-            for j in 0..coors.nrows() {
-                let c = coors.row(j);
-                let r1 = distance(&c, &g);
-                if r1 < r {
-                    flags = true;
-                    break;
-                }
+        .map(|i| {
+            let p = [grid[[i, 0]], grid[[i, 1]], grid[[i, 2]]];
+            shells
+                .iter()
+                .zip(cells.iter())
+                .find(|((dots, pr, _), c)| c.any_within(dots, &p, pr.powi(2)))
+                .map_or(0., |((_, _, label), _)| *label)
+        })
+        .collect()
+}
+
+///
+/// 按6邻接(只有一个方向相差一个格点间距)将`pocket`格点分组, 并查集实现
+///
+/// * `grid`: 格点集合, 只使用前三列
+/// * `spacing`: 格点间距
+///
+/// 返回(每个格点所在组的序号, 每个组的格点数), 组按第一个格点出现的顺序从0开始编号
+///
+pub fn group_pockets(grid: &ArrayView2<'_, f64>, spacing: f64) -> (Array1<i64>, Array1<i64>) {
+    let n = grid.nrows();
+    let mut origin = [0.; 3];
+    for k in 0..3 {
+        origin[k] = grid.column(k).fold(f64::MAX, |a, b| a.min(*b));
+    }
+
+    let keys = (0..n)
+        .map(|i| {
+            let mut key = [0i64; 3];
+            for k in 0..3 {
+                key[k] = ((grid[[i, k]] - origin[k]) / spacing).round() as i64;
             }
+            key
+        })
+        .collect::<Vec<_>>();
+    let lookup = keys
+        .iter()
+        .enumerate()
+        .map(|(i, k)| (*k, i))
+        .collect::<HashMap<_, _>>();
+
+    fn find(parent: &mut Vec<usize>, mut i: usize) -> usize {
+        while parent[i] != i {
+            parent[i] = parent[parent[i]];
+            i = parent[i];
+        }
+        i
+    }
+
+    let mut parent = (0..n).collect::<Vec<usize>>();
+    for (i, key) in keys.iter().enumerate() {
+        // 重复的格点以及 +x, +y, +z 方向相邻的格点
+        let mut neighbors = vec![*key];
+        for k in 0..3 {
+            let mut next = *key;
+            next[k] += 1;
+            neighbors.push(next);
+        }
 
-            if flags {
-                let n = &mut filer.lock().unwrap();
-                n[i] = label;
+        for next in neighbors.iter() {
+            if let Some(j) = lookup.get(next) {
+                let (a, b) = (find(&mut parent, i), find(&mut parent, *j));
+                if a != b {
+                    parent[a.max(b)] = a.min(b);
+                }
             }
+        }
+    }
+
+    let mut ids = vec![0i64; n];
+    let mut sizes = Vec::<i64>::new();
+    let mut labels = HashMap::new();
+    for i in 0..n {
+        let root = find(&mut parent, i);
+        let id = *labels.entry(root).or_insert_with(|| {
+            sizes.push(0);
+            sizes.len() - 1
         });
+        sizes[id] += 1;
+        ids[i] = id as i64;
+    }
+
+    (Array::from(ids), Array::from(sizes))
 }
 
 /// layer 层级及对应label定义
@@ -312,14 +412,16 @@ const PROBE_RADIIS: [(f64, i32); 8] = [
 
 ///
 /// 给找到的pocket分层
+/// * `density`: 点密度(每Å²的点数), 设置后代替`n`, 见`Protein::with_density`
 ///
 pub fn find_layer(
     coors: &ArrayView2<'_, f64>,
     elements: Option<&Vec<&str>>,
     n: usize,
     pr: f64,
+    density: Option<f64>,
 ) -> ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>> {
-    let mut protein = Protein::new(coors.clone(), elements, n);
+    let mut protein = Protein::with_density(coors.clone(), elements, n, density);
     find_layer_core(&mut protein, pr)
 }
 
@@ -330,19 +432,29 @@ pub fn find_layer_core(
     protein: &mut Protein,
     pr: f64,
 ) -> ndarray::ArrayBase<ndarray::OwnedRepr<f64>, ndarray::Dim<[usize; 2]>> {
+    // 一次计算pas以及所有层级需要的sa平面
+    let radii = PROBE_RADIIS
+        .iter()
+        .map(|f| f.0)
+        .chain(std::iter::once(pr))
+        .collect::<Vec<f64>>();
+    protein.sa_surface_multi(&radii);
+
     let grid = find_pocket_core(protein, pr);
 
     let rows = grid.nrows();
 
-    let mut vec = vec![0.; rows];
-
-    // 根据指定的分层逻辑,开始遍历分层
-    PROBE_RADIIS.iter().for_each(|f| {
-        // info!("start sa_surface_core pr={}", f.0);
-        let dots = protein.sa_surface(f.0, false);
-        // info!("end sa_surface_core pr={}", f.0);
-        label_from_grid(&grid.view(), &dots.view(), f.1 as f64, &mut vec, f.0);
-    });
+    // 根据指定的分层逻辑, 所有层级一次标记
+    let dots = PROBE_RADIIS
+        .iter()
+        .map(|f| protein.sa_surface(f.0, false))
+        .collect::<Vec<_>>();
+    let shells = dots
+        .iter()
+        .zip(PROBE_RADIIS.iter())
+        .map(|(d, f)| (d.view(), f.0, f.1 as f64))
+        .collect::<Vec<_>>();
+    let vec = label_layers(&grid.view(), &shells);
 
     let index = Array::from_shape_vec((rows, 1), vec).unwrap();
     // 根据列,矩阵组合
@@ -355,6 +467,63 @@ mod tests {
     use ndarray::array;
 
     use super::*;
+    use crate::utils::distance;
+
+    #[test]
+    fn test_group_pockets() {
+        let grid = array![
+            [0., 0., 0.],
+            [5., 5., 5.],
+            [1., 0., 0.],
+            [1., 1., 0.],
+            [5., 5., 6.],
+            [3., 0., 0.],
+            [1., 1., 1.]
+        ];
+        let (ids, sizes) = group_pockets(&grid.view(), 1.);
+
+        assert_eq!(ids.to_vec(), vec![0, 1, 0, 0, 1, 2, 0]);
+        assert_eq!(sizes.to_vec(), vec![4, 2, 1]);
+    }
+
+    #[test]
+    fn test_label_layers() {
+        let grid = array![[0., 0., 0.], [3., 0., 0.], [6., 0., 0.], [20., 0., 0.], [30., 0., 0.]];
+        let big = array![[0., 0., 6.5], [9., 0., 0.]];
+        let small = array![[6., 2., 0.], [30., 0., 1.5]];
+
+        let layers = label_layers(
+            &grid.view(),
+            &[(big.view(), 7.0, -993.), (small.view(), 2.1, -5.)],
+        );
+
+        // 与逐层调用label_from_grid结果一致
+        let mut vec = vec![0.; grid.nrows()];
+        label_from_grid(&grid.view(), &big.view(), -993., &mut vec, 7.0);
+        label_from_grid(&grid.view(), &small.view(), -5., &mut vec, 2.1);
+
+        assert_eq!(layers, vec);
+        assert_eq!(layers, vec![-993., -993., -993., 0., -5.]);
+    }
+
+    #[test]
+    fn test_stamp_spheres() {
+        let a = array![[0.3, 0.2, 0.1], [2.5, 3.7, 1.2], [4.9, 1.1, 3.3]];
+        let radii = [1.4, 2.9, 2.9];
+
+        let mut xyz = [0.; 9];
+        let grid = gen_grid(&a.view(), 1, 6., &mut xyz);
+        let mask = (0..grid.nrows())
+            .map(|_| AtomicBool::new(false))
+            .collect::<Vec<_>>();
+        stamp_spheres(&a.view(), &radii, &xyz, &mask);
+
+        // 与逐点计算距离的结果一致
+        for i in 0..grid.nrows() {
+            let hit = (0..a.nrows()).any(|j| distance(&a.row(j), &grid.row(i)) < radii[j].powi(2));
+            assert_eq!(hit, mask[i].load(Ordering::Relaxed));
+        }
+    }
 
     #[test]
     fn test_grid() {
@@ -485,7 +654,7 @@ mod tests {
         // assert_eq!(23831, grid.shape()[0]);
 
         info!("start find layer");
-        let grid = find_layer(&a.view(), Some(&b), n, 20.);
+        let grid = find_layer(&a.view(), Some(&b), n, 20., None);
         info!("end find layer");
 
         assert_eq!(23831, grid.shape()[0]);
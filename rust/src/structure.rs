@@ -0,0 +1,94 @@
+use numpy::{npyffi::NPY_ARRAY_WRITEABLE, IntoPyArray, PyArray2, PyReadonlyArray2};
+use pyo3::prelude::{pyclass, pymethods, IntoPy, PyObject, Python};
+
+use crate::{
+    config::get_hdp_vec,
+    hydrophobicity::hydrophobicity_core,
+    nparray_return,
+    pocket::{find_layer_core, find_pocket_core},
+    surface::Protein,
+};
+
+///
+/// 可以在python中持有的蛋白质对象, 缓存各个辅助半径的sa平面,
+/// 原子移动后通过`update`增量更新
+///
+/// `find_pocket`, `find_layer`, `hydrophobicity`共用缓存, 改变`pr`重复调用时只计算新的半径
+///
+#[pyclass]
+pub struct Structure {
+    protein: Protein,
+    elements: Vec<String>,
+}
+
+#[pymethods]
+impl Structure {
+    #[new]
+    fn new(coors: PyReadonlyArray2<'_, f64>, elements: Vec<&str>, n: usize) -> Self {
+        Self {
+            protein: Protein::new(coors.as_array(), Some(&elements), n),
+            elements: elements.iter().map(|e| e.to_string()).collect(),
+        }
+    }
+
+    ///
+    /// 辅助半径`pr`对应的sa平面, 已计算过的半径直接读取缓存
+    ///
+    fn sa_surface<'py>(&mut self, py: Python<'py>, pr: f64, index: bool) -> &'py PyArray2<f64> {
+        nparray_return!(self.protein.sa_surface(pr, index).into_pyarray(py))
+    }
+
+    ///
+    /// 每个原子的sasa, 第一列为留存点的百分比, 第二列为面积
+    ///
+    fn per_atom_sasa<'py>(&mut self, py: Python<'py>, pr: f64) -> &'py PyArray2<f64> {
+        nparray_return!(self.protein.per_atom_sasa(pr).into_pyarray(py))
+    }
+
+    ///
+    /// 辅助半径`pr`对应的pocket格点, 见`find_pocket`
+    ///
+    fn find_pocket<'py>(&mut self, py: Python<'py>, pr: f64) -> &'py PyArray2<f64> {
+        nparray_return!(find_pocket_core(&mut self.protein, pr).into_pyarray(py))
+    }
+
+    ///
+    /// 辅助半径`pr`对应的分层pocket格点, 见`find_layer`
+    ///
+    fn find_layer<'py>(&mut self, py: Python<'py>, pr: f64) -> &'py PyArray2<f64> {
+        nparray_return!(find_layer_core(&mut self.protein, pr).into_pyarray(py))
+    }
+
+    ///
+    /// 辅助半径`pr`对应的pocket格点的疏水性, 见`run_hydrophobicity`
+    /// * `resns`: 原子对应的残基列表
+    /// * `tol`: 设置时为近似模式, 允许的疏水性绝对误差, 同时返回截断距离和抽样估计的最大误差
+    ///
+    fn hydrophobicity(
+        &mut self,
+        py: Python<'_>,
+        resns: Vec<&str>,
+        pr: f64,
+        tol: Option<f64>,
+    ) -> PyObject {
+        let elements = self.elements.iter().map(|e| e.as_str()).collect::<Vec<&str>>();
+        let mut hdp_v = vec![0.; self.protein.coors.len()];
+        get_hdp_vec(Some(&elements), &resns, &mut hdp_v);
+
+        let (grid, approx) = hydrophobicity_core(&mut self.protein, &hdp_v, pr, tol);
+        let grid = nparray_return!(grid.into_pyarray(py));
+        match approx {
+            Some((cutoff, error)) => (grid, cutoff, error).into_py(py),
+            None => grid.into_py(py),
+        }
+    }
+
+    ///
+    /// 部分原子移动后增量更新已缓存的sa平面
+    /// * `moved`: 移动的原子索引
+    /// * `coors`: 移动后的坐标, 与`moved`一一对应
+    ///
+    fn update(&mut self, moved: Vec<usize>, coors: PyReadonlyArray2<'_, f64>) {
+        self.protein.update(&moved, &coors.as_array());
+    }
+}
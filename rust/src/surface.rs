@@ -1,6 +1,6 @@
 use std::{
     cmp::min,
-    collections::HashMap,
+    collections::{BTreeSet, HashMap},
     f64::consts::PI,
     sync::{Mutex, RwLock},
     usize,
@@ -10,7 +10,7 @@ use ndarray::{concatenate, Array, ArrayBase, ArrayView2, Axis, Dim, OwnedRepr, S
 use once_cell::sync::OnceCell;
 use rayon::prelude::*;
 
-use crate::{config::get_vdw_vec, utils::distance};
+use crate::{config::get_vdw_vec, neighbor::CellList, utils::distance};
 
 /// 缓存单位球的均等分点
 static DOTS: OnceCell<RwLock<HashMap<usize, Vec<f64>>>> = OnceCell::new();
@@ -68,15 +68,98 @@ pub fn dotsphere(
     Array::from_shape_vec((n, 3), data).unwrap()
 }
 
-pub struct Protein<'a> {
-    pub coors: ArrayView2<'a, f64>,
+pub struct Protein {
+    pub coors: ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>>,
     pub radis_v: Vec<f64>,
     pub n: usize,
-    cache: Vec<(f64, ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>>)>,
+    /// 点密度(每Å²的点数), 设置后每个原子的均分点数由`dot_counts`决定, 不再使用`n`
+    pub density: Option<f64>,
+    /// 按辅助半径由大到小排列
+    cache: Vec<Surface>,
+    /// 原子的近邻表, 原子移动后在`update`中同步更新
+    cells: CellList,
+    /// 最大的原子半径
+    max_r: f64,
+}
+
+///
+/// 缓存的sa平面, 每个原子的点(`[x, y, z, 原子索引]`连续排列)单独保存,
+/// 增量更新时只替换受影响原子的点
+///
+struct Surface {
+    pr: f64,
+    atoms: Vec<Vec<f64>>,
+}
+
+impl Surface {
+    ///
+    /// 由含原子索引的点集合建立
+    ///
+    fn new(pr: f64, dots: &ArrayView2<'_, f64>, len: usize) -> Self {
+        let mut surface = Self {
+            pr,
+            atoms: vec![vec![]; len],
+        };
+        surface.replace(&[], dots);
+        surface
+    }
+
+    ///
+    /// 清空`affected`中原子的点, 再加入`dots`(含原子索引)中的点
+    ///
+    fn replace(&mut self, affected: &[usize], dots: &ArrayView2<'_, f64>) {
+        for a in affected {
+            self.atoms[*a].clear();
+        }
+        for row in dots.axis_iter(Axis(0)) {
+            self.atoms[row[3] as usize].extend(row.iter().cloned());
+        }
+    }
+
+    ///
+    /// 按原子顺序拼接所有点
+    ///
+    fn to_array(&self, index: bool) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+        let col = if index { 4 } else { 3 };
+        let len = self.atoms.iter().map(|f| f.len()).sum::<usize>() / 4;
+        let mut v = Vec::<f64>::with_capacity(len * col);
+        for a in &self.atoms {
+            for row in a.chunks(4) {
+                v.extend_from_slice(&row[..col]);
+            }
+        }
+        Array::from_shape_vec((len, col), v).unwrap()
+    }
 }
 
 pub const DEFAULT_PTR: f64 = 1.4;
 
+/// 按点密度取点时可选的均分点数, 同一模板的单位球均分点由`dotsphere`缓存
+pub const DOT_TEMPLATES: [usize; 16] = [
+    10, 15, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300, 400, 600, 800, 1000,
+];
+
+///
+/// 按点密度为每个原子选取均分点数
+/// * `radis_v`: 原子半径集合
+/// * `pr`: 补充半径
+/// * `density`: 每Å²的点数
+///
+/// 取不小于`density * 4πr²`的最小模板, 超出范围时取最大模板
+///
+pub fn dot_counts(radis_v: &Vec<f64>, pr: f64, density: f64) -> Vec<usize> {
+    radis_v
+        .iter()
+        .map(|r| {
+            let need = density * 4. * PI * (r + pr).powi(2);
+            *DOT_TEMPLATES
+                .iter()
+                .find(|f| **f as f64 >= need)
+                .unwrap_or(&DOT_TEMPLATES[DOT_TEMPLATES.len() - 1])
+        })
+        .collect()
+}
+
 #[inline]
 fn get_with_index(
     dots: &ArrayView2<'_, f64>,
@@ -89,20 +172,63 @@ fn get_with_index(
     }
 }
 
-impl<'a> Protein<'a> {
-    pub fn new(coors: ArrayView2<'a, f64>, elements: Option<&Vec<&str>>, n: usize) -> Self {
+impl Protein {
+    pub fn new(coors: ArrayView2<'_, f64>, elements: Option<&Vec<&str>>, n: usize) -> Self {
+        Self::with_density(coors, elements, n, None)
+    }
+
+    ///
+    /// * `density`: 点密度(每Å²的点数), 为`None`时所有原子都取`n`个均分点
+    ///
+    pub fn with_density(
+        coors: ArrayView2<'_, f64>,
+        elements: Option<&Vec<&str>>,
+        n: usize,
+        density: Option<f64>,
+    ) -> Self {
         // 求得原子半径集合缓存, 下面多个方法需要使用
         let mut radis_v = vec![0.; coors.nrows()];
         get_vdw_vec(elements, &mut radis_v);
 
-        let data = sa_surface_core(&coors, &radis_v, n, Some(DEFAULT_PTR), true);
-        let mut cache = vec![];
-        cache.push((DEFAULT_PTR, data));
+        let data = match density {
+            Some(d) => {
+                let atoms = (0..coors.nrows()).collect::<Vec<usize>>();
+                let counts = dot_counts(&radis_v, DEFAULT_PTR, d);
+                sa_surface_atoms(&coors, &radis_v, &counts, DEFAULT_PTR, &atoms)
+            }
+            None => sa_surface_core(&coors, &radis_v, n, Some(DEFAULT_PTR), true),
+        };
+        let cache = vec![Surface::new(DEFAULT_PTR, &data.view(), coors.nrows())];
+        let max_r = radis_v.iter().cloned().fold(0f64, f64::max);
+        let cells = CellList::new(&coors, 2. * (max_r + DEFAULT_PTR));
         Self {
-            coors,
+            coors: coors.to_owned(),
             radis_v,
             n,
+            density,
             cache,
+            cells,
+            max_r,
+        }
+    }
+
+    ///
+    /// 辅助半径`pr`下每个原子的均分点数
+    ///
+    fn counts(&self, pr: f64) -> Vec<usize> {
+        match self.density {
+            Some(d) => dot_counts(&self.radis_v, pr, d),
+            None => vec![self.n; self.radis_v.len()],
+        }
+    }
+
+    ///
+    /// 辅助半径`pr`下原子`i`的均分点数
+    ///
+    fn count(&self, pr: f64, i: usize) -> usize {
+        match self.density {
+            Some(d) => dot_counts(&vec![self.radis_v[i]], pr, d)[0],
+            None => self.n,
         }
     }
 
@@ -115,57 +241,162 @@ impl<'a> Protein<'a> {
         index: bool,
     ) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
         let mut i = 0;
-        for (k, v) in &self.cache {
-            if *k == pr {
-                return get_with_index(&v.view(), index);
-            } else if *k < pr {
+        for f in &self.cache {
+            if f.pr == pr {
+                return f.to_array(index);
+            } else if f.pr < pr {
                 break;
             } else {
                 i += 1;
             }
         }
 
+        // 按点密度取点时, 不同半径的均分点数不同, 无法利用缓存中的点
+        if self.density.is_some() {
+            let atoms = (0..self.coors.nrows()).collect::<Vec<usize>>();
+            let data = sa_surface_atoms(
+                &self.coors.view(),
+                &self.radis_v,
+                &self.counts(pr),
+                pr,
+                &atoms,
+            );
+            self.cache
+                .insert(i, Surface::new(pr, &data.view(), self.coors.nrows()));
+            return get_with_index(&data.view(), index);
+        }
+
         // 未发现缓存
         if i == 0 {
-            let data = sa_surface_core(&self.coors, &self.radis_v, self.n, Some(pr), true);
-            self.cache.insert(i, (pr, data.clone()));
+            let data = sa_surface_core(&self.coors.view(), &self.radis_v, self.n, Some(pr), true);
+            self.cache
+                .insert(i, Surface::new(pr, &data.view(), self.coors.nrows()));
             return get_with_index(&data.view(), index);
         } else {
-            let prev = self.cache[min(self.cache.len() - 1, i)].clone();
+            let prev = &self.cache[min(self.cache.len() - 1, i)];
+            let prev_pr = prev.pr;
+            // 缓存中的结果都包含原子索引
+            let prev = prev.to_array(true);
             let data = sa_surface_from_prev(
-                &self.coors,
-                &prev.1.view(),
+                &self.coors.view(),
+                &prev.view(),
                 &self.radis_v,
                 self.n,
-                prev.0,
+                prev_pr,
                 pr,
-                index,
+                true,
+            );
+            self.cache.insert(
+                min(self.cache.len(), i),
+                Surface::new(pr, &data.view(), self.coors.nrows()),
             );
-            self.cache
-                .insert(min(self.cache.len(), i), (pr, data.clone()));
             return get_with_index(&data.view(), index);
         }
     }
 
     ///
-    /// 计算`pr` 对应结果中, 均分点在每个原子下的百分比
+    /// 一次计算多个半径的sa平面, 结果写入缓存
     ///
-    pub fn get_index_map_by_ptr(&mut self, pr: f64) -> HashMap<usize, f64> {
-        let tmp = self.sa_surface(pr, true);
-        let sa = Mutex::new(HashMap::<usize, f64>::new());
-
-        (0..self.coors.nrows()).into_par_iter().for_each(|f| {
-            let count = tmp
-                .axis_iter(Axis(0))
-                .filter(|r| (r[3] as usize) == f)
-                .count();
-
-            let n = &mut sa.lock().unwrap();
-            n.insert(f, count as f64 / self.n as f64);
-        });
+    pub fn sa_surface_multi(&mut self, radii: &[f64]) {
+        let mut todo = Vec::<f64>::with_capacity(radii.len());
+        for pr in radii {
+            if !todo.contains(pr) && !self.cache.iter().any(|f| f.pr == *pr) {
+                todo.push(*pr);
+            }
+        }
+        if todo.is_empty() {
+            return;
+        }
+
+        if self.density.is_some() {
+            for pr in todo {
+                self.sa_surface(pr, true);
+            }
+            return;
+        }
 
-        let m = sa.lock().unwrap().to_owned();
-        m
+        let data = sa_surface_multi_core(&self.coors.view(), &self.radis_v, self.n, &todo);
+        for (pr, d) in todo.into_iter().zip(data.into_iter()) {
+            // 缓存按半径由大到小排列
+            let i = self
+                .cache
+                .iter()
+                .position(|f| f.pr < pr)
+                .unwrap_or(self.cache.len());
+            self.cache
+                .insert(i, Surface::new(pr, &d.view(), self.coors.nrows()));
+        }
+    }
+
+    ///
+    /// 部分原子移动后, 增量更新缓存中所有半径的sa平面
+    /// * `moved`: 移动的原子索引
+    /// * `coors`: 移动后的坐标, 与`moved`一一对应
+    ///
+    /// 只重新计算与移动原子(移动前或移动后)相交的原子上的点, 其余原子的点保持不变;
+    /// 受影响的原子通过近邻表查找, 计算量只与移动原子附近的原子数有关
+    ///
+    pub fn update(&mut self, moved: &[usize], coors: &ArrayView2<'_, f64>) {
+        let old = self.coors.select(Axis(0), moved);
+        for (i, a) in moved.iter().enumerate() {
+            self.coors.row_mut(*a).assign(&coors.row(i));
+            self.cells.move_point(
+                *a,
+                &[old[[i, 0]], old[[i, 1]], old[[i, 2]]],
+                &[coors[[i, 0]], coors[[i, 1]], coors[[i, 2]]],
+            );
+        }
+
+        for k in 0..self.cache.len() {
+            let pr = self.cache[k].pr;
+            let affected = self.affected_atoms(moved, &old.view(), pr);
+            let counts = affected
+                .iter()
+                .map(|a| self.count(pr, *a))
+                .collect::<Vec<usize>>();
+            let data = sa_surface_atoms_with(
+                &self.coors.view(),
+                &self.radis_v,
+                &counts,
+                pr,
+                &affected,
+                &self.cells,
+                self.max_r,
+            );
+            self.cache[k].replace(&affected, &data.view());
+        }
+    }
+
+    ///
+    /// 在辅助半径`pr`下, 与移动原子移动前(`old`)或移动后相交的原子, 包括移动原子本身
+    ///
+    fn affected_atoms(&self, moved: &[usize], old: &ArrayView2<'_, f64>, pr: f64) -> Vec<usize> {
+        let coors = self.coors.view();
+        let mut affected = BTreeSet::new();
+        for (i, a) in moved.iter().enumerate() {
+            let ra = self.radis_v[*a] + pr;
+            let reach = (ra + self.max_r + pr).powi(2);
+            let positions = [
+                [coors[[*a, 0]], coors[[*a, 1]], coors[[*a, 2]]],
+                [old[[i, 0]], old[[i, 1]], old[[i, 2]]],
+            ];
+            for p in positions.iter() {
+                for (j, d) in self.cells.within_reach(&coors, p, reach) {
+                    if d < (ra + self.radis_v[j] + pr).powi(2) {
+                        affected.insert(j);
+                    }
+                }
+            }
+        }
+        affected.into_iter().collect()
+    }
+
+    ///
+    /// 计算`pr` 对应结果中, 每个原子留存均分点的百分比以及对应的面积
+    ///
+    pub fn per_atom_sasa(&mut self, pr: f64) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+        let dots = self.sa_surface(pr, true);
+        count_per_atom(&dots.view(), &self.radis_v, &self.counts(pr), pr)
     }
 }
 
@@ -192,6 +423,77 @@ pub fn sa_surface(
     sa_surface_core(coors, &radis_v, count, pr, index)
 }
 
+///
+/// 计算每个原子的sasa
+/// * `coors` : 原子坐标集合
+/// * `elements` : 原子名称列表
+/// * `n` : 球均分点数
+/// * `pr` : 补充半径
+///
+/// 返回`(m, 2)`矩阵, 第一列为原子球上留存点的百分比, 第二列为面积(Å²)
+///
+pub fn per_atom_sasa(
+    coors: &ArrayView2<'_, f64>,
+    elements: Option<&Vec<&str>>,
+    n: usize,
+    pr: f64,
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    let mut radis_v = vec![0.; coors.nrows()];
+    get_vdw_vec(elements, &mut radis_v);
+
+    let dots = sa_surface_core(coors, &radis_v, n, Some(pr), true);
+    count_per_atom(&dots.view(), &radis_v, &vec![n; radis_v.len()], pr)
+}
+
+///
+/// 按点密度求sa平面, 每个原子的均分点数由`dot_counts`决定
+/// * `coors` : 原子坐标集合
+/// * `elements` : 原子名称列表
+/// * `density` : 每Å²的点数
+/// * `pr` : 补充半径
+/// * `index`: 返回矩阵是否包含index
+///
+pub fn sa_surface_density(
+    coors: &ArrayView2<'_, f64>,
+    elements: Option<&Vec<&str>>,
+    density: f64,
+    pr: f64,
+    index: bool,
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    let mut radis_v = vec![0.; coors.nrows()];
+    get_vdw_vec(elements, &mut radis_v);
+
+    let atoms = (0..coors.nrows()).collect::<Vec<usize>>();
+    let counts = dot_counts(&radis_v, pr, density);
+    let dots = sa_surface_atoms(coors, &radis_v, &counts, pr, &atoms);
+    get_with_index(&dots.view(), index)
+}
+
+///
+/// 一次遍历sa平面点集合(第4列为原子索引), 统计每个原子留存的点数
+/// * `n`: 每个原子的均分点数
+///
+fn count_per_atom(
+    dots: &ArrayView2<'_, f64>,
+    radis_v: &Vec<f64>,
+    n: &[usize],
+    pr: f64,
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    let mut counts = vec![0usize; radis_v.len()];
+    for row in dots.axis_iter(Axis(0)) {
+        counts[row[3] as usize] += 1;
+    }
+
+    Array::from_shape_fn((radis_v.len(), 2), |(i, j)| {
+        let percent = counts[i] as f64 / n[i] as f64;
+        if j == 0 {
+            percent
+        } else {
+            4. * PI * (radis_v[i] + pr).powi(2) * percent
+        }
+    })
+}
+
 ///
 /// 求蛋白质sa平面点集合
 ///
@@ -261,6 +563,293 @@ fn sa_surface_core(
     Array::from_shape_vec((ddd.len() / col, col), ddd).unwrap()
 }
 
+///
+/// 一次计算多个补充半径的sa平面
+/// * `coors` : 原子坐标集合
+/// * `elements` : 原子名称列表
+/// * `n` : 球均分点数
+/// * `radii` : 补充半径集合
+///
+/// 返回按`radii`顺序拼接的点集合(含原子索引), 以及每个半径在其中的起始位置`offsets`,
+/// 第`k`个半径的结果为`dots[offsets[k]..offsets[k + 1]]`
+///
+pub fn sa_surface_multi(
+    coors: &ArrayView2<'_, f64>,
+    elements: Option<&Vec<&str>>,
+    n: usize,
+    radii: &[f64],
+) -> (ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>>, Vec<i64>) {
+    let mut radis_v = vec![0.; coors.nrows()];
+    get_vdw_vec(elements, &mut radis_v);
+
+    let data = sa_surface_multi_core(coors, &radis_v, n, radii);
+
+    let mut offsets = vec![0i64];
+    for d in &data {
+        offsets.push(offsets[offsets.len() - 1] + d.nrows() as i64);
+    }
+
+    let views = data.iter().map(|f| f.view()).collect::<Vec<_>>();
+    let dots = if views.is_empty() {
+        Array::zeros((0, 4))
+    } else {
+        concatenate(Axis(0), &views).unwrap()
+    };
+    (dots, offsets)
+}
+
+/// 同一组半径的近邻表, 最大与最小单元格边长之比的上限, 见`sa_surface_multi_core`
+const CELL_GROUP_RATIO: f64 = 1.5;
+
+///
+/// 多个半径共用单位球均分点, 一次遍历原子集合
+///
+/// 被遮挡的点在更大的半径下仍然被遮挡, 所以半径由小到大计算,
+/// 每个半径只需检查上一个半径留存的点
+///
+/// 半径按相交距离分组, 每组使用单元格边长为组内最大相交距离的近邻表,
+/// 避免小半径也按最大半径(如pas的20Å)的距离遍历几乎所有原子
+///
+fn sa_surface_multi_core(
+    coors: &ArrayView2<'_, f64>,
+    elements: &Vec<f64>,
+    n: usize,
+    radii: &[f64],
+) -> Vec<ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>>> {
+    let ball = dotsphere(n);
+
+    let mut order = (0..radii.len()).collect::<Vec<usize>>();
+    order.sort_by(|a, b| radii[*a].partial_cmp(&radii[*b]).unwrap());
+
+    // (最小相交距离, 最大相交距离, 组内半径序号)
+    let max_r = elements.iter().cloned().fold(0f64, f64::max);
+    let mut groups: Vec<(f64, f64, Vec<usize>)> = vec![];
+    for k in order {
+        let cutoff = 2. * (max_r + radii[k]);
+        if groups.last().map_or(false, |g| cutoff <= g.0 * CELL_GROUP_RATIO) {
+            let g = groups.last_mut().unwrap();
+            g.1 = cutoff;
+            g.2.push(k);
+        } else {
+            groups.push((cutoff, cutoff, vec![k]));
+        }
+    }
+    let cells = groups
+        .iter()
+        .map(|g| CellList::new(coors, g.1))
+        .collect::<Vec<_>>();
+
+    // 每个原子在每个半径下留存的点
+    let data = (0..coors.nrows())
+        .into_par_iter()
+        .map(|i| {
+            let c = [coors[[i, 0]], coors[[i, 1]], coors[[i, 2]]];
+
+            let mut alive = (0..n).collect::<Vec<usize>>();
+            let mut res = vec![Vec::<f64>::new(); radii.len()];
+
+            for (g, cell) in groups.iter().zip(cells.iter()) {
+                // 之后的半径不会再有留存的点
+                if alive.is_empty() {
+                    break;
+                }
+
+                // 近邻原子按距离排序, 近的原子优先判断, 被遮挡的点可以提前结束
+                let mut near = cell.within(coors, &c, g.1.powi(2));
+                near.sort_by(|a, b| a.1.partial_cmp(&b.1).unwrap());
+
+                for k in &g.2 {
+                    let pr = radii[*k];
+                    let r = elements[i] + pr;
+
+                    // 当前半径下与原子i相交的原子及其半径平方
+                    let contact = near
+                        .iter()
+                        .filter(|(j, d)| *d < (r + elements[*j] + pr).powi(2))
+                        .map(|(j, _)| (*j, (elements[*j] + pr).powi(2) - 1e-6))
+                        .collect::<Vec<_>>();
+
+                    let point = |j: usize| {
+                        [
+                            ball[[j, 0]] * r + c[0],
+                            ball[[j, 1]] * r + c[1],
+                            ball[[j, 2]] * r + c[2],
+                        ]
+                    };
+
+                    alive.retain(|j| !is_hidden(coors, &contact, &point(*j)));
+
+                    let v = &mut res[*k];
+                    for j in &alive {
+                        v.extend_from_slice(&point(*j));
+                        v.push(i as f64);
+                    }
+                }
+            }
+            res
+        })
+        .collect::<Vec<_>>();
+
+    (0..radii.len())
+        .map(|k| {
+            let v = data
+                .iter()
+                .flat_map(|f| f[k].iter().cloned())
+                .collect::<Vec<f64>>();
+            Array::from_shape_vec((v.len() / 4, 4), v).unwrap()
+        })
+        .collect()
+}
+
+///
+/// 生成分子的connolly surface
+/// * `coors` : 原子坐标集合
+/// * `elements` : 原子名称列表
+/// * `n` : 球均分点数
+/// * `pr` : 探测小球半径
+///
+/// 先生成sa平面作为探测小球球心, 再在探测小球上取点, 去除小球之间的重叠部分,
+/// 最后保留离原子距离的平方小于10.01的内层点. 两步都使用近邻表, 并按探测小球逐个计算,
+/// 不生成全部探测小球上的点
+///
+pub fn connolly_surface(
+    coors: &ArrayView2<'_, f64>,
+    elements: Option<&Vec<&str>>,
+    n: usize,
+    pr: f64,
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    let mut radis_v = vec![0.; coors.nrows()];
+    get_vdw_vec(elements, &mut radis_v);
+
+    // 探测小球球心, 使用近邻表计算(前三列为坐标)
+    let sas = sa_surface_multi_core(coors, &radis_v, n, &[pr]).remove(0);
+    let sas = sas.view();
+
+    let ball = dotsphere(n);
+    let probe_cells = CellList::new(&sas, 2. * pr);
+    let atom_cells = CellList::new(coors, 10.01f64.sqrt());
+    let r2 = pr.powi(2) - 1e-6;
+
+    let data = (0..sas.nrows())
+        .into_par_iter()
+        .map(|i| {
+            let c = [sas[[i, 0]], sas[[i, 1]], sas[[i, 2]]];
+
+            // 与当前探测小球相交的其他小球
+            let contact = probe_cells
+                .within(&sas, &c, (2. * pr).powi(2))
+                .into_iter()
+                .map(|(j, _)| (j, r2))
+                .collect::<Vec<_>>();
+
+            let mut v = vec![];
+            for j in 0..n {
+                let b = [
+                    ball[[j, 0]] * pr + c[0],
+                    ball[[j, 1]] * pr + c[1],
+                    ball[[j, 2]] * pr + c[2],
+                ];
+                if !is_hidden(&sas, &contact, &b) && atom_cells.any_within(coors, &b, 10.01) {
+                    v.extend_from_slice(&b);
+                    v.push(1.);
+                }
+            }
+            v
+        })
+        .collect::<Vec<_>>()
+        .concat();
+
+    Array::from_shape_vec((data.len() / 4, 4), data).unwrap()
+}
+
+///
+/// 只计算`atoms`中原子上的sa平面点(含原子索引)
+/// * `counts`: `atoms`中每个原子的均分点数
+///
+fn sa_surface_atoms(
+    coors: &ArrayView2<'_, f64>,
+    elements: &Vec<f64>,
+    counts: &[usize],
+    pr: f64,
+    atoms: &[usize],
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    let max_r = elements.iter().cloned().fold(0f64, f64::max);
+    let cells = CellList::new(coors, 2. * (max_r + pr));
+    sa_surface_atoms_with(coors, elements, counts, pr, atoms, &cells, max_r)
+}
+
+///
+/// 同`sa_surface_atoms`, 使用已有的近邻表
+/// * `cells`: `coors`的近邻表, 单元格边长任意
+/// * `max_r`: 最大的原子半径
+///
+fn sa_surface_atoms_with(
+    coors: &ArrayView2<'_, f64>,
+    elements: &Vec<f64>,
+    counts: &[usize],
+    pr: f64,
+    atoms: &[usize],
+    cells: &CellList,
+    max_r: f64,
+) -> ArrayBase<OwnedRepr<f64>, Dim<[usize; 2]>> {
+    // 每种均分点数只生成一次单位球
+    let mut balls = HashMap::new();
+    for n in counts {
+        balls.entry(*n).or_insert_with(|| dotsphere(*n));
+    }
+
+    let max_r = max_r + pr;
+
+    let data = (0..atoms.len())
+        .into_par_iter()
+        .map(|k| {
+            let i = atoms[k];
+            let c = [coors[[i, 0]], coors[[i, 1]], coors[[i, 2]]];
+            let r = elements[i] + pr;
+            let n = counts[k];
+            let ball = &balls[&n];
+
+            // 与原子i相交的原子及其半径平方
+            let contact = cells
+                .within_reach(coors, &c, (r + max_r).powi(2))
+                .into_iter()
+                .filter(|(j, d)| *d < (r + elements[*j] + pr).powi(2))
+                .map(|(j, _)| (j, (elements[j] + pr).powi(2) - 1e-6))
+                .collect::<Vec<_>>();
+
+            let mut v = Vec::<f64>::with_capacity(n * 4);
+            for j in 0..n {
+                let b = [
+                    ball[[j, 0]] * r + c[0],
+                    ball[[j, 1]] * r + c[1],
+                    ball[[j, 2]] * r + c[2],
+                ];
+                if !is_hidden(coors, &contact, &b) {
+                    v.extend_from_slice(&b);
+                    v.push(i as f64);
+                }
+            }
+            v
+        })
+        .collect::<Vec<_>>()
+        .concat();
+
+    Array::from_shape_vec((data.len() / 4, 4), data).unwrap()
+}
+
+///
+/// 点`b`是否在`contact`(原子索引, 半径平方)中任一原子内
+///
+#[inline]
+fn is_hidden(coors: &ArrayView2<'_, f64>, contact: &[(usize, f64)], b: &[f64; 3]) -> bool {
+    contact.iter().any(|(a, r2)| {
+        let r1 = (coors[[*a, 0]] - b[0]).powi(2)
+            + (coors[[*a, 1]] - b[1]).powi(2)
+            + (coors[[*a, 2]] - b[2]).powi(2);
+        r1 < *r2
+    })
+}
+
 ///
 /// 利用缓存数据,计算蛋白质sa平面点集合
 ///
@@ -407,6 +996,129 @@ mod tests {
         assert_eq!(d1.shape()[0], d.shape()[0]);
     }
 
+    #[test]
+    fn test_per_atom_sasa() {
+        let a = array![[0., 0., 0.], [0., 0., 1.7], [0., 0., 10.7]];
+        let b = vec!["C", "O", "CD1"];
+        let n = 100;
+
+        let d = sa_surface(&a.view(), Some(&b), Some(n), Some(DEFAULT_PTR), true);
+        let s = per_atom_sasa(&a.view(), Some(&b), n, DEFAULT_PTR);
+
+        assert_eq!(s.nrows(), 3);
+        // 孤立原子的点全部留存
+        assert_eq!(s[[2, 0]], 1.);
+        assert!((s[[2, 1]] - 4. * PI * (1.7f64 + DEFAULT_PTR).powi(2)).abs() < 1e-9);
+        let total = s.column(0).sum() * n as f64;
+        assert_eq!(total.round() as usize, d.nrows());
+    }
+
+    #[test]
+    fn test_sa_surface_multi() {
+        let a = array![[0., 0., 0.], [0., 0., 1.7], [0., 0., 10.7], [3., 2., 4.]];
+        let b = vec!["C", "O", "CD1", "N"];
+        let n = 200;
+        let radii = [7.0, 1.4, 2.1, 20.];
+
+        let (dots, offsets) = sa_surface_multi(&a.view(), Some(&b), n, &radii);
+        assert_eq!(offsets.len(), radii.len() + 1);
+        assert_eq!(offsets[radii.len()] as usize, dots.nrows());
+
+        for (k, pr) in radii.iter().enumerate() {
+            let d = sa_surface(&a.view(), Some(&b), Some(n), Some(*pr), true);
+            assert_eq!((offsets[k + 1] - offsets[k]) as usize, d.nrows());
+        }
+
+        let mut p = Protein::new(a.view(), Some(&b), n);
+        p.sa_surface_multi(&radii);
+        let d = p.sa_surface(7.0, true);
+        assert_eq!((offsets[1] - offsets[0]) as usize, d.nrows());
+
+        // 分层的半径与pas半径一起计算时分成多组近邻表, 结果与逐个半径计算相同
+        let radii = [7.0, 6.3, 5.6, 4.9, 4.2, 3.5, 2.8, 2.1, 20.];
+        let (dots, offsets) = sa_surface_multi(&a.view(), Some(&b), n, &radii);
+        for (k, pr) in radii.iter().enumerate() {
+            let d = sa_surface(&a.view(), Some(&b), Some(n), Some(*pr), true);
+            assert_eq!((offsets[k + 1] - offsets[k]) as usize, d.nrows());
+        }
+        assert_eq!(offsets[radii.len()] as usize, dots.nrows());
+    }
+
+    #[test]
+    fn test_update() {
+        let a = array![[0., 0., 0.], [0., 0., 1.7], [0., 0., 10.7], [3., 2., 4.]];
+        let b = vec!["C", "O", "CD1", "N"];
+        let n = 200;
+
+        let mut p = Protein::new(a.view(), Some(&b), n);
+        p.sa_surface_multi(&[2.1, 7.0]);
+
+        // 移动第二个原子
+        let moved = array![[0., 1., 3.]];
+        p.update(&[1], &moved.view());
+
+        let mut a2 = a.clone();
+        a2.row_mut(1).assign(&moved.row(0));
+        for pr in [DEFAULT_PTR, 2.1, 7.0].iter() {
+            let d = sa_surface(&a2.view(), Some(&b), Some(n), Some(*pr), true);
+            assert_eq!(p.sa_surface(*pr, true).nrows(), d.nrows());
+        }
+
+        // 第四个原子移到远处, 跨越近邻表的单元格
+        let moved = array![[30., -20., 15.]];
+        p.update(&[3], &moved.view());
+        a2.row_mut(3).assign(&moved.row(0));
+        for pr in [DEFAULT_PTR, 2.1, 7.0].iter() {
+            let d = sa_surface(&a2.view(), Some(&b), Some(n), Some(*pr), true);
+            let s = p.sa_surface(*pr, true);
+            assert_eq!(s.nrows(), d.nrows());
+            // 缓存按原子顺序输出
+            assert!((1..s.nrows()).all(|i| s[[i - 1, 3]] <= s[[i, 3]]));
+        }
+    }
+
+    #[test]
+    fn test_density() {
+        let a = array![[0., 0., 0.], [0., 0., 1.7], [0., 0., 10.7], [3., 2., 4.]];
+        let b = vec!["C", "O", "CD1", "N"];
+
+        let mut radis_v = vec![0.; a.nrows()];
+        get_vdw_vec(Some(&b), &mut radis_v);
+
+        // 半径越大, 取的点越多
+        let small = dot_counts(&radis_v, DEFAULT_PTR, 1.);
+        let large = dot_counts(&radis_v, 7.0, 1.);
+        assert!((0..a.nrows()).all(|i| small[i] < large[i]));
+        assert_eq!(dot_counts(&radis_v, 100., 1.), vec![1000; a.nrows()]);
+
+        let d = sa_surface_density(&a.view(), Some(&b), 1., DEFAULT_PTR, true);
+        let mut p = Protein::with_density(a.view(), Some(&b), 100, Some(1.));
+        assert_eq!(p.sa_surface(DEFAULT_PTR, true).nrows(), d.nrows());
+
+        // 孤立原子的面积与解析值一致
+        let s = p.per_atom_sasa(DEFAULT_PTR);
+        assert!((s[[2, 1]] - 4. * PI * (1.7f64 + DEFAULT_PTR).powi(2)).abs() < 1e-9);
+
+        p.sa_surface_multi(&[2.1, 7.0]);
+        let d = sa_surface_density(&a.view(), Some(&b), 1., 7.0, true);
+        assert_eq!(p.sa_surface(7.0, true).nrows(), d.nrows());
+    }
+
+    #[test]
+    fn test_connolly_surface() {
+        let a = array![[0., 0., 0.], [0., 0., 2.7]];
+        let b = vec!["C", "O"];
+
+        let d = connolly_surface(&a.view(), Some(&b), 40, DEFAULT_PTR);
+        assert!(d.nrows() > 0);
+        // 所有点都是离原子较近的内层点
+        for row in d.axis_iter(Axis(0)) {
+            let d0 = row[0].powi(2) + row[1].powi(2) + row[2].powi(2);
+            let d1 = row[0].powi(2) + row[1].powi(2) + (row[2] - 2.7).powi(2);
+            assert!(d0 < 10.01 || d1 < 10.01);
+        }
+    }
+
     #[test]
     fn test_ndarray() {
         crate::config::init_config();
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+pocket 格点的埋藏度(buriedness)
+
+从每个格点沿 dotsphere 的 n 个方向发射射线, 以 spacing / 2 为步长前进 max_d,
+经过原子 vdw 球占据的格点即为被遮挡, 埋藏度为被遮挡射线的比例 (0 ~ 1)
+"""
+
+import numpy as np
+from sz_py_ext import buriedness as buriedness_rust
+
+from sitemap.core import vdw_radii
+from sitemap.hydrophobicity.grid_surface import rasterize
+from sitemap.hydrophobicity.mol_surface import dotsphere
+from sitemap.hydrophobicity.voxel_grid import VoxelGrid
+
+# 每次向量化计算的 (格点 × 射线 × 步数) 上限, 控制内存
+_CHUNK_SAMPLES = 1 << 22
+
+
+def occupancy(coors, elements, spacing=1):
+    """
+    原子 vdw 球占据的格点, 范围为 gen_grid 范围再向外扩展 max(vdw) 以上
+    返回 (grid, occupied)
+    """
+    coors = np.asarray(coors, dtype="float64")
+    radii = np.array([vdw_radii[e] for e in elements])
+    grid = VoxelGrid.from_coors(coors, spacing=spacing).padded(int(np.ceil(radii.max() / spacing)) + 1)
+    return (grid, rasterize(coors, radii, grid) >= 0)
+
+
+def buriedness(coors, elements, grids, n=30, max_d=20, spacing=1, enable_ext=True):
+    """
+    coors: 分子的xyz
+    elements: 分子中元素
+    grids: pocket 格点, 只使用前三列
+    n: 射线数, 方向为 dotsphere(n)
+    max_d: 射线长度
+    spacing: 原子占据格点的间距
+    返回每个格点的埋藏度, shape (len(grids),)
+    """
+    grids = np.asarray(grids, dtype="float64")[:, :3]
+    if enable_ext:
+        return buriedness_rust(coors, list(elements), grids, n, float(max_d), float(spacing))
+
+    grid, occupied = occupancy(coors, elements, spacing=spacing)
+    rays = dotsphere(n)
+    step = spacing / 2
+    t = step * np.arange(1, int(np.floor(max_d / step)) + 1)
+    shape = np.array(grid.shape)
+
+    blocked = np.zeros(len(grids))
+    chunk = max(1, _CHUNK_SAMPLES // max(1, n * len(t)))
+    for i in range(0, len(grids), chunk):
+        # 采样点所在(最近)的格点, 超出范围的采样点不会被遮挡
+        samples = grids[i : i + chunk, None, None, :] + t[None, None, :, None] * rays[None, :, None, :]
+        idx = np.floor((samples - grid.origin) / spacing + 0.5).astype(np.int64)
+        inside = np.all((idx >= 0) & (idx < shape), axis=3)
+        hit = np.zeros(inside.shape, dtype=bool)
+        hit[inside] = occupied[tuple(idx[inside].T)]
+        blocked[i : i + chunk] = np.count_nonzero(np.any(hit, axis=2), axis=1)
+    return blocked / n
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+空间哈希(cell list), 用于快速查找 cutoff 范围内的近邻原子
+
+把空间按 cutoff 划分成立方体单元格, 点只需与所在单元格及周围 26 个单元格中的原子计算距离,
+代替原来每个点与所有原子计算距离的做法
+"""
+
+import numpy as np
+
+# 当前单元格及周围 26 个单元格的偏移
+_OFFSETS = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)])
+
+# 每次向量化计算的 (点 × 原子) 对数上限, 控制内存
+_CHUNK_PAIRS = 1 << 21
+
+
+class CellList:
+    """
+    coors: 原子坐标, shape (m, 3)
+    cutoff: 单元格边长, 不能小于之后需要查询的最大距离
+    """
+
+    def __init__(self, coors, cutoff):
+        self.coors = np.asarray(coors, dtype="float64")[:, :3]
+        self.cutoff = float(cutoff)
+        self.origin = self.coors.min(axis=0) if len(self.coors) else np.zeros(3)
+
+        keys = self.cell_keys(self.coors)
+        self.shape = keys.max(axis=0) + 1 if len(keys) else np.ones(3, dtype=np.int64)
+        flat = np.ravel_multi_index(keys.T, self.shape) if len(keys) else np.zeros(0, dtype=np.int64)
+
+        # 按单元格排序后, 每个单元格的原子在 order 中是连续的一段
+        self.order = np.argsort(flat, kind="stable")
+        self.cells, self.starts, counts = np.unique(flat[self.order], return_index=True, return_counts=True)
+        self.ends = self.starts + counts
+
+    def cell_keys(self, points):
+        """点所在单元格的整数坐标"""
+        return np.floor((np.asarray(points)[:, :3] - self.origin) / self.cutoff).astype(np.int64)
+
+    def neighbors(self, key):
+        """返回 key 所在单元格及周围 26 个单元格中的原子序号"""
+        cells = key + _OFFSETS
+        cells = cells[np.all((cells >= 0) & (cells < self.shape), axis=1)]
+        if len(cells) == 0 or len(self.cells) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        flat = np.ravel_multi_index(cells.T, self.shape)
+        pos = np.minimum(np.searchsorted(self.cells, flat), len(self.cells) - 1)
+        pos = pos[self.cells[pos] == flat]
+        if len(pos) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self.order[s:e] for s, e in zip(self.starts[pos], self.ends[pos])])
+
+    def query(self, points, chunk_pairs=_CHUNK_PAIRS):
+        """
+        按单元格将 points 分组, 依次返回 (points 的序号, 近邻原子序号)
+        每组点的数量按 chunk_pairs 切分, 避免距离矩阵过大
+        """
+        keys = self.cell_keys(points)
+        if len(keys) == 0:
+            return
+
+        shift = keys.min(axis=0)
+        flat = np.ravel_multi_index((keys - shift).T, keys.max(axis=0) - shift + 1)
+        order = np.argsort(flat, kind="stable")
+        _, starts, counts = np.unique(flat[order], return_index=True, return_counts=True)
+
+        for s, c in zip(starts, counts):
+            idx = order[s : s + c]
+            atoms = self.neighbors(keys[idx[0]])
+            step = max(1, chunk_pairs // max(1, len(atoms)))
+            for i in range(0, len(idx), step):
+                yield (idx[i : i + step], atoms)
@@ -8,6 +8,7 @@ Created on Fri May  7 14:38:41 2021
 
 import numpy as np
 from sz_py_ext import cal_electro as cal_electro_rust
+from sz_py_ext import cal_electro_grid as cal_electro_grid_rust
 
 charged_dict = {
     "ASP_OD1": -0.5,
@@ -25,6 +26,7 @@ charged_dict = {
 
 
 def get_grids_elec(grids, charged_atoms, n=4):
+    """逐个格点调用 cal_electro, 见 cal_electro_grid"""
     elecs = np.zeros(len(grids))
     for index, grid in enumerate(grids):
         # grid = grid.reshape((1,3))
@@ -45,6 +47,15 @@ def cal_electro(grid, charged_atoms, n=4):
     return cal_electro_rust(grid, charged_atoms, n)
 
 
+def cal_electro_grid(grids, charged_atoms, n=4):
+    """
+    所有格点的静电势, 与 get_grids_elec 相同, 一次调用 rust 扩展并行计算
+    grids: 格点, 只使用前三列
+    """
+    grids = np.ascontiguousarray(np.asarray(grids, dtype="float64")[:, :3])
+    return cal_electro_grid_rust(grids, np.asarray(charged_atoms, dtype="float64"), n)
+
+
 def join(r, e):
     r_e = []
     for i in zip(r, e):
@@ -70,4 +81,4 @@ def get_charge(coors, r_e):
 def run_electrosatatic(grids, coors, eles, residue_names):
     r_e = join(residue_names, eles)
     charged = get_charge(coors, r_e)
-    return get_grids_elec(grids, charged, n=4)
+    return cal_electro_grid(grids, charged, n=4)
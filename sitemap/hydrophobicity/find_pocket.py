@@ -10,11 +10,19 @@ Created on Mon Apr 12 09:03:24 2021
 
 import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
 from sz_py_ext import find_layer
 from sz_py_ext import find_pocket as find_pocket_rust
 
 from sitemap.core import vdw_radii
-from sitemap.hydrophobicity.mol_surface import sa_surface
+from sitemap.hydrophobicity.mol_surface import sa_surface, sa_surface_multi
+from sitemap.hydrophobicity.voxel_grid import (
+    BlockVoxelGrid,
+    VoxelGrid,
+    grid_bounds,
+    remove_within_points,
+    within_any,
+)
 
 probe_radiis = {
     7.0: -993,
@@ -59,11 +67,8 @@ def sas_search_del(coors, elements, grids, pr=1.4):
     grids: 为该分子生成的格点，np.array
     pr: 伸长的半径，一般为水分子的半径 1.4
     """
-    for index, coor in enumerate(coors):  # 循环原子
-        r = vdw_radii[elements[index]] + pr
-        d_ma = np.sum(np.square(coor - grids), axis=1)
-        grids = grids[d_ma > np.square(r)]
-    return grids
+    radii = np.array([vdw_radii[e] for e in elements]) + pr
+    return remove_within_points(grids, coors, radii)
 
 
 def pas_search_for_water(grids, pas, n=40, pr=20):
@@ -74,11 +79,7 @@ def pas_search_for_water(grids, pas, n=40, pr=20):
     elements:分子的元素
     grids:经过sa_search_* 处理之后的格点
     """
-
-    for coor in pas[:, :-1]:  # 循环pas中的每个点
-        d_ma = np.sum(np.square(coor - grids), axis=1)
-        grids = grids[d_ma > np.square(pr - 4.4)]
-    return grids
+    return remove_within_points(grids, pas[:, :3], pr - 4.4)
 
 
 def pas_search_for_pocket(grids, pas, n=40, pr=20):
@@ -87,41 +88,137 @@ def pas_search_for_pocket(grids, pas, n=40, pr=20):
     找到所有以 pas 为圆心，半径=pr 圆内所有的 格点
     grids:经过sa_search_* 处理之后的格点
     """
-    for coor in pas[:, :3]:  # 循环pas中的每个点
-        d_ma = np.sum(np.square(coor - grids), axis=1)
-        grids = grids[d_ma > np.square(pr)]
-    return grids
+    return remove_within_points(grids, pas[:, :3], pr)
 
 
 def pocket_search(water_grids, pocket_grids):
-    for point in pocket_grids:
-        d_ma = np.sum(np.square(point - water_grids), axis=1)
-        water_grids = water_grids[d_ma > 1.0]
-    return water_grids
+    """
+    去除与任一 pocket 格点距离不超过 1 的水格点, 一次 KD-tree 查询每个水格点最近的 pocket 格点
+    """
+    return water_grids[~within_any(water_grids, pocket_grids, 1.0, inclusive=True)]
+
+
+def roi_atoms(roi, atoms_coors, elements, pr):
+    """
+    计算 roi 内的格点需要的原子, 见 Roi.atoms
+    返回 (原子序号, 坐标, 元素)
+    """
+    radii = np.array([vdw_radii[e] for e in elements])
+    atoms = roi.atoms(atoms_coors, radii, pr)
+    return (atoms, np.asarray(atoms_coors)[atoms], [elements[i] for i in atoms])
 
 
-def find_pocket(atoms_coors, elements, n=40, pas_r=20, enable_ext=True):
+def find_pocket(atoms_coors, elements, n=40, pas_r=20, enable_ext=True, density=None, roi=None, spacing=1, coarse=None):
+    """
+    density: 点密度(每 Å² 的点数), 设置后代替 n, 见 sa_surface
+    roi: 只返回该区域内的 pocket 格点, 见 Roi, 只用区域附近的原子计算
+    spacing: 格点间距, 只有 python 版, enable_ext=True 时不为 1 则报错
+    coarse: 设置时先在该间距的粗格点上找候选区域, 再细化到 spacing, 见 pocket_voxels_adaptive,
+        只有 python 版, enable_ext=True 时报错
+    """
 
     if enable_ext:
-        return find_pocket_rust(atoms_coors, elements, n, pas_r)
+        if coarse is not None:
+            raise ValueError("coarse is only supported with enable_ext=False")
+        if spacing != 1:
+            raise ValueError("spacing other than 1 is only supported with enable_ext=False")
+        if roi is None:
+            return find_pocket_rust(atoms_coors, elements, n, pas_r, density)
+        _, coors, eles = roi_atoms(roi, atoms_coors, elements, pas_r)
+        grids = find_pocket_rust(coors, eles, n, pas_r, density)
+        return grids[roi.contains(grids)]
+
+    if coarse is not None:
+        return pocket_voxels_adaptive(
+            atoms_coors, elements, n=n, pas_r=pas_r, coarse=coarse, spacing=spacing, density=density, roi=roi
+        ).coordinates()
+    grid = pocket_voxels(atoms_coors, elements, n=n, pas_r=pas_r, density=density, roi=roi, spacing=spacing)
+    return grid.coordinates()
+
+
+def pocket_voxels(atoms_coors, elements, n=40, pas_r=20, density=None, roi=None, spacing=1):
+    """
+    python 版 find_pocket, 返回 VoxelGrid, mask 为 pocket 格点
+    roi: 格点只取该区域内的部分, 格点位置与全蛋白时相同
+    spacing: 格点间距
+    """
+    grid = VoxelGrid.from_coors(atoms_coors, spacing=spacing)
+    if roi is not None:
+        grid = roi.crop(grid)
+        _, atoms_coors, elements = roi_atoms(roi, atoms_coors, elements, pas_r)
+
+    radii = np.array([vdw_radii[e] for e in elements])
+    pas = sa_surface(atoms_coors, elements, n=n, pr=pas_r, enable_ext=True, index=False, density=density)
+    if roi is not None:
+        pas = pas[roi.near(pas, pas_r)]
+    grid.remove_within(atoms_coors, radii + 1.4)
+    grid.remove_within(pas, pas_r)
+    return grid
+
+
+def pocket_voxels_adaptive(atoms_coors, elements, n=40, pas_r=20, coarse=3, spacing=1, density=None, roi=None):
+    """
+    先粗后细的 python 版 find_pocket, 结果与 pocket_voxels(spacing=spacing) 相同, 只有 python 版
+    1) 细格点每 m×m×m 个为一块 (m = coarse / spacing), 块的中心为粗格点
+    2) 粗格点离原子或 pas 点的距离不超过 r - h (h 为块中心到块内格点的最大距离) 时, 整块都会被去除,
+       在粗格点上去除这些块, 剩下的块为候选区域
+    3) 只对候选块内的细格点逐个查询最近的原子和 pas 点
+    不分配完整的细格点 mask, 返回 BlockVoxelGrid, 只保存还有 pocket 格点的块
+    """
+    m = max(1, int(round(coarse / spacing)))
+    origin, shape = grid_bounds(atoms_coors, spacing=spacing)
+    if roi is not None:
+        lo, shape = roi.crop_bounds(origin, spacing, shape)
+        origin = origin + lo * spacing
+        _, atoms_coors, elements = roi_atoms(roi, atoms_coors, elements, pas_r)
+
+    radii = np.array([vdw_radii[e] for e in elements]) + 1.4
+    pas = sa_surface(atoms_coors, elements, n=n, pr=pas_r, enable_ext=True, index=False, density=density)
+    if roi is not None:
+        pas = pas[roi.near(pas, pas_r)]
+    spheres = [(np.asarray(atoms_coors), radii), (pas[:, :3], np.full(len(pas), float(pas_r)))]
+
+    h = (m - 1) / 2 * spacing * np.sqrt(3) + 1e-6
+    blocks = VoxelGrid(origin + (m - 1) / 2 * spacing, m * spacing, -(-np.array(shape) // m))
+    for centers, r in spheres:
+        keep = r > h
+        blocks.remove_within(centers[keep], r[keep] - h)
 
-    pas = sa_surface(atoms_coors, elements, n=n, pr=pas_r, enable_ext=True, index=False)
-    pocket_grids = gen_grid(atoms_coors, n=1)
-    pocket_grids = sas_search_del(atoms_coors, elements, pocket_grids, pr=1.4)
-    pocket_grids = pas_search_for_pocket(pocket_grids, pas, n=n, pr=pas_r)
-    return pocket_grids
+    # 候选块内的细格点, 每块 m³ 个连续排列
+    keys = np.argwhere(blocks.mask)
+    idx = (keys[:, None, :] * m + np.argwhere(np.ones((m,) * 3, dtype=bool))).reshape(-1, 3)
+    keep = np.all(idx < shape, axis=1)
+    if roi is not None:
+        keep[keep] = roi.contains(origin + idx[keep] * spacing)
+    for centers, r in spheres:
+        for v in np.unique(r):
+            sel = np.nonzero(keep)[0]
+            keep[sel[within_any(origin + idx[sel] * spacing, centers[r == v], v, inclusive=True)]] = False
 
+    keep = keep.reshape(len(keys), m, m, m)
+    alive = np.nonzero(keep.any(axis=(1, 2, 3)))[0]
+    return BlockVoxelGrid(origin, spacing, shape, m, {tuple(keys[i]): keep[i] for i in alive})
 
-def find_water(atoms_coors, elements, n=40, pas_r=20):
+
+def find_water(atoms_coors, elements, n=40, pas_r=20, distance=False):
+    """
+    返回 (water_grids, pocket_grids)
+    distance: water_grids 增加第4列, 为到最近的原子(中心)的距离
+    """
+    radii = np.array([vdw_radii[e] for e in elements])
     pas = sa_surface(atoms_coors, elements, n=n, pr=pas_r)
-    pocket_grids = gen_grid(atoms_coors, n=1)
-    pocket_grids = sas_search_del(atoms_coors, elements, pocket_grids, pr=1.4)
-    pocket_grids = pas_search_for_pocket(pocket_grids, pas, n=n, pr=pas_r)
-
-    water_grids = gen_grid(atoms_coors, n=3, buffer=6)
-    water_grids = sas_search_del(atoms_coors, elements, water_grids, pr=1.4)
-    water_grids = pas_search_for_water(water_grids, pas, n=n, pr=pas_r)
-    water_grids = pocket_search(water_grids, pocket_grids)
+    pocket = VoxelGrid.from_coors(atoms_coors, spacing=1)
+    pocket.remove_within(atoms_coors, radii + 1.4)
+    pocket.remove_within(pas, pas_r)
+    pocket_grids = pocket.coordinates()
+
+    water = VoxelGrid.from_coors(atoms_coors, spacing=3, buffer=6)
+    water.remove_within(atoms_coors, radii + 1.4)
+    water.remove_within(pas, pas_r - 4.4)
+    water_grids = pocket_search(water.coordinates(), pocket_grids)
+    if distance:
+        d, _ = cKDTree(atoms_coors).query(water_grids)
+        water_grids = np.insert(water_grids, 3, d, axis=1)
     return (water_grids, pocket_grids)
 
 
@@ -130,20 +227,33 @@ def label_grids(grids, pas, pr=20):
     pas:protein accessible surface
 
     """
-    for coor in pas[:, :3]:  # 循环pas中的每个点
-        d_ma = np.sum(np.square(coor - grids[:, :3]), axis=1)
-        indexes = np.where((d_ma < np.square(pr)) & (grids[:, 3] == 0))
-        grids[indexes, 3] = probe_radiis[pr]
+    free = np.where(grids[:, 3] == 0)[0]
+    hit = within_any(grids[free, :3], pas, pr)
+    grids[free[hit], 3] = probe_radiis[pr]
     return grids
 
 
-def layer_grids(coors, eles, n=40, pr=20, enable_ext=True):
+def layer_grids(coors, eles, n=40, pr=20, enable_ext=True, density=None, roi=None):
+    """
+    density: 点密度(每 Å² 的点数), 设置后代替 n, 大半径的层级会取更多的点
+    roi: 只返回该区域内的格点, 见 find_pocket
+    """
     if enable_ext:
-        return find_layer(coors, eles, n, pr)
-
-    pocket_grids = find_pocket(coors, eles, n=n, pas_r=pr)
-    grids = np.insert(pocket_grids, 3, 0, axis=1)  # 标记为0
-    for pr in probe_radiis:
-        surface_points = sa_surface(coors, eles, n=n, pr=pr)
-        labeled_grids = label_grids(grids, surface_points, pr=pr)
-    return labeled_grids
+        if roi is None:
+            return find_layer(coors, eles, n, pr, density)
+        _, sub_coors, sub_eles = roi_atoms(roi, coors, eles, pr)
+        grids = find_layer(sub_coors, sub_eles, n, pr, density)
+        return grids[roi.contains(grids)]
+
+    grid = pocket_voxels(coors, eles, n=n, pas_r=pr, density=density, roi=roi)
+
+    # 一次计算所有层级的 sa surface, 一次完成所有层级的标记
+    radiis = list(probe_radiis)
+    if roi is not None:
+        _, coors, eles = roi_atoms(roi, coors, eles, max(radiis))
+    dots, offsets = sa_surface_multi(coors, eles, n=n, radii=radiis, density=density)
+    shells = [dots[offsets[i] : offsets[i + 1]] for i in range(len(radiis))]
+    if roi is not None:
+        shells = [d[roi.near(d, r)] for d, r in zip(shells, radiis)]
+    grid.label_layers([(shells[i], pr, probe_radiis[pr]) for i, pr in enumerate(radiis)])
+    return grid.to_array()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+基于格点的 SAS / SES 以及 pocket 计算
+1) 在 gen_grid 生成的格点上标记原子 vdw 球内的格点
+2) 对其余格点查询最近的原子, 得到每个格点到分子 vdw 表面的距离
+3) 对距离取阈值即可得到任意 probe 半径的 SAS / SES, probe 可达区域; pocket 以及分层还需要对 SAS 内部做
+   Euclidean distance transform, 得到到 SAS 平面的距离
+
+计算量只与格点数有关, 与球面取点数 n 无关, 精度由格点间距 spacing 控制
+"""
+
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+from sitemap.core import vdw_radii
+from sitemap.hydrophobicity.find_pocket import probe_radiis
+from sitemap.hydrophobicity.voxel_grid import VoxelGrid
+
+
+def rasterize(coors, radii, grid):
+    """
+    标记所有在原子 vdw 球内的格点, 返回 shape 与 grid.shape 相同的数组,
+    球内格点为所在原子的序号(多个原子时取其一), 球外为 -1
+    相同半径的原子共用一组球内格点偏移, 一次向量化计算
+    """
+    shape, origin, spacing = grid.shape, grid.origin, grid.spacing
+    owner = np.full(shape, -1, dtype=np.int64)
+
+    for r in np.unique(radii):
+        k = int(np.ceil(r / spacing)) + 1
+        offsets = np.stack(np.meshgrid(*[np.arange(-k, k + 1)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+        ids = np.nonzero(radii == r)[0]
+        atoms = coors[ids]
+        base = np.floor((atoms - origin) / spacing).astype(np.int64)
+
+        step = max(1, (1 << 21) // len(offsets))
+        for i in range(0, len(atoms), step):
+            idx = base[i : i + step, None, :] + offsets[None, :, :]
+            d = np.sum(np.square(origin + idx * spacing - atoms[i : i + step, None, :]), axis=2)
+            hit = (d < r * r) & np.all((idx >= 0) & (idx < shape), axis=2)
+            owner[tuple(idx[hit].T)] = np.broadcast_to(ids[i : i + step, None], hit.shape)[hit]
+    return owner
+
+
+def distance_map(coors, elements, spacing=1, pad=0, return_normals=False):
+    """
+    每个格点到分子 vdw 表面的距离, vdw 球内的格点为 0
+    coors: 分子的xyz
+    elements: 分子中元素
+    spacing: 格点间距
+    pad: 格点在分子外额外扩展的距离, 需要不小于之后用到的最大 probe 半径
+    return_normals: 是否同时返回 normals, 见 boundary_distance
+    返回 (grid, k, dist): grid 为 gen_grid 范围每个方向向外扩展 k 个格点后的 VoxelGrid;
+    return_normals 时为 (grid, k, dist, normals), normals 为每个格点从最近原子中心指向格点的单位向量,
+    shape 为 grid.shape + (3,), vdw 球内的格点为 0
+
+    EDT 只给出到最近的球内格点的距离, 会比到 vdw 表面的距离偏大(最多约半个格点对角线), 而最近球内格点所在的原子
+    在原子重叠处也不一定是表面最近的原子(误差可达 0.7 Å), 因此在最近的 8 个原子中心中取表面距离最小的原子,
+    用到该原子表面的精确距离代替; 原子半径相差不到 1 Å, 8 个已足够
+    """
+    coors = np.asarray(coors, dtype="float64")
+    radii = np.array([vdw_radii[e] for e in elements])
+    k = int(np.ceil((pad + radii.max()) / spacing))
+    grid = VoxelGrid.from_coors(coors, spacing=spacing).padded(k)
+    owner = rasterize(coors, radii, grid)
+
+    free = owner < 0
+    points = grid.origin + np.argwhere(free) * spacing
+    d, j = cKDTree(coors).query(points, k=min(8, len(coors)))
+    d, j = d.reshape(len(points), -1), j.reshape(len(points), -1)
+    nearest = j[np.arange(len(j)), np.argmin(d - radii[j], axis=1)]
+
+    delta = points - coors[nearest]
+    norm = np.sqrt(np.sum(np.square(delta), axis=1))
+    dist = np.zeros(owner.shape)
+    dist[free] = np.maximum(norm - radii[nearest], 0)
+    if not return_normals:
+        return (grid, k, dist)
+    normals = np.zeros(owner.shape + (3,))
+    normals[free] = delta / np.maximum(norm, 1e-12)[:, None]
+    return (grid, k, dist, normals)
+
+
+def sas_mask(dist, pr=1.4):
+    """solvent accessible surface 以内(probe 球心无法到达)的格点"""
+    return dist < pr
+
+
+def accessible_mask(dist, pr=1.4):
+    """probe 球心可以到达的格点"""
+    return dist >= pr
+
+
+def ses_mask(dist, pr=1.4, spacing=1):
+    """
+    solvent excluded surface 以内的格点:
+    离所有 probe 可到达的球心都超过 pr, 即 probe 无法覆盖的区域
+    """
+    return ndimage.distance_transform_edt(sas_mask(dist, pr), sampling=spacing) > pr
+
+
+def boundary_distance(dist, pr, spacing=1, normals=None):
+    """
+    每个格点到半径为 pr 的 SAS 平面的距离
+    SAS 外的格点为 dist - pr; SAS 内的格点没有 normals 时为 EDT 得到的到最近 SAS 外格点的距离, 比到平面的距离偏大.
+    有 normals(见 distance_map) 时, 用 EDT 的 return_indices 找到最近的 SAS 外格点 q, q 沿法向退回 dist(q) - pr
+    得到其最近原子 SAS 球面上的点, 该点不在其他原子的 SAS 内, 即为 SAS 平面上的点, 用到该点的精确距离代替
+    """
+    inside = sas_mask(dist, pr)
+    if normals is None:
+        return np.where(inside, ndimage.distance_transform_edt(inside, sampling=spacing), dist - pr)
+
+    indices = ndimage.distance_transform_edt(inside, sampling=spacing, return_distances=False, return_indices=True)
+    q = tuple(indices[:, inside])
+    surface = np.stack(q, axis=1) * spacing - (dist[q] - pr)[:, None] * normals[q]
+    res = dist - pr
+    res[inside] = np.sqrt(np.sum(np.square(np.argwhere(inside) * spacing - surface), axis=1))
+    return res
+
+
+def pocket_mask(dist, spacing=1, pas_r=20, normals=None):
+    """
+    与 find_pocket 相同的规则:
+    去除 vdw + 1.4 以内的格点, 以及离 pas(半径为 pas_r 的 SAS 平面) 距离在 pas_r 以内的格点
+    normals: 见 boundary_distance
+    """
+    return (dist > 1.4) & (boundary_distance(dist, pas_r, spacing=spacing, normals=normals) > pas_r)
+
+
+def layer_labels(dist, spacing=1, mask=None, normals=None):
+    """
+    与 label_grids 相同的分层规则, probe 半径由大到小,
+    离该半径 SAS 平面距离在 pr 以内且未被标记的格点标记为 probe_radiis[pr]
+    normals: 见 boundary_distance
+    """
+    labels = np.zeros(dist.shape)
+    for pr in probe_radiis:
+        near = (boundary_distance(dist, pr, spacing=spacing, normals=normals) < pr) & (labels == 0)
+        if mask is not None:
+            near &= mask
+        labels[near] = probe_radiis[pr]
+    return labels
+
+
+def pocket_voxels_edt(coors, elements, spacing=1, pas_r=20, layer=False):
+    """
+    格点版 find_pocket, 返回 gen_grid 范围内的 VoxelGrid, mask 为 pocket 格点
+    layer: 是否同时按 label_grids 的规则分层, 结果写入 labels
+    """
+    grid, k, dist, normals = distance_map(coors, elements, spacing=spacing, pad=pas_r + spacing, return_normals=True)
+    grid.mask = pocket_mask(dist, spacing=spacing, pas_r=pas_r, normals=normals)
+    if layer:
+        grid.labels = layer_labels(dist, spacing=spacing, mask=grid.mask, normals=normals)
+    return grid.cropped(k)
+
+
+def find_pocket_edt(coors, elements, spacing=1, pas_r=20):
+    """格点版 find_pocket, 返回 pocket 格点坐标"""
+    return pocket_voxels_edt(coors, elements, spacing=spacing, pas_r=pas_r).coordinates()
+
+
+def layer_grids_edt(coors, elements, spacing=1, pas_r=20):
+    """格点版 layer_grids, 返回 pocket 格点坐标以及分层标记"""
+    return pocket_voxels_edt(coors, elements, spacing=spacing, pas_r=pas_r, layer=True).to_array()
@@ -2,13 +2,89 @@
 分组依据为两个点相邻（delta X + delta Y + delta Z )= 1
 若A与B相邻，B和C相邻，则A与C也为同一组
 实际为 并查集 问题
-进一步优化： 现有程序为 广度优先搜索，时间复杂度为n^2.
-可以用 并查集 进一步优化"""
+gen_isadjacent + group_pocket 为 广度优先搜索，时间与内存都为 n^2, 只适合少量格点.
+group_pockets 直接在格点的整数坐标上标记 6 邻接的连通区域, 时间与内存都与格点数成正比"""
 import numpy as np
+import pandas as pd
+from scipy import ndimage
+from sz_py_ext import group_pockets as group_pockets_rust
+
+from sitemap.hydrophobicity.find_pocket import probe_radiis
 
 np.set_printoptions(precision=4)
 
 
+def group_pockets(grids, spacing=1, enable_ext=True):
+    """
+    按 6 邻接(只有一个方向相差一个格点间距)将 pocket 格点分组
+    grids: 格点, shape (n, 3) 或 (n, 4), 只使用前三列
+    spacing: 格点间距
+    返回 (ids, sizes): ids 为每个格点所在组的序号, 按组内第一个格点出现的顺序从 0 开始编号;
+    sizes 为每个组的格点数
+    """
+    grids = np.asarray(grids, dtype="float64")
+    if enable_ext:
+        return group_pockets_rust(grids[:, :3], spacing)
+
+    if len(grids) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    idx = np.rint((grids[:, :3] - grids[:, :3].min(axis=0)) / spacing).astype(np.int64)
+    occupied = np.zeros(idx.max(axis=0) + 1, dtype=bool)
+    occupied[tuple(idx.T)] = True
+    labels, _ = ndimage.label(occupied, structure=ndimage.generate_binary_structure(3, 1))
+
+    # 按第一次出现的顺序重新编号
+    _, first, inverse = np.unique(labels[tuple(idx.T)], return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    ids = rank[inverse.ravel()]
+    return (ids, np.bincount(ids))
+
+
+def score_pockets(labels, layered_grids, hydro, spacing=1, buried=None):
+    """
+    用分组求和一次计算所有 pocket 的描述符, 并按 size_enclosure_score 从高到低排序
+    labels: 每个格点所在 pocket 的序号, 见 group_pockets
+    layered_grids: 分层后的格点, shape (n, 4), 见 layer_grids
+    hydro: 每个格点的疏水性, 如 run_hydrophobicity 结果的最后一列
+    spacing: 格点间距
+    buried: 可选, 每个格点的埋藏度(见 buriedness.buriedness), 设置时增加其平均值 buriedness 一列
+    返回 DataFrame, 每行一个 pocket:
+        size: 格点数; volume: 体积(Å³)
+        enclosure: 最大 probe 无法到达的格点比例
+        depth: 平均分层深度, 最大 probe 的层为 0, 所有 probe 都无法到达(标记为 0)为 1
+        buriedness: 平均埋藏度, 只在设置 buried 时存在
+        hydrophobicity: 平均疏水性
+        size_enclosure_score: 0.0733 * sqrt(size) + 0.6688 * enclosure, 只是 SiteMap SiteScore 中的大小和封闭项;
+            SiteScore 还要减去 0.20 * 亲水性, 而亲水性需要 SiteMap 的亲水性格点图, 这里不计算
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    hydro = np.asarray(hydro, dtype="float64")
+    sizes = np.bincount(labels)
+
+    # 标记值随 probe 半径减小而增大, 最后为未标记的 0, 排序后的位置即为分层深度
+    values = np.array(sorted(probe_radiis.values()) + [0])
+    depth = np.searchsorted(values, layered_grids[:, 3]) / (len(values) - 1)
+
+    enclosure = np.bincount(labels, weights=depth > 0, minlength=len(sizes)) / sizes
+    table = pd.DataFrame(
+        {
+            "pocket": np.arange(len(sizes)),
+            "size": sizes,
+            "volume": sizes * spacing ** 3,
+            "enclosure": enclosure,
+            "depth": np.bincount(labels, weights=depth, minlength=len(sizes)) / sizes,
+            "hydrophobicity": np.bincount(labels, weights=hydro, minlength=len(sizes)) / sizes,
+            "size_enclosure_score": 0.0733 * np.sqrt(sizes) + 0.6688 * enclosure,
+        }
+    )
+    if buried is not None:
+        buried = np.asarray(buried, dtype="float64")
+        table.insert(5, "buriedness", np.bincount(labels, weights=buried, minlength=len(sizes)) / sizes)
+    return table.sort_values("size_enclosure_score", ascending=False, kind="stable").reset_index(drop=True)
+
+
 def gen_isadjacent(grids):
     """
     判断格点与格点是否相邻，若相邻则为1.
@@ -6,42 +6,76 @@ Created on Tue Apr 20 16:37:11 2021
 
 计算pocket网格的疏水性
 """
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+from multiprocessing import cpu_count
+
 import numpy as np
 import pandas as pd
+from scipy.ndimage import map_coordinates
+from scipy.signal import fftconvolve
 from sz_py_ext import run_hydrophobicity
 
 from sitemap.core import mkdir_by_file, vdw_radii
-from sitemap.hydrophobicity.find_pocket import layer_grids
-from sitemap.hydrophobicity.mol_surface import sa_surface
+from sitemap.hydrophobicity.cell_list import CellList
+from sitemap.hydrophobicity.find_pocket import layer_grids, roi_atoms
+from sitemap.hydrophobicity.mol_surface import count_per_atom, dot_counts, sa_surface
 from sitemap.hydrophobicity.pdb_io import read_pdb, to_pdb, to_xyz
+from sitemap.hydrophobicity.roi import Roi
+from sitemap.hydrophobicity.voxel_grid import VoxelGrid
+
+logger = logging.getLogger(__name__)
 
 atomic_hydrophobicity_file_path = "data/atomic_hydrophobicity.csv"
 atomic_hydrophobicity = pd.read_csv(atomic_hydrophobicity_file_path).iloc[:, :3].values
 
+# 格点疏水性只受该距离以内的原子和格点影响, 见 find_within_radii_atoms
+HYDRO_CUTOFF = 9.01
+HYDRO_R2 = 81.01  # 9^2 + .1
 
-def get_atomic_sovation_para(resn, atom):
-    """ find atomic_sovation_para in the atomic_hydrophobicity table
+# tol 模式下可选的截断距离的平方, 从小到大, 最后一个为精确值
+HYDRO_R2_CHOICES = [c * c for c in np.arange(4.5, 9, 0.5)] + [HYDRO_R2]
+
+
+def compile_solvation_table(table):
     """
-    if atom == "OXT":
-        atomic_sovation_para = -6  # termeial O,与残基无关
-    elif atom == "NA":
-        atomic_sovation_para = -12  # 因为pandas读取时会错误的将‘NA’认为 na（missing value)
-    else:
-        index = np.where(((atomic_hydrophobicity[:, 0] == resn) & (atomic_hydrophobicity[:, 1] == atom)))
-        atomic_sovation_para = atomic_hydrophobicity[index, 2]
-    return atomic_sovation_para
+    把 (resn, atom, value) 表编译为整数编码的查找表
+    返回 (resn 编码, atom 编码, values): values[resn 编码, atom 编码] 为对应的值,
+    最后一行和最后一列为 0, 编码为 -1(表中没有)时取到 0
+    """
+    resn_index = pd.Index(np.unique(table[:, 0].astype(str)))
+    atom_index = pd.Index(np.unique(table[:, 1].astype(str)))
+    rows = resn_index.get_indexer(table[:, 0].astype(str))
+    cols = atom_index.get_indexer(table[:, 1].astype(str))
+    values = np.zeros((len(resn_index) + 1, len(atom_index) + 1))
+    values[rows, cols] = table[:, 2].astype("float64")
+    return (resn_index, atom_index, values)
+
 
+solvation_table = compile_solvation_table(atomic_hydrophobicity)
 
-def get_accessible_solvent_area(sa, vdw_r, index, n=100):
+
+def get_solvation_params(resns, atom_names):
+    """
+    一次查出所有原子的 atomic_sovation_para, 返回 shape (m,) 的数组, 表中没有的原子为 0
+    """
+    resn_index, atom_index, values = solvation_table
+    atom_names = np.asarray(atom_names).astype(str)
+    params = values[resn_index.get_indexer(np.asarray(resns).astype(str)), atom_index.get_indexer(atom_names)]
+    params[atom_names == "OXT"] = -6  # termeial O,与残基无关
+    params[atom_names == "NA"] = -12  # 因为pandas读取时会错误的将‘NA’认为 na（missing value)
+    return params
+
+
+def get_atomic_sovation_para(resn, atom):
+    """ find atomic_sovation_para in the atomic_hydrophobicity table
     """
-    sa : solvent_accessible_points
-    n为产生单位圆时取得点数，要与sa_surface用的点数相同
-    index:原子在体系中的index"""
-    # len(solvent_accessible_points[index]) : 该原子贡献的SASpoints
-    return 4 * np.pi * np.square(vdw_r + 1.4) / n * sa[sa[:, -1] == index].shape[0]
+    return get_solvation_params([resn], [atom])[0]
 
 
-def find_within_radii_atoms(grid, atom_coors, elements, resns, sa, n=40):
+def find_within_radii_atoms(grid, atom_coors, elements, resns, areas, params=None, radii=None):
     """
     找到以grid为球心，半径=radii之内的所有原子,
     并返回 其坐标 , atomic_sovation_para, assessable_solvent_area,
@@ -51,22 +85,22 @@ def find_within_radii_atoms(grid, atom_coors, elements, resns, sa, n=40):
     atom_coors:体系的原子坐标
     elements: 体系的元素
     resns:残基
-    radii：半径，默认为9
+    areas: 每个原子的 sasa 面积, 见 per_atom_sasa
+    params: 每个原子的 atomic_sovation_para, 见 get_solvation_params, 默认在这里查表
+    radii: 每个原子的 vdw 半径, 默认在这里查表
+    查找半径为9
     """
     d = np.sum(np.square(grid[:3] - atom_coors), axis=1)
     felt_atoms = atom_coors[d < 81.01]  # 9^2
     indexes = np.where(d < 81.01)[0]
     d = np.sqrt(d[d < 81.01])
-    atomic_sovation_para = np.zeros(len(indexes))
-    area = np.zeros(len(indexes))
-    # eles = np.array(['X']*len(indexes))
-    for i, index in enumerate(indexes):
-        element = elements[index]
-        resn = resns[index]
-        vdw_r = vdw_radii[element]
-        atomic_sovation_para[i] = get_atomic_sovation_para(resn, element)
-        area[i] = get_accessible_solvent_area(sa, vdw_r, index, n=n)
-        d[i] = d[i] - vdw_r - 1.4
+    area = areas[indexes]
+    if params is None:
+        atomic_sovation_para = get_solvation_params(np.asarray(resns)[indexes], np.asarray(elements)[indexes])
+    else:
+        atomic_sovation_para = params[indexes]
+    vdw_r = np.array([vdw_radii[elements[i]] for i in indexes]) if radii is None else radii[indexes]
+    d = d - vdw_r - 1.4
 
     # insert atomic_sovation_para
     felt_atoms = np.insert(felt_atoms, 3, atomic_sovation_para, axis=1)
@@ -103,44 +137,311 @@ def cal_hydro_atoms(felt_atoms):
     return hydro_atom
 
 
-def cal_grids_hydro(layerd_grids, atom_coors, elements, resns, solvent_accessible_points, n=40):
+def cal_atoms_hydro(grids, atom_coors, vdw, weights, r2=HYDRO_R2):
+    """
+    所有格点的原子贡献, 与逐个格点 find_within_radii_atoms + cal_hydro_atoms 相同
+    用 CellList 只计算 9 Å 以内的原子, 按单元格分块向量化
+    weights: 每个原子的 atomic_sovation_para * area
+    r2: 截断距离的平方
+    """
+    hydro = np.zeros(len(grids))
+    for idx, atoms in CellList(atom_coors, np.sqrt(r2)).query(grids):
+        d = np.sum(np.square(grids[idx, None, :3] - atom_coors[None, atoms]), axis=2)
+        felt = d < r2
+        e = np.exp(-0.7 * (np.sqrt(d) - vdw[atoms] - 1.4))
+        hydro[idx] = np.sum(np.where(felt, weights[atoms] * e, 0), axis=1)
+    return hydro
+
+
+def water_kernel(spacing, r2=HYDRO_R2):
+    """9 Å (距离平方 r2) 以内的 exp(-0.7 * d) 卷积核, 边长 2k + 1 个格点, 中心为 d = 0"""
+    k = int(np.floor(np.sqrt(r2) / spacing))
+    o = np.arange(-k, k + 1) * spacing
+    d = np.sum(np.square(np.stack(np.meshgrid(o, o, o, indexing="ij"))), axis=0)
+    return np.where(d < r2, np.exp(-0.7 * np.sqrt(d)), 0)
+
+
+def atom_hydro_map(atom_coors, vdw, weights, spacing=0.5):
+    """
+    原子贡献的稠密场, 与 cal_atoms_hydro 近似:
+    exp(-0.7 * (d - vdw - 1.4)) = exp(0.7 * (vdw + 1.4)) * exp(-0.7 * d),
+    把每个原子的 weights * exp(0.7 * (vdw + 1.4)) 三线性分配到周围 8 个格点,
+    再与 water_kernel 做 FFT 卷积, 一次得到原子 9 Å 范围内所有格点的值
+    返回 VoxelGrid, labels 为各格点的原子贡献, 任意点的值见 sample_map
+    """
+    atom_coors = np.asarray(atom_coors, dtype="float64")[:, :3]
+    k = int(np.floor(np.sqrt(HYDRO_R2) / spacing)) + 1
+    origin = atom_coors.min(axis=0) - k * spacing
+    shape = np.floor((atom_coors.max(axis=0) - origin) / spacing).astype(np.int64) + k + 2
+    grid = VoxelGrid(origin, spacing, shape)
+
+    u = (atom_coors - origin) / spacing
+    base = np.floor(u).astype(np.int64)
+    frac = u - base
+    charge = np.asarray(weights) * np.exp(0.7 * (np.asarray(vdw) + 1.4))
+    splat = np.zeros(np.prod(shape))
+    for corner in np.ndindex(2, 2, 2):
+        w = np.prod(np.where(corner, frac, 1 - frac), axis=1)
+        flat = np.ravel_multi_index((base + corner).T, shape)
+        splat += np.bincount(flat, weights=charge * w, minlength=len(splat))
+
+    grid.labels = fftconvolve(splat.reshape(shape), water_kernel(spacing), mode="same")
+    return grid
+
+
+def sample_map(grid, points):
+    """三线性插值得到 grid.labels 在 points 处的值, 超出范围为 0"""
+    u = (np.asarray(points, dtype="float64")[:, :3] - grid.origin) / grid.spacing
+    return map_coordinates(grid.labels, u.T, order=1, mode="constant", cval=0.0)
+
+
+def cal_waters_hydro_fft(grids, layerd_grids, r2=HYDRO_R2):
+    """
+    layerd_grids 位于规则格点上时, 水的贡献是 layer 值与 exp(-0.7 * d) 核的卷积,
+    分子(layer 加权和)和分母(权重和)各用一次 FFT 卷积得到所有格点的结果
+    grids 不在 layerd_grids 的格点上时返回 None
+    """
+    grid, layer_idx = VoxelGrid.from_points(layerd_grids)
+    if grid is None:
+        return None
+    idx = np.rint((grids[:, :3] - grid.origin) / grid.spacing).astype(np.int64)
+    if not np.array_equal(grid.origin + idx * grid.spacing, grids[:, :3]):
+        return None
+    if np.any((idx < 0) | (idx >= grid.shape)):
+        return None
+
+    labels = np.zeros(grid.shape)
+    labels[tuple(layer_idx.T)] = layerd_grids[:, -1]
+    kernel = water_kernel(grid.spacing, r2)
+    num = fftconvolve(labels, kernel, mode="same")
+    den = fftconvolve(grid.mask.astype("float64"), kernel, mode="same")
+    return num[tuple(idx.T)] / den[tuple(idx.T)]
+
+
+def sample_indices(n, size):
+    """0 ~ n - 1 中均匀抽取的不超过 size 个序号"""
+    return np.unique(np.linspace(0, n - 1, min(n, size)).astype(np.int64))
+
+
+def cal_waters_hydro(grids, layerd_grids, method="cell", tol=1e-6, r2=HYDRO_R2):
+    """
+    所有格点的水贡献, 与逐个格点 find_within_radii_grids 相同
+    method: "cell" 用 CellList 只计算 9 Å 以内的格点, 按单元格分块向量化;
+        "fft" 见 cal_waters_hydro_fft, 抽取部分格点与 "cell" 的结果比较,
+        误差超过 tol 或格点不规则时改用 "cell"
+    r2: 截断距离的平方
+    """
+    if method == "fft":
+        hydro = cal_waters_hydro_fft(grids, layerd_grids, r2)
+        if hydro is not None:
+            sample = sample_indices(len(grids), 64)
+            if np.all(np.abs(hydro[sample] - cal_waters_hydro(grids[sample], layerd_grids, r2=r2)) <= tol):
+                return hydro
+
+    hydro = np.zeros(len(grids))
+    labels = layerd_grids[:, -1]
+    for idx, near in CellList(layerd_grids, np.sqrt(r2)).query(grids):
+        d = np.sum(np.square(grids[idx, None, :3] - layerd_grids[None, near, :3]), axis=2)
+        w = np.where(d < r2, np.exp(-0.7 * np.sqrt(d)), 0)
+        hydro[idx] = w.dot(labels[near]) / np.sum(w, axis=1)
+    return hydro
+
+
+def near_pairs(points, coors, r2=HYDRO_R2):
+    """points 与 coors 中距离平方小于 r2 的点对, 返回 (points 序号, coors 序号, 距离平方)"""
+    res = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))]
+    for idx, near in CellList(coors, np.sqrt(r2)).query(points):
+        d = np.sum(np.square(points[idx, None, :3] - coors[None, near, :3]), axis=2)
+        i, j = np.nonzero(d < r2)
+        res.append((idx[i], near[j], d[i, j]))
+    return tuple(np.concatenate(f) for f in zip(*res))
+
+
+def hydro_cutoff(grids, layerd_grids, atom_coors, vdw, weights, tol, water_method="fft", sample=1024):
+    """
+    满足 tol 的最小截断距离, 只截断计算量随截断距离减小的项: 原子的贡献, 以及 water_method 为 "cell" 时水的贡献;
+    "fft" 的计算量与截断距离基本无关, 水的贡献仍使用 9 Å
+    抽取 sample 个格点, 截断距离从大到小与 9 Å 的最终疏水性(* 0.1)比较, 第一次超过 tol 时停止,
+    返回 (r2, 抽样格点上的最大误差); 误差只是抽样估计, 未抽到的格点的误差可能更大
+    """
+    points = grids[sample_indices(len(grids), sample)]
+    size = len(points)
+
+    # 抽样格点 9 Å 以内的原子和格点只查找一次, 各截断距离只需按距离筛选
+    i, j, d = near_pairs(points, np.asarray(atom_coors)[:, :3])
+    atom = weights[j] * np.exp(-0.7 * (np.sqrt(d) - vdw[j] - 1.4))
+    if water_method == "cell":
+        wi, wj, wd = near_pairs(points, layerd_grids)
+        w = np.exp(-0.7 * np.sqrt(wd))
+        labels = layerd_grids[wj, -1]
+
+    def hydro(r2):
+        value = np.bincount(i, weights=np.where(d < r2, atom, 0), minlength=size)
+        if water_method == "cell":
+            felt = wd < r2
+            num = np.bincount(wi, weights=np.where(felt, w * labels, 0), minlength=size)
+            value = value + num / np.bincount(wi, weights=np.where(felt, w, 0), minlength=size)
+        return value * 0.1
+
+    exact = hydro(HYDRO_R2)
+    best = (HYDRO_R2, 0.0)
+    for r2 in HYDRO_R2_CHOICES[-2::-1]:
+        error = np.max(np.abs(hydro(r2) - exact), initial=0)
+        if error > tol:
+            break
+        best = (r2, error)
+    return best
+
+
+def cal_grids_hydro(
+    layerd_grids,
+    atom_coors,
+    elements,
+    resns,
+    solvent_accessible_points,
+    n=40,
+    density=None,
+    targets=None,
+    water_method="fft",
+    atom_method="cell",
+    tol=None,
+):
     """
     for all grid points
     pas_r: probe radii
     n:生成单位球时取点的个数，要与sas保持一致
+    density: 按点密度生成 sas 时的点密度, 与 sas 保持一致
     radii： 格点的寻找半径，在此范围内的atoms对格点的疏水性有影响
+    targets: 只计算这些格点(bool 数组)的疏水性, 默认全部; 水的贡献仍来自所有 layerd_grids
+    water_method: 水的贡献的计算方法, 见 cal_waters_hydro; 只用于 python 版(run_hydro 的 enable_ext=False),
+        rust 版 run_hydrophobicity 总是用 CellList 逐对计算截断距离以内的格点, 相当于 "cell"
+    atom_method: 原子的贡献的计算方法, "cell" 见 cal_atoms_hydro;
+        "map" 在 0.5 Å 的 atom_hydro_map 上插值, 为近似值
+    tol: 设置时为近似模式, 用 hydro_cutoff 选择满足该绝对误差的最小截断距离;
+        python 版只缩短截断距离, 不使用 rust 版的 exp 查找表; 不支持 atom_method="map"
+    返回各格点的疏水性; 设置 tol 时返回 (疏水性, 截断距离(Å), 最大误差),
+        最大误差是在至多 1024 个抽样格点上与精确值比较得到的估计值, 不是所有格点上的上界
     """
-    atom_hydro = np.zeros(len(layerd_grids))
-    water_hydro = np.zeros(len(layerd_grids))
-    for index, grid in enumerate(layerd_grids):
-        felt_atoms = find_within_radii_atoms(grid, atom_coors, elements, resns, solvent_accessible_points, n=n)
-        atom_hydro[index] = cal_hydro_atoms(felt_atoms)
-        new_layerd_grid = find_within_radii_grids(grid, layerd_grids)
-        water_hydro[index] = new_layerd_grid
+    if tol is not None and atom_method == "map":
+        raise ValueError("tol is not supported with atom_method='map'")
+
+    targets = np.ones(len(layerd_grids), dtype=bool) if targets is None else np.asarray(targets)
+
+    # 每个原子的 sasa 面积, 半径以及 atomic_sovation_para 只需计算一次
+    vdw = np.array([vdw_radii[e] for e in elements])
+    radii = vdw + 1.4
+    counts = n if density is None else dot_counts(radii, density)
+    areas = count_per_atom(solvent_accessible_points, radii, n=counts)[:, 1]
+    params = get_solvation_params(resns, elements)
+    grids = layerd_grids[targets]
+    r2 = HYDRO_R2
+    if tol is not None:
+        r2, error = hydro_cutoff(grids, layerd_grids, atom_coors, vdw, params * areas, tol, water_method=water_method)
+        logger.info("tol = %s: cutoff = %.1f, max error = %.3g", tol, np.sqrt(r2), error)
+    if atom_method == "map":
+        atom_hydro = sample_map(atom_hydro_map(atom_coors, vdw, params * areas), grids)
+    else:
+        atom_hydro = cal_atoms_hydro(grids, atom_coors, vdw, params * areas, r2)
+    water_hydro = cal_waters_hydro(
+        grids, layerd_grids, method=water_method, r2=r2 if water_method == "cell" else HYDRO_R2
+    )
     all_hydro = atom_hydro + water_hydro
     # grids_hydro = np.insert(layerd_grids, 3, all_hydro, axis=1)
     all_hydro = all_hydro * 0.1  # 为了显示，疏水性 * 0.1
+    if tol is not None:
+        return all_hydro, np.sqrt(r2), error
     return all_hydro
 
 
-def run_hydro(filename, n=100, pas_r=20, dir=".", enable_ext=True):
-    mkdir_by_file(dir, is_dir=True)
+def run_hydro(filename, n=100, pas_r=20, dir=".", enable_ext=True, density=None, roi=None, tol=None, save=True):
+    """
+    enable_ext: 使用 rust 版 run_hydrophobicity, 水的贡献逐对计算截断距离以内的格点;
+        否则使用 python 版 cal_grids_hydro, 水的贡献默认用 FFT (water_method="fft"), FFT 误差超过 1e-6 时改用逐对计算, 见 cal_waters_hydro
+    density: 点密度(每 Å² 的点数), 设置后代替 n, 见 sa_surface
+    roi: 只计算该区域内格点的疏水性, 见 Roi; 也可以是 Roi 以外的参数:
+        残基名列表(如配体的 HETATM 残基名), 以这些原子 6 Å 以内为区域
+    tol: 近似模式允许的疏水性绝对误差, 如 1e-3, 见 cal_grids_hydro; 默认为精确计算.
+        设置时返回 (格点及疏水性, 截断距离(Å), 抽样估计的最大误差), 否则只返回格点及疏水性
+    save: 是否在 dir 中保存结果的 pdb (以及 sas 的 xyz)
+    """
+    if save:
+        mkdir_by_file(dir, is_dir=True)
     atom_coors, eles, resns = read_pdb(filename)
+    if roi is not None and not isinstance(roi, Roi):
+        roi = Roi.residues(atom_coors, resns, roi)
 
     if enable_ext:
-        grid_hyo = run_hydrophobicity(atom_coors, eles, resns, n, pas_r)
-        grid_coors = grid_hyo[:, :3]
-        hyo = grid_hyo[:, -1]
-        to_pdb(
-            grid_coors, hyo, filename="{}/{}_hyo_rust.pdb".format(dir, filename[:-4]),
-        )
-        return grid_hyo
-
-    layered_grids = layer_grids(atom_coors, eles, n=n, pr=pas_r)
-    sa = sa_surface(atom_coors, eles, n=n, pr=1.4)
-    to_xyz(sa, filename="{}/{}_SAS.xyz".format(dir, filename[:-4]))
-    hyo = cal_grids_hydro(layered_grids, atom_coors, eles, resns, sa, n=n)
-    grid_coors = layered_grids[:, :3]
-    to_pdb(grid_coors, hyo, filename="{}/{}_hyo.pdb".format(dir, filename[:-4]))
+        if roi is None:
+            result = run_hydrophobicity(atom_coors, eles, resns, n, pas_r, density, tol)
+        else:
+            # 水的贡献来自 9 Å 以内的格点, 原子的贡献来自 9 Å 以内的原子的 sasa
+            halo = roi.expanded(HYDRO_CUTOFF)
+            atoms, coors, sub_eles = roi_atoms(halo, atom_coors, eles, pas_r)
+            result = run_hydrophobicity(coors, sub_eles, [resns[i] for i in atoms], n, pas_r, density, tol)
+        # 设置 tol 时 rust 版返回 (格点及疏水性, 截断距离, 最大误差)
+        grid_hyo, approx = (result[0], result[1:]) if tol is not None else (result, ())
+        if roi is not None:
+            grid_hyo = grid_hyo[roi.contains(grid_hyo)]
+        if save:
+            grid_coors = grid_hyo[:, :3]
+            hyo = grid_hyo[:, -1]
+            to_pdb(
+                grid_coors, hyo, filename="{}/{}_hyo_rust.pdb".format(dir, filename[:-4]),
+            )
+        return (grid_hyo, *approx) if tol is not None else grid_hyo
+
+    if roi is None:
+        layered_grids = layer_grids(atom_coors, eles, n=n, pr=pas_r, density=density)
+        sa = sa_surface(atom_coors, eles, n=n, pr=1.4, density=density)
+        targets = None
+    else:
+        halo = roi.expanded(HYDRO_CUTOFF)
+        layered_grids = layer_grids(atom_coors, eles, n=n, pr=pas_r, density=density, roi=halo)
+        # 只需要 roi 9 Å 以内的原子的 sasa, 以及可能遮挡它们的原子; 第4列换回原来的原子序号
+        radii = np.array([vdw_radii[e] for e in eles]) + 1.4
+        atoms = np.nonzero(roi.near(atom_coors, HYDRO_CUTOFF + 2 * radii.max()))[0]
+        sa = sa_surface(atom_coors[atoms], [eles[i] for i in atoms], n=n, pr=1.4, density=density)
+        sa[:, 3] = atoms[sa[:, 3].astype(np.int64)]
+        targets = roi.contains(layered_grids)
+    if save:
+        to_xyz(sa, filename="{}/{}_SAS.xyz".format(dir, filename[:-4]))
+    hyo = cal_grids_hydro(
+        layered_grids, atom_coors, eles, resns, sa, n=n, density=density, targets=targets, tol=tol
+    )
+    hyo, approx = (hyo[0], hyo[1:]) if tol is not None else (hyo, ())
+    grid_coors = layered_grids[targets if targets is not None else slice(None), :3]
+    if save:
+        to_pdb(grid_coors, hyo, filename="{}/{}_hyo.pdb".format(dir, filename[:-4]))
     print("Done")
-    return np.insert(grid_coors, 3, hyo, axis=1)
+    grid_hyo = np.insert(grid_coors, 3, hyo, axis=1)
+    return (grid_hyo, *approx) if tol is not None else grid_hyo
+
+
+def _init_hydro_worker(threads):
+    """进程池中每个进程的初始化, 在第一次调用 sz_py_ext 之前限制 rayon 的线程数"""
+    os.environ["RAYON_NUM_THREADS"] = str(threads)
+
+
+def run_hydro_batch(paths, workers=None, n=100, pas_r=20, dir=".", save=False, **kwargs):
+    """
+    多个结构的 run_hydro, 用进程池并行计算, 每完成一个结构返回一个 (path, grid_hyo)
+    每个进程只在第一次调用时载入疏水性参数表和 vdw 半径, 之后的结构直接复用
+    workers: 进程数, 默认为 cpu 数; 每个进程中 rayon 的线程数为 cpu 数 / workers, 避免线程数超过 cpu 数
+    save: 是否保存每个结构的 pdb, 默认不保存
+    其余参数见 run_hydro
+
+    进程使用 spawn 启动: fork 得到的子进程复制了父进程 rayon 线程池的状态但没有其中的线程,
+    父进程调用过 sz_py_ext 后子进程会卡住; 在脚本中调用时需要放在 if __name__ == "__main__": 之下
+    """
+    workers = workers or cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_hydro_worker,
+        initargs=(max(1, cpu_count() // workers),),
+    ) as executor:
+        futures = {
+            executor.submit(run_hydro, path, n=n, pas_r=pas_r, dir=dir, save=save, **kwargs): path for path in paths
+        }
+        for future in concurrent.futures.as_completed(futures):
+            yield (futures[future], future.result())
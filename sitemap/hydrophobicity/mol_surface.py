@@ -14,14 +14,26 @@ representations
 @author: likun yang
 """
 
+from functools import lru_cache
+
 import numpy as np
+from sz_py_ext import connolly_surface as connolly_surface_rust
+from sz_py_ext import per_atom_sasa as per_atom_sasa_rust
+from sz_py_ext import per_atom_sasa_bitmask as per_atom_sasa_bitmask_rust
 from sz_py_ext import sa_surface as sa_surface_rust
+from sz_py_ext import sa_surface_bitmask as sa_surface_bitmask_rust
+from sz_py_ext import sa_surface_density as sa_surface_density_rust
+from sz_py_ext import sa_surface_multi as sa_surface_multi_rust
 from sz_py_ext import sa_surface_no_ele as sa_surface_no_ele_rust
 
 from sitemap.core import vdw_radii
+from sitemap.hydrophobicity.cell_list import CellList
 
 GoldenRatio = (1 + 5 ** 0.5) / 2
 
+# 按点密度取点时可选的单位球点数, 与 rust 版 DOT_TEMPLATES 一致
+DOT_TEMPLATES = np.array([10, 15, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300, 400, 600, 800, 1000])
+
 
 def dotsphere(n=100):
     """ use Fibonacci Lattice to even distribute points on a unit sphere
@@ -40,79 +52,194 @@ def dotsphere(n=100):
     return np.array([x, y, z]).T
 
 
-def sa_surface(coors, elements, n=40, pr=1.4, enable_ext=True, index=True):
+@lru_cache(maxsize=None)
+def _dotsphere_template(n):
+    """缓存的单位球点, 不要修改返回值"""
+    return dotsphere(n)
+
+
+def dot_counts(radii, density):
+    """
+    按点密度(每 Å² 的点数)为每个原子选取单位球点数
+    取不小于 density * 4πr² 的最小模板, 超出范围时取最大模板
+    radii: 每个原子的半径(vdw + pr)
+    """
+    need = density * 4 * np.pi * np.square(radii)
+    return DOT_TEMPLATES[np.minimum(np.searchsorted(DOT_TEMPLATES, need), len(DOT_TEMPLATES) - 1)]
+
+
+def sa_surface(coors, elements, n=40, pr=1.4, enable_ext=True, index=True, bitmask=False, density=None):
     """ 生solvent accessible ,返回list，list的index为原子的序号
     coors: 体系的xyz坐标，shape：(m * 3)
     elements: 元素，shape：（m * 1))
     n:生成的圆上格点的数目
-    pr:probe radaii"""
+    pr:probe radaii
+    bitmask: 使用预先计算的遮挡表按位或判断遮挡, 速度快但结果为近似值, 只有 rust 版, enable_ext=False 时报错
+    density: 点密度(每 Å² 的点数), 设置后每个原子的点数由 dot_counts 决定, 不再使用 n"""
+    if bitmask and not enable_ext:
+        raise ValueError("bitmask is only supported with enable_ext=True")
 
     if enable_ext:
+        if density is not None:
+            return sa_surface_density_rust(coors, elements, float(density), pr, index)
+        if bitmask:
+            return sa_surface_bitmask_rust(coors, elements, n, pr, index)
         return sa_surface_rust(coors, elements, n, pr, index)
 
-    dots = np.zeros((len(coors) * n, 4))
+    radii = np.array([vdw_radii[e] for e in elements]) + pr  # 半径
+    return _sa_surface_core(coors, radii, n=n if density is None else dot_counts(radii, density))
 
-    for i in range(coors.shape[0]):
-        _b = dotsphere(n=n)  # 生成圆上的点
-        r = vdw_radii[elements[i]] + pr  # 半径
-        _b = _b * r  # 根据 vdw半径对点进行放缩
-        _c = _b + coors[i]  # 平移生成的圆
-        _c = np.insert(_c, 3, i, axis=1)  # 加入原子序号
-        dots[i * n : (i + 1) * n] = _c
-    for index, coor in enumerate(coors):
-        r = vdw_radii[elements[index]] + pr
 
-        # 计算所有球上点与当前原子的距离
-        d_ma = np.sum(np.square(coor - dots[:, :-1]), axis=1)
+def sa_surface_no_ele(coors, n=40, pr=1.4, enable_ext=True, index=True):
+    if enable_ext:
+        return sa_surface_no_ele_rust(coors, n, pr, index)
+    return _sa_surface_core(coors, np.full(len(coors), float(pr)), n=n)
+
+
+def sa_surface_multi(
+    coors, elements, n=40, radii=(7.0, 6.3, 5.6, 4.9, 4.2, 3.5, 2.8, 2.1), enable_ext=True, density=None
+):
+    """一次计算多个 probe radii 的 sa surface
+    返回 (dots, offsets): 按 radii 顺序拼接的点(第4列为原子序号),
+    第k个半径的结果为 dots[offsets[k] : offsets[k + 1]]
+    density: 见 sa_surface, 此时不同半径的点数不同, 每个半径单独计算"""
+    if density is not None:
+        res = [sa_surface(coors, elements, pr=pr, enable_ext=enable_ext, density=density) for pr in radii]
+        offsets = np.cumsum([0] + [len(r) for r in res])
+        dots = np.vstack(res) if res else np.zeros((0, 4))
+        return (dots, offsets)
 
-        # 过滤在r^2长度内的点,也就是index 球内的点, 重叠的部分
-        dots = dots[d_ma > np.square(r - 0.001)]
+    if enable_ext:
+        return sa_surface_multi_rust(coors, elements, n, [float(pr) for pr in radii])
 
-    return dots
+    vdw = np.array([vdw_radii[e] for e in elements])
+    res = [None] * len(radii)
 
+    # 被遮挡的点在更大的半径下仍然被遮挡, 由小到大计算, 只需检查上一个半径留存的点
+    ids = np.arange(len(coors) * n)
+    for k in np.argsort(radii, kind="stable"):
+        res[k], ids = _sa_surface_dots(coors, vdw + radii[k], ids, n=n)
+
+    offsets = np.cumsum([0] + [len(r) for r in res])
+    dots = np.vstack(res) if res else np.zeros((0, 4))
+    return (dots, offsets)
+
+
+def _sa_surface_core(coors, radii, n=40):
+    """
+    python 版 sa surface, 用 cell list 只计算点与 max(radii) 范围内原子的距离
+    结果(包括点的顺序)与逐个原子过滤所有点的做法一致
+    coors: 体系的xyz坐标，shape：(m * 3)
+    radii: 每个原子的半径(vdw + pr)，shape：(m,)
+    n: 单位球点数, 或者每个原子的点数, shape：(m,)
+    """
+    total = len(coors) * n if np.ndim(n) == 0 else int(np.sum(n))
+    return _sa_surface_dots(coors, radii, np.arange(total), n=n)[0]
+
+
+def _sa_surface_dots(coors, radii, ids, n=40, cells=None):
+    """
+    只计算 ids 对应的点, ids = 原子序号 * n + 单位球上点的序号
+    n 为每个原子的点数时, ids 为所有原子的点依次排列后的序号
+    cells: 可选, 预先建好的 CellList(coors, radii.max())
+    返回留存的点(第4列为原子序号)以及它们的 ids
+    """
+    coors = np.asarray(coors, dtype="float64")
+
+    # 根据半径放缩单位球上的点并平移到原子上
+    dots = np.zeros((len(ids), 4))
+    if np.ndim(n) == 0:
+        atoms = ids // n
+        dots[:, :3] = _dotsphere_template(int(n))[ids % n]
+    else:
+        offsets = np.concatenate([[0], np.cumsum(n)])
+        atoms = np.searchsorted(offsets, ids, side="right") - 1
+        counts = np.asarray(n)[atoms]
+        for c in np.unique(counts):
+            mask = counts == c
+            dots[mask, :3] = _dotsphere_template(int(c))[ids[mask] - offsets[atoms[mask]]]
+    dots[:, :3] = dots[:, :3] * radii[atoms, None] + coors[atoms]
+    dots[:, 3] = atoms
+    if len(ids) == 0:
+        return (dots, ids)
+
+    # 点落在任一原子 r 内即为重叠部分, 需要去除
+    cutoff = np.square(radii - 0.001)
+    keep = np.zeros(len(dots), dtype=bool)
+    cells = CellList(coors, radii.max()) if cells is None else cells
+    for idx, near in cells.query(dots[:, :3]):
+        # 先用离这组点最近的原子过滤, 被遮挡的点尽早去除, 减少后续计算
+        center = dots[idx, :3].mean(axis=0)
+        near = near[np.argsort(np.sum(np.square(coors[near] - center), axis=1))]
+        for i in range(0, len(near), 256):
+            block = near[i : i + 256]
+            d_ma = np.sum(np.square(dots[idx, None, :3] - coors[None, block]), axis=2)
+            idx = idx[~np.any(d_ma <= cutoff[block], axis=1)]
+            if len(idx) == 0:
+                break
+        keep[idx] = True
+    return (dots[keep], ids[keep])
+
+
+def per_atom_sasa(coors, elements, n=40, pr=1.4, enable_ext=True, bitmask=False, density=None):
+    """每个原子的 solvent accessible surface area
+    返回 shape (m, 2): 第一列为原子球上留存点的百分比, 第二列为面积(Å²)
+    bitmask: 同 sa_surface, 留存点数为遮挡 bitmask 的 popcount
+    density: 同 sa_surface"""
+    if bitmask and not enable_ext:
+        raise ValueError("bitmask is only supported with enable_ext=True")
+
+    radii = np.array([vdw_radii[e] for e in elements]) + pr
+    if density is not None:
+        dots = sa_surface(coors, elements, pr=pr, enable_ext=enable_ext, density=density)
+        return count_per_atom(dots, radii, n=dot_counts(radii, density))
 
-def sa_surface_no_ele(coors, n=40, pr=1.4, enable_ext=True, index=True):
     if enable_ext:
-        return sa_surface_no_ele_rust(coors, n, pr, index)
-    dots = np.zeros((len(coors) * n, 4))
+        if bitmask:
+            return per_atom_sasa_bitmask_rust(coors, elements, n, pr)
+        return per_atom_sasa_rust(coors, elements, n, pr)
 
-    for i in range(coors.shape[0]):
-        _b = dotsphere(n=n)  # 生成圆上的点
+    return count_per_atom(_sa_surface_core(coors, radii, n=n), radii, n=n)
 
-        _b = _b * pr  # 根据 vdw半径对点进行放缩
-        _c = _b + coors[i]  # 平移生成的圆
-        _c = np.insert(_c, 3, i, axis=1)  # 加入原子序号
-        dots[i * n : (i + 1) * n] = _c
-    for coor in coors:
-        d_ma = np.sum(np.square(coor - dots[:, :-1]), axis=1)
-        dots = dots[d_ma > np.square(pr - 0.001)]
 
-    return dots
+def count_per_atom(dots, radii, n=40):
+    """
+    由 sa surface 点(第4列为原子序号)一次 bincount 统计每个原子留存的点
+    radii: 每个原子的半径(vdw + pr)
+    n: 单位球点数, 或者每个原子的点数
+    """
+    percent = np.bincount(dots[:, -1].astype(np.int64), minlength=len(radii)) / n
+    return np.stack([percent, 4 * np.pi * np.square(radii) * percent], axis=1)
 
 
-def connolly_surface(coors, elements, n=50, pr=1.4, enable_ext=True):
+def connolly_surface(coors, elements, n=50, pr=1.4, enable_ext=True, chunk=2048):
     """
     coors: 体系的xyz坐标，shape：(m * 3)
     elements: 元素，shape：（m * 1))
     r:比vdw半径伸长的半径
+    chunk: 每次处理的探测小球个数, 不一次生成所有探测小球上的点
     """
-    sas_points = sa_surface(coors, elements, n=n, pr=pr, enable_ext=enable_ext)  # 生成sas
-    dots = sa_surface_no_ele(sas_points[:, :-1], n=n, pr=pr, enable_ext=enable_ext)  # 以sas为球心，pr为半径做球
-    # return dots
-
-    # 开始去除探测小球最外面的点, 认为离原子距离的平方小于10.01都是内层的点
-    dots[:, 3] = 0  # label as 0
-    for atom in coors:
-        d = np.sum(np.square(atom - dots[:, :3]), axis=1)
-        indexes = np.where((d < 10.01) & (dots[:, 3] == 0))
-        dots[indexes, 3] = 1
-    return dots[dots[:, 3] == 1]
-
-    # result = []
-    # for point in dots:
-    #     for atom in coors:
-    #         d = np.sum(np.square(point[:-1] - atom))
-    #         if d < 10:
-    #             result.append(point)
-    #             break
-    # return np.vstack(result)
+    if enable_ext:
+        return connolly_surface_rust(coors, elements, n, pr)
+
+    coors = np.asarray(coors, dtype="float64")
+    sas_points = sa_surface(coors, elements, n=n, pr=pr, enable_ext=False)[:, :3]  # 生成sas
+    radii = np.full(len(sas_points), float(pr))
+    probe_cells = CellList(sas_points, pr)
+    atom_cells = CellList(coors, np.sqrt(10.01))
+
+    res = [np.zeros((0, 4))]
+    for start in range(0, len(sas_points), chunk):
+        # 以sas为球心，pr为半径做球, 去除探测小球之间的overlap
+        ids = np.arange(start * n, min(len(sas_points), start + chunk) * n)
+        dots, _ = _sa_surface_dots(sas_points, radii, ids, n=n, cells=probe_cells)
+
+        # 开始去除探测小球最外面的点, 认为离原子距离的平方小于10.01都是内层的点
+        inner = np.zeros(len(dots), dtype=bool)
+        for idx, near in atom_cells.query(dots[:, :3]):
+            d = np.sum(np.square(dots[idx, None, :3] - coors[None, near]), axis=2)
+            inner[idx] = np.any(d < 10.01, axis=1)
+        dots = dots[inner]
+        dots[:, 3] = 1  # label as 1
+        res.append(dots)
+    return np.vstack(res)
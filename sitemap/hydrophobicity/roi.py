@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+感兴趣区域(region of interest)
+
+只在配体或指定残基附近计算 pocket, 分层以及疏水性时使用:
+格点只取 roi 内的部分, 表面点只由 roi 附近(加上 halo)的原子计算, roi 内的结果与全蛋白计算相同
+"""
+
+import numpy as np
+
+from sitemap.hydrophobicity.voxel_grid import VoxelGrid, within_any
+
+
+class Roi:
+    """
+    lo, hi: 外接盒的两个角
+    centers, radius: 设置时区域为以 centers 为球心, radius 为半径的球的并集, 否则为盒子 [lo, hi]
+    """
+
+    def __init__(self, lo, hi, centers=None, radius=None):
+        self.lo = np.asarray(lo, dtype="float64")
+        self.hi = np.asarray(hi, dtype="float64")
+        self.centers = None if centers is None else np.asarray(centers, dtype="float64")[:, :3]
+        self.radius = radius
+
+    @classmethod
+    def box(cls, lo, hi):
+        """盒子 [lo, hi]"""
+        return cls(lo, hi)
+
+    @classmethod
+    def sphere(cls, centers, radius=6.0):
+        """以 centers (一个坐标或 shape (m, 3)) 为球心, radius 为半径的球的并集, 如配体的原子坐标"""
+        centers = np.atleast_2d(np.asarray(centers, dtype="float64"))[:, :3]
+        return cls(centers.min(axis=0) - radius, centers.max(axis=0) + radius, centers, radius)
+
+    @classmethod
+    def residues(cls, coors, resns, names, radius=6.0):
+        """以残基名在 names 中的原子(如配体的 HETATM 残基名)为球心, 见 sphere"""
+        selected = np.isin(np.asarray(resns).astype(str), np.asarray(names).astype(str))
+        if not np.any(selected):
+            raise ValueError("no atoms found for residues {}".format(names))
+        return cls.sphere(np.asarray(coors)[selected], radius)
+
+    def expanded(self, d):
+        """每个方向向外扩展 d 的区域"""
+        if self.centers is None:
+            return Roi(self.lo - d, self.hi + d)
+        return Roi(self.lo - d, self.hi + d, self.centers, self.radius + d)
+
+    def contains(self, points):
+        """points 是否在区域内, 返回 bool 数组"""
+        points = np.asarray(points, dtype="float64")[:, :3]
+        if self.centers is None:
+            return np.all((points >= self.lo) & (points <= self.hi), axis=1)
+        return within_any(points, self.centers, self.radius)
+
+    def near(self, points, d):
+        """与外接盒距离不超过 d 的点, 返回 bool 数组, 用于挑选 halo 内的原子和表面点"""
+        points = np.asarray(points, dtype="float64")[:, :3]
+        gap = np.maximum(np.maximum(self.lo - points, points - self.hi), 0)
+        return np.sum(np.square(gap), axis=1) <= np.square(d)
+
+    def crop(self, grid):
+        """
+        grid 在外接盒内的部分, 格点位置不变, mask 只保留区域内原来保留的格点
+        """
+        lo, shape = self.crop_bounds(grid.origin, grid.spacing, grid.shape)
+
+        cropped = VoxelGrid(grid.origin + lo * grid.spacing, grid.spacing, shape)
+        inner = tuple(slice(a, a + s) for a, s in zip(lo, shape))
+        cropped.mask = grid.mask[inner].copy()
+        cropped.labels = grid.labels[inner].copy()
+
+        idx = np.argwhere(cropped.mask)
+        cropped.mask[tuple(idx.T)] = self.contains(cropped.origin + idx * cropped.spacing)
+        return cropped
+
+    def crop_bounds(self, origin, spacing, shape):
+        """格点 (origin, spacing, shape) 在外接盒内的部分, 返回 (起点的整数坐标, shape)"""
+        lo = np.maximum(np.ceil((self.lo - origin) / spacing).astype(np.int64), 0)
+        hi = np.minimum(np.floor((self.hi - origin) / spacing).astype(np.int64) + 1, shape)
+        return (lo, np.maximum(hi - lo, 0))
+
+    def atoms(self, coors, radii, pr):
+        """
+        计算区域附近半径为 pr 的 sa surface 需要的原子序号
+        落在区域 pr 以内的表面点, 其所在原子以及遮挡它的原子都在外接盒 max(radii) + 2 * pr 以内;
+        只用这些原子计算时多出来的点都在区域 pr 以外, 可以用 near(dots, pr) 去掉
+        """
+        return np.nonzero(self.near(coors, np.max(radii) + 2 * pr))[0]
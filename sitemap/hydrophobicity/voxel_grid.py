@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+隐式表示的规则格点
+
+只保存 origin, spacing, shape 以及每个格点的 mask / label, 格点坐标只在输出时生成,
+代替 gen_grid 生成的 N×3 float64 坐标数组, 各个步骤直接修改 mask, 不再反复复制坐标数组
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# 每次向量化计算的 (球心 × 偏移) 对数上限, 控制内存
+_CHUNK_PAIRS = 1 << 21
+
+
+@lru_cache(maxsize=None)
+def sphere_offsets(r):
+    """
+    格点间距为 1 时半径为 r 的球的整数偏移, 与 rust 版 sphere_offsets 相同
+    球心在所在单元格 [0, 1)³ 内任意移动时:
+    返回的 inner 偏移点一定在半径 r 内, shell 偏移点可能在半径 r 内, 需要精确计算距离
+    """
+    k = int(np.ceil(r)) + 1
+    o = np.stack(np.meshgrid(*[np.arange(-k, k + 1)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    far = np.sum(np.maximum(np.square(o), np.square(o - 1)), axis=1)
+    near = np.sum(np.square(np.maximum(np.maximum(-o, o - 1), 0)), axis=1)
+    inner = far < r * r - 1e-6
+    shell = ~inner & (near <= r * r + 1e-6)
+    return (o[inner], o[shell])
+
+
+def within_any(points, centers, r, inclusive=False):
+    """
+    points 中与任一 center 距离小于 r (inclusive 时为小于等于)的点, 返回 bool 数组
+    用 KD-tree 查询每个点最近的 center, 代替与所有 center 逐个计算距离
+    """
+    hit = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(centers) == 0:
+        return hit
+    centers = np.asarray(centers, dtype="float64")[:, :3]
+    _, j = cKDTree(centers).query(points, distance_upper_bound=r * (1 + 1e-9))
+    found = j < len(centers)
+    d_ma = np.sum(np.square(centers[j[found]] - points[found]), axis=1)
+    hit[found] = d_ma <= np.square(r) if inclusive else d_ma < np.square(r)
+    return hit
+
+
+def grid_bounds(coors, spacing=1, buffer=0):
+    """与 gen_grid 范围相同的格点的 (origin, shape), 不分配 mask"""
+    axes = [np.arange(int(min(coors[:, i]) - buffer), int(max(coors[:, i]) + buffer) + 1, spacing) for i in range(3)]
+    return (np.array([a[0] for a in axes], dtype="float64"), tuple(len(a) for a in axes))
+
+
+def remove_within_points(grids, centers, radii):
+    """
+    去除 grids 中与任一 center 距离小于等于对应半径的点, 保持原来的顺序
+    grids 需为规则格点上的点, 如 gen_grid 的结果或其子集
+    """
+    if len(grids) == 0:
+        return grids
+    grid, idx = VoxelGrid.from_points(grids)
+    if grid is None:
+        # 不在规则格点上, 逐个球心计算
+        radii = np.broadcast_to(np.asarray(radii, dtype="float64"), (len(centers),))
+        for center, r in zip(centers, radii):
+            d_ma = np.sum(np.square(center[:3] - grids), axis=1)
+            grids = grids[d_ma > np.square(r)]
+        return grids
+    grid.remove_within(centers, radii)
+    return grids[grid.mask[tuple(idx.T)]]
+
+
+class VoxelGrid:
+    """
+    origin: 第一个格点的坐标, shape (3,)
+    spacing: 格点间距
+    shape: 每个方向的格点数 (nx, ny, nz)
+    mask: 格点是否保留, bool, shape 与 shape 相同, 默认全部保留
+    labels: 格点的标记, float64, 默认全部为 0
+    """
+
+    def __init__(self, origin, spacing, shape, mask=None, labels=None):
+        self.origin = np.asarray(origin, dtype="float64")
+        self.spacing = spacing
+        self.shape = tuple(int(s) for s in shape)
+        self.mask = np.ones(self.shape, dtype=bool) if mask is None else mask
+        self.labels = np.zeros(self.shape) if labels is None else labels
+
+    @classmethod
+    def from_coors(cls, coors, spacing=1, buffer=0):
+        """与 gen_grid 范围相同的格点"""
+        origin, shape = grid_bounds(coors, spacing=spacing, buffer=buffer)
+        return cls(origin, spacing, shape)
+
+    @classmethod
+    def from_points(cls, points):
+        """
+        由规则格点上的点建立格点, mask 只保留这些点
+        返回 (grid, idx): idx 为每个点的整数坐标; 点不在规则格点上时 grid 为 None
+        """
+        points = np.asarray(points, dtype="float64")[:, :3]
+        origin = points.min(axis=0)
+        diffs = np.concatenate([np.diff(np.unique(points[:, i])) for i in range(3)])
+        spacing = diffs.min() if len(diffs) else 1.0
+
+        idx = np.rint((points - origin) / spacing).astype(np.int64)
+        if not np.array_equal(origin + idx * spacing, points):
+            return (None, idx)
+
+        shape = idx.max(axis=0) + 1
+        grid = cls(origin, spacing, shape, mask=np.zeros(shape, dtype=bool))
+        grid.mask[tuple(idx.T)] = True
+        return (grid, idx)
+
+    @property
+    def axes(self):
+        """x, y, z 三个方向的格点坐标"""
+        return [self.origin[i] + np.arange(self.shape[i]) * self.spacing for i in range(3)]
+
+    def padded(self, k):
+        """每个方向向外扩展 k 个格点, 返回新的格点(全部保留)"""
+        return VoxelGrid(self.origin - k * self.spacing, self.spacing, [s + 2 * k for s in self.shape])
+
+    def cropped(self, k):
+        """每个方向去掉最外面的 k 个格点, 返回新的格点, 与原格点共用 mask 和 labels"""
+        inner = tuple(slice(k, s - k) for s in self.shape)
+        return VoxelGrid(
+            self.origin + k * self.spacing,
+            self.spacing,
+            [s - 2 * k for s in self.shape],
+            mask=self.mask[inner],
+            labels=self.labels[inner],
+        )
+
+    def indices(self, mask=None):
+        """
+        mask(默认为 self.mask) 中保留的格点的整数坐标 (i, j, k), shape (N, 3)
+        顺序与 gen_grid 相同: gen_grid 使用 meshgrid 默认的 xy 索引, 展开顺序为 y, x, z
+        """
+        mask = self.mask if mask is None else mask
+        yy, xx, zz = np.nonzero(mask.transpose(1, 0, 2))
+        return np.stack([xx, yy, zz], axis=1)
+
+    def coordinates(self, mask=None):
+        """保留的格点坐标, shape (N, 3), 顺序与 gen_grid 相同"""
+        return self.origin + self.indices(mask) * self.spacing
+
+    def to_array(self, mask=None):
+        """保留的格点坐标以及标记, shape (N, 4)"""
+        idx = self.indices(mask)
+        return np.insert(self.origin + idx * self.spacing, 3, self.labels[tuple(idx.T)], axis=1)
+
+    def remove_within(self, centers, radii):
+        """
+        去除与任一 center 距离小于等于对应半径的格点, 直接修改 mask
+        centers: shape (m, 3)
+        radii: 每个 center 的半径, 或者所有 center 相同的半径
+
+        相同半径的球共用一组整数偏移(见 sphere_offsets)印到 mask 上,
+        计算量与球心数量成正比, 与格点数无关
+        """
+        centers = np.asarray(centers, dtype="float64")[:, :3]
+        radii = np.broadcast_to(np.asarray(radii, dtype="float64"), (len(centers),))
+        for r in np.unique(radii):
+            self._stamp(centers[radii == r], r)
+
+    def _stamp(self, centers, r):
+        """
+        把与 centers 距离小于等于 r 的格点从 mask 中直接去除, 不复制 mask
+        离边界 k 个格点以上的球所有偏移点都在格点范围内, 一次向量化写入, 见 _stamp_inside;
+        其余的球逐个按裁剪后的切片写入, 见 _stamp_clipped
+        """
+        inner, shell = sphere_offsets(r / self.spacing)
+        k = int(np.ceil(r / self.spacing)) + 1
+        shape = np.array(self.shape)
+
+        base = np.floor((centers - self.origin) / self.spacing).astype(np.int64)
+        # 离格点范围太远的球不会覆盖任何格点
+        near = np.all((base >= -k) & (base < shape + k), axis=1)
+        centers, base = centers[near], base[near]
+        edge = ~np.all((base >= k) & (base < shape - k), axis=1)
+
+        self._stamp_inside(centers[~edge], base[~edge], r, inner, shell)
+        self._stamp_clipped(centers[edge], base[edge], r, inner, shell, k)
+
+    def _stamp_inside(self, centers, base, r, inner, shell):
+        """所有偏移点都在格点范围内的球, 使用 flat 序号"""
+        strides = np.array([self.shape[1] * self.shape[2], self.shape[2], 1])
+        flat = base @ strides
+
+        step = max(1, _CHUNK_PAIRS // max(1, len(inner)))
+        for i in range(0, len(flat), step):
+            self._clear((flat[i : i + step, None] + inner @ strides).ravel())
+
+        step = max(1, _CHUNK_PAIRS // max(1, len(shell)))
+        for i in range(0, len(flat), step):
+            points = self.origin + (base[i : i + step, None, :] + shell) * self.spacing
+            d_ma = np.sum(np.square(centers[i : i + step, None, :] - points), axis=2)
+            self._clear((flat[i : i + step, None] + shell @ strides)[d_ma <= np.square(r)])
+
+    def _stamp_clipped(self, centers, base, r, inner, shell, k):
+        """靠近边界的球, 每个球为 (2k + 1)³ 的 bool 块, 只写入与格点范围相交的切片"""
+        cube = np.zeros((2 * k + 1,) * 3, dtype=bool)
+        cube[tuple((inner + k).T)] = True
+        shape = np.array(self.shape)
+        for center, b in zip(centers, base):
+            d_ma = np.sum(np.square(center - self.origin - (b + shell) * self.spacing), axis=1)
+            ball = cube.copy()
+            ball[tuple((shell[d_ma <= np.square(r)] + k).T)] = True
+
+            lo = b - k
+            start, stop = np.maximum(lo, 0), np.minimum(lo + 2 * k + 1, shape)
+            if np.any(start >= stop):
+                continue
+            target = tuple(slice(s, e) for s, e in zip(start, stop))
+            self.mask[target] &= ~ball[tuple(slice(s, e) for s, e in zip(start - lo, stop - lo))]
+
+    def _clear(self, flat):
+        """去除 flat 序号为 flat 的格点; mask 为其他格点的视图(见 cropped)时不连续, 换算为整数坐标"""
+        if self.mask.flags.c_contiguous:
+            self.mask.reshape(-1)[flat] = False
+        else:
+            self.mask[np.unravel_index(flat, self.shape)] = False
+
+    def discard_within(self, centers, radii):
+        """
+        与 remove_within 结果相同, 但逐个保留的格点查询最近的 center,
+        计算量与保留的格点数成正比, 适合保留的格点很少而球很大的情况
+        """
+        centers = np.asarray(centers, dtype="float64")[:, :3]
+        radii = np.broadcast_to(np.asarray(radii, dtype="float64"), (len(centers),))
+        idx = np.argwhere(self.mask)
+        points = self.origin + idx * self.spacing
+        for r in np.unique(radii):
+            hit = within_any(points, centers[radii == r], r, inclusive=True)
+            self.mask[tuple(idx[hit].T)] = False
+            idx, points = idx[~hit], points[~hit]
+
+    def label_within(self, centers, r, value):
+        """
+        与任一 center 距离小于 r 且未标记(标记为 0)的保留格点标记为 value
+        """
+        self.label_layers([(centers, r, value)])
+
+    def label_layers(self, shells):
+        """
+        一次完成所有层级的标记, 结果与依次调用 label_within 相同
+        shells: 按标记顺序排列的 (centers, r, value)
+        每层只需对未标记的格点做一次最近点查询, 已标记的格点不再参与后面的层级
+        """
+        idx = self.indices(self.mask & (self.labels == 0))
+        points = self.origin + idx * self.spacing
+        for centers, r, value in shells:
+            hit = within_any(points, centers, r)
+            self.labels[tuple(idx[hit].T)] = value
+            idx, points = idx[~hit], points[~hit]
+
+
+class BlockVoxelGrid:
+    """
+    只保存部分块的规则格点, 格点每 m×m×m 个为一块, 不分配完整的 mask
+    origin, spacing, shape: 同 VoxelGrid
+    m: 每块每个方向的格点数
+    blocks: {块的整数坐标: m×m×m 的 bool mask}, 不在其中的块没有保留的格点
+    """
+
+    def __init__(self, origin, spacing, shape, m, blocks=None):
+        self.origin = np.asarray(origin, dtype="float64")
+        self.spacing = spacing
+        self.shape = tuple(int(s) for s in shape)
+        self.m = m
+        self.blocks = {} if blocks is None else blocks
+
+    def indices(self):
+        """保留的格点的整数坐标, shape (N, 3), 顺序与 VoxelGrid.indices 相同"""
+        if not self.blocks:
+            return np.zeros((0, 3), dtype=np.int64)
+        keys = np.array(list(self.blocks), dtype=np.int64)
+        masks = np.stack(list(self.blocks.values())).reshape(len(keys), -1)
+        offsets = np.argwhere(np.ones((self.m,) * 3, dtype=bool))
+        b, o = np.nonzero(masks)
+        idx = keys[b] * self.m + offsets[o]
+        return idx[np.lexsort((idx[:, 2], idx[:, 0], idx[:, 1]))]
+
+    def coordinates(self):
+        """保留的格点坐标, shape (N, 3), 顺序与 gen_grid 相同"""
+        return self.origin + self.indices() * self.spacing
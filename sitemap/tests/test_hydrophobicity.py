@@ -2,10 +2,30 @@ import logging
 import math
 
 import numpy as np
-
-from sitemap.hydrophobicity.electrostatic import run_electrosatatic
-from sitemap.hydrophobicity.find_pocket import find_pocket
-from sitemap.hydrophobicity.hydrophobicity import run_hydro
+import pytest
+from sz_py_ext import Structure, run_hydrophobicity
+
+from sitemap.core import vdw_radii
+from sitemap.hydrophobicity.electrostatic import cal_electro_grid, get_charge, get_grids_elec, join, run_electrosatatic
+from sitemap.hydrophobicity.find_pocket import find_pocket, probe_radiis
+from sitemap.hydrophobicity.hydrophobicity import (
+    HYDRO_R2,
+    HYDRO_R2_CHOICES,
+    atom_hydro_map,
+    atomic_hydrophobicity,
+    cal_atoms_hydro,
+    cal_grids_hydro,
+    cal_hydro_atoms,
+    cal_waters_hydro,
+    cal_waters_hydro_fft,
+    find_within_radii_atoms,
+    find_within_radii_grids,
+    get_solvation_params,
+    hydro_cutoff,
+    run_hydro,
+    run_hydro_batch,
+    sample_map,
+)
 from sitemap.hydrophobicity.pdb_io import read_pdb, to_pdb
 
 logger = logging.getLogger(__name__)
@@ -32,11 +52,136 @@ def test_6fs6_run_hydro_rust():
     logging.info("test_6fs6_run_hydro_rust done ...")
 
 
+def test_get_solvation_params():
+    c, e, r = read_pdb(pdb_6fs6)
+    params = get_solvation_params(r, e)
+
+    # 与逐个原子查表的结果一致
+    for resn, atom, p in zip(r[:200], e[:200], params[:200]):
+        if atom in ("OXT", "NA"):
+            continue
+        index = np.where((atomic_hydrophobicity[:, 0] == resn) & (atomic_hydrophobicity[:, 1] == atom))
+        assert p == atomic_hydrophobicity[index, 2].ravel()[0]
+
+    assert get_solvation_params(["ALA", "GLY", "XXX"], ["OXT", "NA", "CA"]).tolist() == [-6, -12, 0]
+
+
+def test_cal_hydro_cell_list():
+    c, e, r = read_pdb(pdb_6fs6)
+    vdw = np.array([vdw_radii[x] for x in e])
+    params = get_solvation_params(r, e)
+    areas = np.random.default_rng(0).random(len(c)) * 10
+
+    # 原子附近的随机格点, 最后一列为 layer 值
+    rng = np.random.default_rng(1)
+    grids = c[rng.choice(len(c), 500)] + rng.normal(scale=3, size=(500, 3))
+    grids = np.insert(grids, 3, rng.choice(list(probe_radiis.values()), 500), axis=1)
+
+    atom_hydro = cal_atoms_hydro(grids, c, vdw, params * areas)
+    water_hydro = cal_waters_hydro(grids, grids)
+    for i, g in enumerate(grids[:100]):
+        felt_atoms = find_within_radii_atoms(g, c, e, r, areas, params, vdw)
+        assert math.isclose(atom_hydro[i], cal_hydro_atoms(felt_atoms), abs_tol=1e-9)
+        assert math.isclose(water_hydro[i], find_within_radii_grids(g, grids), abs_tol=1e-9)
+
+
+def test_atom_hydro_map():
+    c, e, r = read_pdb(pdb_6fs6)
+    vdw = np.array([vdw_radii[x] for x in e])
+    weights = get_solvation_params(r, e) * np.random.default_rng(0).random(len(c)) * 10
+
+    rng = np.random.default_rng(1)
+    grids = c[rng.choice(len(c), 500)] + rng.normal(scale=3, size=(500, 3))
+    exact = cal_atoms_hydro(grids, c, vdw, weights)
+
+    # 插值得到的近似值, 误差随 spacing 减小
+    errors = [np.mean(np.abs(sample_map(atom_hydro_map(c, vdw, weights, spacing=s), grids) - exact)) for s in (1, 0.5)]
+    assert errors[1] < errors[0]
+    assert errors[1] < 0.01 * np.max(np.abs(exact))
+
+    # 超出场的范围为 0
+    assert sample_map(atom_hydro_map(c, vdw, weights), [[1e4, 1e4, 1e4]])[0] == 0
+
+
+def test_cal_waters_hydro_fft():
+    # 规则格点上的随机 pocket, 最后一列为 layer 值
+    rng = np.random.default_rng(0)
+    grids = np.unique(rng.integers(0, 20, size=(3000, 3)), axis=0).astype("float64")
+    grids = np.insert(grids, 3, rng.choice(list(probe_radiis.values()), len(grids)), axis=1)
+
+    assert np.allclose(cal_waters_hydro_fft(grids, grids), cal_waters_hydro(grids, grids), rtol=0, atol=1e-9)
+
+    # 不在规则格点上时改用 cell list
+    grids[0, 0] += 0.3
+    assert cal_waters_hydro_fft(grids, grids) is None
+    assert np.allclose(cal_waters_hydro(grids, grids, method="fft"), cal_waters_hydro(grids, grids))
+
+
+def test_hydro_cutoff():
+    c, e, r = read_pdb(pdb_6fs6)
+    vdw = np.array([vdw_radii[x] for x in e])
+    weights = get_solvation_params(r, e) * np.random.default_rng(0).random(len(c)) * 10
+
+    rng = np.random.default_rng(1)
+    grids = c[rng.choice(len(c), 500)] + rng.normal(scale=3, size=(500, 3))
+    grids = np.insert(grids, 3, rng.choice(list(probe_radiis.values()), 500), axis=1)
+
+    # 误差要求很小时只能使用 9 Å, 误差要求很大时使用最小的截断距离
+    assert hydro_cutoff(grids, grids, c, vdw, weights, 1e-3) == (HYDRO_R2, 0.0)
+    r2, error = hydro_cutoff(grids, grids, c, vdw, weights, 1e4)
+    assert r2 == HYDRO_R2_CHOICES[0] and error <= 1e4
+
+    # 抽样包含所有格点时, 误差即实际运行的方法在所有格点上的误差
+    exact = cal_atoms_hydro(grids, c, vdw, weights) + cal_waters_hydro(grids, grids)
+    for tol in (5, 20):
+        # fft 的水贡献不截断, 只有原子的贡献有误差
+        r2, error = hydro_cutoff(grids, grids, c, vdw, weights, tol)
+        approx = cal_atoms_hydro(grids, c, vdw, weights, r2) + cal_waters_hydro(grids, grids)
+        assert error <= tol and np.isclose(error, np.max(np.abs(approx - exact)) * 0.1)
+
+        r2, error = hydro_cutoff(grids, grids, c, vdw, weights, tol, water_method="cell")
+        approx = cal_atoms_hydro(grids, c, vdw, weights, r2) + cal_waters_hydro(grids, grids, r2=r2)
+        assert error <= tol and np.isclose(error, np.max(np.abs(approx - exact)) * 0.1)
+
+    # map 不支持截断距离
+    sa = np.zeros((0, 4))
+    with pytest.raises(ValueError):
+        cal_grids_hydro(grids, c, e, r, sa, atom_method="map", tol=1)
+
+
 def test_run_hydro_rust():
     logging.info("test_run_hydro_rust...")
     run_hydro(pdb, dir="test", n=100)
 
 
+def test_run_hydro_tol():
+    # 设置 tol 时 rust 版与 python 版都返回 (格点及疏水性, 截断距离, 抽样估计的最大误差)
+    for enable_ext in (True, False):
+        exact = run_hydro(pdb_6fs6, n=40, enable_ext=enable_ext, save=False)
+        grid_hyo, cutoff, error = run_hydro(pdb_6fs6, n=40, enable_ext=enable_ext, tol=1e-3, save=False)
+        assert np.array_equal(grid_hyo[:, :3], exact[:, :3])
+        assert 4.5 <= cutoff <= np.sqrt(HYDRO_R2) and 0 <= error <= 1e-3
+
+
+def test_run_hydro_batch():
+    paths = [pdb_6fs6, pdb_4ey5]
+    results = dict(run_hydro_batch(paths, workers=2, n=100))
+    assert sorted(results) == sorted(paths)
+    for path in paths:
+        assert np.array_equal(results[path], run_hydro(path, n=100, save=False))
+
+
+def test_structure_sweep():
+    c, e, r = read_pdb(pdb_6fs6)
+    structure = Structure(c, e, 100)
+
+    # 同一个 Structure 依次扫描 pas_r, 已计算的 sa 平面复用, 结果与单独计算相同
+    for pas_r in (10.0, 15.0, 20.0):
+        expected = run_hydrophobicity(c, e, r, 100, pas_r, None, None)
+        assert np.array_equal(structure.hydrophobicity(r, pas_r, None), expected)
+        assert np.array_equal(structure.find_layer(pas_r)[:, :3], structure.find_pocket(pas_r))
+
+
 def test_4ey5_run_hydro_rust():
     pdb = pdb_4ey5
     logging.info("test_4ey5_run_hydro_rust...")
@@ -72,3 +217,10 @@ def test_run_electro():
     grids = find_pocket(c, e)
     elecs = run_electrosatatic(grids, c, e, r)
     to_pdb(grids, elecs, filename="test/test.pdb")
+
+
+def test_cal_electro_grid():
+    c, e, r = read_pdb(pdb_6fs6)
+    charged = get_charge(c, join(r, e))
+    grids = find_pocket(c, e)[:500]
+    assert np.allclose(cal_electro_grid(grids, charged), get_grids_elec(grids, charged), rtol=1e-12)
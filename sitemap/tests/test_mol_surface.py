@@ -1,10 +1,33 @@
 import logging
 
 import numpy as np
+import pytest
 
-from sitemap.hydrophobicity.find_pocket import find_pocket, layer_grids
-from sitemap.hydrophobicity.mol_surface import connolly_surface, sa_surface
+from sitemap.core import vdw_radii
+from sitemap.hydrophobicity.buriedness import buriedness
+from sitemap.hydrophobicity.find_pocket import (
+    find_pocket,
+    find_water,
+    gen_grid,
+    layer_grids,
+    pocket_search,
+    pocket_voxels,
+    pocket_voxels_adaptive,
+    sas_search_del,
+)
+from sitemap.hydrophobicity.grid_surface import distance_map, find_pocket_edt, sas_mask, ses_mask
+from sitemap.hydrophobicity.group_pocket import gen_isadjacent, group_pocket, group_pockets, score_pockets
+from sitemap.hydrophobicity.mol_surface import (
+    connolly_surface,
+    dot_counts,
+    dotsphere,
+    per_atom_sasa,
+    sa_surface,
+    sa_surface_multi,
+)
 from sitemap.hydrophobicity.pdb_io import read_pdb, to_xyz
+from sitemap.hydrophobicity.roi import Roi
+from sitemap.hydrophobicity.voxel_grid import VoxelGrid
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +48,226 @@ def test_sa_surface_rust(p=pdb):
     to_xyz(dots, filename="test/{}-{}-cs_rust.xyz".format(p.replace("/", "_"), n))
 
 
+def test_sa_surface_python_cell_list():
+    cs, es = c[:300], e[:300]
+    dots = sa_surface(cs, es, n=40, pr=1.4, enable_ext=False)
+
+    # 逐原子过滤所有点的原始算法作为参照
+    ref = np.zeros((len(cs) * 40, 4))
+    for i in range(cs.shape[0]):
+        r = vdw_radii[es[i]] + 1.4
+        ref[i * 40 : (i + 1) * 40] = np.insert(dotsphere(n=40) * r + cs[i], 3, i, axis=1)
+    for index, coor in enumerate(cs):
+        r = vdw_radii[es[index]] + 1.4
+        ref = ref[np.sum(np.square(coor - ref[:, :-1]), axis=1) > np.square(r - 0.001)]
+
+    logger.info("dots = %s", dots.shape)
+    assert np.array_equal(dots, ref)
+
+
+def test_per_atom_sasa_python():
+    cs, es = c[:300], e[:300]
+    dots = sa_surface(cs, es, n=40, pr=1.4, enable_ext=False)
+    sasa = per_atom_sasa(cs, es, n=40, pr=1.4, enable_ext=False)
+
+    assert sasa.shape == (300, 2)
+    for i in (0, 10, 150):
+        area = 4 * np.pi * np.square(vdw_radii[es[i]] + 1.4) / 40 * np.count_nonzero(dots[:, -1] == i)
+        assert np.isclose(sasa[i, 1], area)
+
+
+def test_per_atom_sasa_bitmask_rust():
+    sasa = per_atom_sasa(c, e, n=n, pr=1.4)
+    approx = per_atom_sasa(c, e, n=n, pr=1.4, bitmask=True)
+
+    assert approx.shape == sasa.shape
+    # 查表的量化误差只影响球冠边缘的少量点
+    assert np.max(np.abs(approx[:, 0] - sasa[:, 0])) < 0.05
+    assert np.isclose(np.sum(approx[:, 1]), np.sum(sasa[:, 1]), rtol=0.02)
+
+
+def test_bitmask_python():
+    # python 版没有 bitmask, 不能静默返回精确结果
+    with pytest.raises(ValueError):
+        sa_surface(c[:10], e[:10], bitmask=True, enable_ext=False)
+    with pytest.raises(ValueError):
+        per_atom_sasa(c[:10], e[:10], bitmask=True, enable_ext=False)
+
+
+def test_sa_surface_density_python():
+    cs, es = c[:300], e[:300]
+    radii = np.array([vdw_radii[x] for x in es]) + 1.4
+    counts = dot_counts(radii, 1.0)
+    assert np.all(counts >= np.minimum(4 * np.pi * np.square(radii), 1000))
+
+    # C, N, O, S 在 1.4 下都取 150 个点, 与固定 n=150 的结果一致
+    dots = sa_surface(cs, es, pr=1.4, enable_ext=False, density=1.0)
+    assert np.all(counts == 150)
+    assert np.array_equal(dots, sa_surface(cs, es, n=150, pr=1.4, enable_ext=False))
+
+    sasa = per_atom_sasa(cs, es, pr=1.4, enable_ext=False, density=1.0)
+    assert np.allclose(sasa[:, 0] * counts, np.bincount(dots[:, -1].astype(int), minlength=300))
+
+    dots, offsets = sa_surface_multi(cs, es, radii=[7.0, 2.1], enable_ext=False, density=1.0)
+    assert np.array_equal(dots[offsets[1] :], sa_surface(cs, es, pr=2.1, enable_ext=False, density=1.0))
+    # 大半径的层级取更多的点
+    assert offsets[1] > offsets[2] - offsets[1]
+
+
+def test_sa_surface_multi_python():
+    cs, es = c[:300], e[:300]
+    radii = [7.0, 2.1, 1.4, 20]
+    dots, offsets = sa_surface_multi(cs, es, n=40, radii=radii, enable_ext=False)
+
+    assert offsets[-1] == dots.shape[0]
+    for i, pr in enumerate(radii):
+        ref = sa_surface(cs, es, n=40, pr=pr, enable_ext=False)
+        assert np.array_equal(dots[offsets[i] : offsets[i + 1]], ref)
+
+
+def test_grid_surface():
+    cs, es = c[:300], e[:300]
+    voxels, k, dist = distance_map(cs, es, spacing=0.5, pad=1.4)
+
+    # 与到 vdw 表面的精确距离相同
+    grid = np.stack(np.meshgrid(*voxels.axes, indexing="ij"), axis=-1).reshape(-1, 3)[::97]
+    radii = np.array([vdw_radii[x] for x in es])
+    exact = np.min(np.sqrt(np.sum(np.square(grid[:, None, :] - cs[None, :, :]), axis=2)) - radii, axis=1)
+    assert np.allclose(dist.reshape(-1)[::97], np.maximum(exact, 0), rtol=0, atol=1e-9)
+
+    # vdw 体积 ⊂ SES ⊂ SAS
+    sas, ses = sas_mask(dist, 1.4), ses_mask(dist, 1.4, spacing=0.5)
+    assert np.all(ses[dist == 0]) and np.all(sas[ses])
+    assert np.count_nonzero(sas) > np.count_nonzero(ses) > np.count_nonzero(dist == 0)
+
+
+def test_voxel_grid():
+    cs, es = c[:300], e[:300]
+    radii = np.array([vdw_radii[x] for x in es])
+
+    grid = VoxelGrid.from_coors(cs, spacing=1)
+    assert np.array_equal(grid.coordinates(), gen_grid(cs, n=1))
+
+    # 球偏移印章与逐个原子计算距离的结果一致
+    grid.remove_within(cs, radii + 1.4)
+    ref = gen_grid(cs, n=1)
+    for coor, r in zip(cs, radii + 1.4):
+        ref = ref[np.sum(np.square(coor - ref), axis=1) > np.square(r)]
+    assert np.array_equal(grid.coordinates(), ref)
+    assert np.array_equal(sas_search_del(cs, es, gen_grid(cs, n=1), pr=1.4), ref)
+
+    grid.label_within(cs[:10], 4.0, -5)
+    labels = grid.to_array()[:, 3]
+    d = np.min(np.sum(np.square(ref[:, None, :] - cs[None, :10]), axis=2), axis=1)
+    assert np.array_equal(labels == -5, d < 16)
+
+
+def test_group_pockets():
+    grids = np.array([[0, 0, 0], [5, 5, 5], [1, 0, 0], [1, 1, 0], [5, 5, 6], [3, 0, 0], [1, 1, 1]], dtype=float)
+    ids, sizes = group_pockets(grids, enable_ext=False)
+    assert ids.tolist() == [0, 1, 0, 0, 1, 2, 0]
+    assert sizes.tolist() == [4, 2, 1]
+
+    # 与广度优先搜索的结果一致
+    pocket = find_pocket_edt(*read_pdb(pdb_6f6s)[:2])[:200]
+    ids, sizes = group_pockets(pocket, enable_ext=False)
+    groups = group_pocket(gen_isadjacent(pocket))
+    assert sorted(map(sorted, groups)) == sorted(np.nonzero(ids == i)[0].tolist() for i in range(len(sizes)))
+
+
+def test_score_pockets():
+    grids = np.array(
+        [[0, 0, 0, -993], [1, 0, 0, -5], [5, 5, 5, 0], [1, 1, 0, -993], [5, 5, 6, -993], [1, 1, 1, -19]], dtype=float
+    )
+    ids, sizes = group_pockets(grids, enable_ext=False)
+    table = score_pockets(ids, grids, np.array([1.0, 2.0, -1.0, 3.0, 0.0, 2.0]))
+    assert table["pocket"].tolist() == [0, 1]
+    assert table["size"].tolist() == [4, 2]
+    assert np.allclose(table["enclosure"], [0.5, 0.5])
+    assert np.allclose(table["depth"], [(7 + 6) / 8 / 4, 1 / 2])
+    assert np.allclose(table["hydrophobicity"], [2.0, -0.5])
+    assert np.allclose(table["size_enclosure_score"], 0.0733 * np.sqrt([4, 2]) + 0.6688 * 0.5)
+    assert "buriedness" not in table
+
+    # 设置 buried 时增加 buriedness 一列, depth 不变
+    table = score_pockets(ids, grids, np.zeros(6), buried=np.array([0.5, 1.0, 0.2, 0.5, 0.4, 1.0]))
+    assert np.allclose(table["buriedness"], [0.75, 0.3])
+    assert np.allclose(table["depth"], [(7 + 6) / 8 / 4, 1 / 2])
+
+
+def test_layer_grids_roi():
+    c, e, r = read_pdb(pdb_6f6s)
+    full = layer_grids(c, e, n=40, enable_ext=False)
+    center = full[len(full) // 2, :3]
+
+    # roi 内的结果与全蛋白计算相同
+    for roi in [Roi.sphere(center, 8.0), Roi.box(center - 5, center + 7)]:
+        grids = layer_grids(c, e, n=40, enable_ext=False, roi=roi)
+        assert np.array_equal(grids, full[roi.contains(full)])
+        assert np.array_equal(find_pocket(c, e, n=40, enable_ext=False, roi=roi), grids[:, :3])
+
+
+def test_find_pocket_adaptive():
+    c, e, r = read_pdb(pdb_6f6s)
+    # 先粗后细的结果与直接使用细格点相同
+    for spacing, coarse in [(1, 3), (0.5, 2)]:
+        dense = find_pocket(c, e, n=40, enable_ext=False, spacing=spacing)
+        grids = find_pocket(c, e, n=40, enable_ext=False, spacing=spacing, coarse=coarse)
+        logger.info("spacing = %s, grids = %s", spacing, grids.shape)
+        assert np.array_equal(dense, grids)
+
+    # rust 版没有先粗后细, 格点间距固定为 1, 不能静默忽略 coarse 和 spacing
+    with pytest.raises(ValueError):
+        find_pocket(c, e, coarse=3)
+    with pytest.raises(ValueError):
+        find_pocket(c, e, spacing=0.5)
+
+    # 只保存还有 pocket 格点的块, 6FS6 上约为完整细格点的 30%
+    blocks = pocket_voxels_adaptive(c, e, n=40, spacing=0.5, coarse=2)
+    assert len(blocks.blocks) * blocks.m ** 3 < 0.5 * np.prod(blocks.shape)
+
+
+def test_find_water():
+    c, e, r = read_pdb(pdb_6f6s)
+    water, pocket = find_water(c, e, distance=True)
+    logger.info("water = %s, pocket = %s", water.shape, pocket.shape)
+
+    # 与逐个 pocket 格点过滤的结果一致
+    grids = gen_grid(c, n=3, buffer=6)
+    ref = grids
+    for point in pocket[:500]:
+        ref = ref[np.sum(np.square(point - ref), axis=1) > 1.0]
+    assert np.array_equal(pocket_search(grids, pocket[:500]), ref)
+
+    d = np.sqrt(np.min(np.sum(np.square(water[:, None, :3] - c[None]), axis=2), axis=1))
+    assert np.allclose(water[:, 3], d)
+
+
+def test_buriedness():
+    c, e, r = read_pdb(pdb_6f6s)
+    grids = find_pocket_edt(c, e)
+    far = np.array([[c[:, 0].max() + 25, c[:, 1].mean(), c[:, 2].mean()]])
+    grids = np.vstack([grids, far])
+
+    b = buriedness(c, e, grids, n=30, enable_ext=False)
+    logger.info("buriedness = %s", b.mean())
+    assert np.all((b >= 0) & (b <= 1)) and b[-1] == 0
+    assert np.allclose(buriedness(c, e, grids, n=30), b)
+
+
+def test_find_pocket_edt():
+    c, e, r = read_pdb(pdb_6f6s)
+    grids = find_pocket_edt(c, e, spacing=1, pas_r=20)
+    logger.info("grids = %s", grids.shape)
+    assert grids.shape[1] == 3 and grids.shape[0] > 0
+
+    # 球面取点足够密时, 点集版 pocket 收敛到格点版的结果, 两者格点位置相同
+    # 6FS6 上不一致的格点 n=1000 时约为 6%, n=3000 时约为 4.5%, 主要来自点集版球面点之间的空隙
+    ref = set(map(tuple, pocket_voxels(c, e, n=1000, pas_r=20).coordinates()))
+    edt = set(map(tuple, grids))
+    assert len(ref ^ edt) < 0.08 * len(ref | edt)
+
+
 # 运行太慢注释
 # def test_sa_surface_python(p=pdb):
 #     c, e, r = read_pdb(p)
@@ -48,6 +291,16 @@ def test_connolly_surface_python(p=pdb):
     )
 
 
+def test_connolly_surface_rust_python(p=pdb):
+    # rust 与 python 版的 connolly surface 一致
+    c, e, r = read_pdb(p)
+    rust = connolly_surface(c, e, n=20, pr=1.4)
+    python = connolly_surface(c, e, n=20, pr=1.4, enable_ext=False)
+    assert rust.shape[1] == python.shape[1] == 4
+    assert abs(len(rust) - len(python)) <= 0.005 * len(python)
+    assert np.allclose(rust[:, :3].mean(axis=0), python[:, :3].mean(axis=0), atol=1e-2)
+
+
 def test_connolly_surface():
     coor = np.array([[0, 0, 0], [0, 0, 2.7]])
     elements = np.array(["C", "O"])